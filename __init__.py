@@ -1,7 +1,21 @@
 from list import *
 from delete import *
 from create import *
+from update import *
 from stop import *
 from network import *
 from state import *
-from provision import *
\ No newline at end of file
+from provision import *
+from plan import *
+from output import *
+from yamlio import *
+from scheduler import *
+from executor import *
+from waiter import *
+from clients import *
+from state_sqlite import *
+from ami import *
+from inventory import *
+from snapshot import *
+from metrics import *
+from tracing import *
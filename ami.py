@@ -0,0 +1,244 @@
+import contextlib
+import json
+import os
+import sqlite3
+import sys
+import time
+from clients import get_client, get_session
+from list import ListManager
+
+# Image owners and architectures the catalog is built from: Amazon (Amazon Linux,
+# Windows), Canonical (Ubuntu), Debian and Red Hat.
+DEFAULT_OWNERS = ['amazon', '099720109477', '136693071363', '309956199498']
+DEFAULT_ARCHITECTURES = ['x86_64', 'arm64']
+
+CATALOG_DIR = os.environ.get('SARMASTACK_AMI_CATALOG_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'sarmastack', 'ami'))
+# Seconds a catalog is used before it is refreshed from describe_images, unless
+# SARMASTACK_AMI_TTL says otherwise.
+CATALOG_TTL = 24 * 3600
+
+# Substrings of an image's name, checked in order, that identify its OS.
+OS_PATTERNS = [
+    ('windows', 'windows'),
+    ('ubuntu', 'ubuntu'),
+    ('debian', 'debian'),
+    ('al2023', 'amazon-linux'),
+    ('amzn', 'amazon-linux'),
+    ('rhel', 'rhel'),
+    ('suse', 'suse'),
+    ('centos', 'centos'),
+    ('fedora', 'fedora'),
+]
+
+# suggest-ami --filter-name values the catalog can answer, and the column each one
+# matches (with EC2's '*' and '?' wildcards). Any other EC2 filter is answered by
+# search_live instead.
+CATALOG_FILTERS = {
+    'name': 'name',
+    'image-id': 'image_id',
+    'architecture': 'architecture',
+    'owner-id': 'owner',
+    'platform-details': 'platform',
+}
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS images (
+    image_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    os TEXT NOT NULL,
+    architecture TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    platform TEXT,
+    creation_date TEXT NOT NULL,
+    description TEXT
+);
+CREATE INDEX IF NOT EXISTS images_by_name ON images (name);
+CREATE INDEX IF NOT EXISTS images_by_os ON images (os, creation_date);
+CREATE INDEX IF NOT EXISTS images_by_creation_date ON images (creation_date);
+CREATE TABLE IF NOT EXISTS catalog (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+'''
+
+IMAGE_COLUMNS = ['image_id', 'name', 'os', 'architecture', 'owner', 'platform', 'creation_date', 'description']
+
+
+def image_row(image):
+    return (
+        image['ImageId'],
+        image.get('Name') or '',
+        image_os(image),
+        image.get('Architecture') or '',
+        image.get('ImageOwnerAlias') or image.get('OwnerId') or '',
+        image.get('PlatformDetails'),
+        image.get('CreationDate') or '',
+        image.get('Description'),
+    )
+
+
+# Whether the catalog holds every image the filters could match: it only has the
+# default owners' images, so other filter names, and owner-id filters naming
+# anyone else (e.g. the account's own private AMIs), need a live describe_images.
+def catalog_can_answer(filters):
+    for filter_name, values in (filters or {}).items():
+        if filter_name not in CATALOG_FILTERS:
+            return False
+        if filter_name == 'owner-id' and not set(values) <= set(DEFAULT_OWNERS):
+            return False
+    return True
+
+
+# Same results as AmiCatalog.search, straight from describe_images. Like EC2 itself
+# with no owner given, it covers every image the account can see: public, shared
+# and its own.
+def search_live(region=None, name_prefix=None, os_name=None, architecture=None, filters=None, limit=10):
+    ec2_client = get_client('ec2', region)
+    ec2_filters = [{'Name': filter_name, 'Values': list(values)} for filter_name, values in (filters or {}).items()]
+    if name_prefix:
+        ec2_filters.append({'Name': 'name', 'Values': [name_prefix + '*']})
+    if architecture:
+        ec2_filters.append({'Name': 'architecture', 'Values': [architecture]})
+    images = []
+    for page in ListManager.iter_pages(ec2_client, 'describe_images', Filters=ec2_filters):
+        for image in page['Images']:
+            row = dict(zip(IMAGE_COLUMNS, image_row(image)))
+            if not os_name or row['os'] == os_name:
+                images.append(row)
+    images.sort(key=lambda image: image['creation_date'], reverse=True)
+    return images[:limit] if limit else images
+
+
+def image_os(image):
+    platform = (image.get('PlatformDetails') or image.get('Platform') or '').lower()
+    if 'windows' in platform:
+        return 'windows'
+    name = (image.get('Name') or '').lower()
+    for pattern, os_name in OS_PATTERNS:
+        if pattern in name:
+            return os_name
+    return 'linux' if 'linux' in platform else 'other'
+
+
+# SARMASTACK_AMI_TTL is read when a catalog is opened, not at import, so a bad value
+# only affects suggest-ami, which warns and uses CATALOG_TTL.
+def catalog_ttl():
+    value = os.environ.get('SARMASTACK_AMI_TTL')
+    if value is None:
+        return CATALOG_TTL
+    try:
+        return float(value)
+    except ValueError:
+        print(f"Ignoring SARMASTACK_AMI_TTL={value!r}: not a number of seconds. Using {CATALOG_TTL}.", file=sys.stderr)
+        return CATALOG_TTL
+
+
+# Local, per-region catalog of public AMIs in SQLite. It is refreshed with one
+# paginated, owner- and architecture-filtered describe_images pass at most once per
+# TTL; every lookup after that is an indexed query that needs no AWS access.
+class AmiCatalog:
+    def __init__(self, region=None, owners=None, architectures=None, ttl=None):
+        # The region is only looked up through boto3 when it is not in the
+        # environment, so answering from a fresh catalog stays cheap.
+        self.region = region or os.environ.get('AWS_REGION') or os.environ.get('AWS_DEFAULT_REGION') or get_session().region_name
+        if not self.region:
+            raise ValueError("No AWS region configured; pass --region or set AWS_REGION.")
+        self.owners = owners or DEFAULT_OWNERS
+        self.architectures = architectures or DEFAULT_ARCHITECTURES
+        self.ttl = catalog_ttl() if ttl is None else ttl
+        self.path = os.path.join(CATALOG_DIR, f'{self.region}.db')
+        os.makedirs(CATALOG_DIR, exist_ok=True)
+        self.connection = sqlite3.connect(self.path, isolation_level=None)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def metadata(self, key):
+        row = self.connection.execute('SELECT value FROM catalog WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    # Seconds since the last refresh, or None if the catalog was never filled or
+    # was filled for other owners or architectures.
+    def age(self):
+        if self.metadata('owners') != sorted(self.owners) or self.metadata('architectures') != sorted(self.architectures):
+            return None
+        refreshed_at = self.metadata('refreshed_at')
+        return time.time() - refreshed_at if refreshed_at else None
+
+    def is_fresh(self):
+        age = self.age()
+        return age is not None and age < self.ttl
+
+    def refresh(self):
+        ec2_client = get_client('ec2', self.region)
+        filters = [
+            {'Name': 'architecture', 'Values': self.architectures},
+            {'Name': 'state', 'Values': ['available']},
+            {'Name': 'image-type', 'Values': ['machine']},
+        ]
+        rows = []
+        for page in ListManager.iter_pages(ec2_client, 'describe_images', Owners=self.owners, Filters=filters):
+            rows.extend(image_row(image) for image in page['Images'])
+
+        with self.transaction() as connection:
+            connection.execute('DELETE FROM images')
+            connection.executemany(f"INSERT OR REPLACE INTO images ({', '.join(IMAGE_COLUMNS)}) VALUES ({', '.join('?' * len(IMAGE_COLUMNS))})", rows)
+            for key, value in [('owners', sorted(self.owners)), ('architectures', sorted(self.architectures)), ('refreshed_at', time.time())]:
+                connection.execute('INSERT OR REPLACE INTO catalog (key, value) VALUES (?, ?)', (key, json.dumps(value)))
+        return len(rows)
+
+    # Refreshes the catalog if it is stale (or if forced). A failed refresh falls back
+    # to whatever the catalog already holds.
+    def ensure_fresh(self, force=False):
+        if not force and self.is_fresh():
+            return
+        try:
+            count = self.refresh()
+            print(f"Refreshed AMI catalog for {self.region}: {count} images.")
+        except Exception as e:
+            if self.metadata('refreshed_at') is None:
+                raise
+            print(f"Could not refresh AMI catalog for {self.region}, using the cached one: {str(e)}")
+
+    # Newest images first. name_prefix uses the name index; filters maps
+    # CATALOG_FILTERS names to lists of EC2-style wildcard patterns.
+    def search(self, name_prefix=None, os_name=None, architecture=None, filters=None, limit=10):
+        conditions = []
+        params = []
+        if name_prefix:
+            conditions.append('name >= ? AND name < ?')
+            params += [name_prefix, name_prefix + '\uffff']
+        if os_name:
+            conditions.append('os = ?')
+            params.append(os_name)
+        if architecture:
+            conditions.append('architecture = ?')
+            params.append(architecture)
+        for filter_name, values in (filters or {}).items():
+            column = CATALOG_FILTERS[filter_name]
+            conditions.append('(' + ' OR '.join(f'{column} GLOB ?' for _ in values) + ')')
+            params += values
+
+        query = f"SELECT {', '.join(IMAGE_COLUMNS)} FROM images"
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY creation_date DESC'
+        if limit:
+            query += ' LIMIT ?'
+            params.append(limit)
+        return [dict(zip(IMAGE_COLUMNS, row)) for row in self.connection.execute(query, params)]
+
+    def newest(self, **kwargs):
+        images = self.search(limit=1, **kwargs)
+        return images[0] if images else None
+
+    @contextlib.contextmanager
+    def transaction(self):
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        self.connection.execute('COMMIT')
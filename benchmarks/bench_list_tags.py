@@ -0,0 +1,58 @@
+# Counts EC2 API calls made by each ListManager.list_* command as the number of
+# rows grows. The count must stay flat: one describe call per command, no
+# per-row describe_tags.
+#
+#   python benchmarks/bench_list_tags.py
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Listings read with refresh=True are still written to the inventory cache, which
+# is located at import time; keep the fake rows out of the user's own cache.
+INVENTORY_DIR = tempfile.TemporaryDirectory()
+os.environ['SARMASTACK_INVENTORY_DIR'] = INVENTORY_DIR.name
+
+from tabulate import tabulate
+from fakeaws import FakeEC2, make_client
+from inventory import Inventory
+from list import ListManager
+
+SIZES = [10, 100, 1000, 2000]
+COMMANDS = ['list_instances', 'list_vpcs', 'list_subnets', 'list_route_tables', 'list_internet_gateways']
+
+
+def run(size):
+    results = []
+    for command in COMMANDS:
+        fake = FakeEC2(size)
+        manager = ListManager(Inventory(refresh=True))
+        manager.ec2_client = fake.attach(make_client('ec2'))
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            getattr(manager, command)()
+        elapsed = time.perf_counter() - start
+        results.append([command, size, sum(fake.calls.values()), fake.calls['DescribeTags'], f"{elapsed:.3f}"])
+    return results
+
+
+def main():
+    table_data = []
+    for size in SIZES:
+        table_data.extend(run(size))
+
+    headers = ['Command', 'Rows', 'API Calls', 'DescribeTags Calls', 'Seconds']
+    print(tabulate(table_data, headers, tablefmt="fancy_grid"))
+
+    flat = all(row[2] == 1 for row in table_data)
+    print("Call count is flat." if flat else "Call count grows with row count!")
+    return 0 if flat else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
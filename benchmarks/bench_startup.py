@@ -0,0 +1,81 @@
+# Measures CLI startup: total import time of sarmastack.py (python -X importtime)
+# and wall-clock time for each subcommand's --help, which parses arguments and
+# exits without touching AWS.
+#
+#   python benchmarks/bench_startup.py [--runs N] [--json]
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLI = os.path.join(ROOT, 'sarmastack.py')
+
+SUBCOMMANDS = [
+    [],
+    ['start'],
+    ['provision'],
+    ['create-instance'],
+    ['list-instances'],
+    ['list-buckets'],
+    ['delete-vpc'],
+    ['network'],
+    ['suggest-ami'],
+]
+
+
+def import_time(args):
+    result = subprocess.run([sys.executable, '-X', 'importtime', CLI] + args + ['--help'],
+                            capture_output=True, text=True, cwd=ROOT)
+    total = 0
+    heaviest = []
+    for line in result.stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)', line)
+        if match and not match.group(3):
+            total += int(match.group(2))
+            heaviest.append((int(match.group(2)), match.group(4)))
+    heaviest.sort(reverse=True)
+    return total / 1000, [name for _, name in heaviest[:3]]
+
+
+def wall_time(args, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, CLI] + args + ['--help'], capture_output=True, cwd=ROOT)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SarmaStack startup benchmark')
+    parser.add_argument('--runs', type=int, default=5, help='Runs per subcommand')
+    parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+    options = parser.parse_args()
+
+    results = []
+    for args in SUBCOMMANDS:
+        imports_ms, heaviest = import_time(args)
+        results.append({
+            'command': ' '.join(args) or '(none)',
+            'import_ms': round(imports_ms, 1),
+            'wall_ms': round(wall_time(args, options.runs), 1),
+            'heaviest_imports': heaviest,
+        })
+
+    if options.json:
+        print(json.dumps(results, indent=2))
+    else:
+        from tabulate import tabulate
+        table_data = [[r['command'], r['import_ms'], r['wall_ms'], ', '.join(r['heaviest_imports'])] for r in results]
+        headers = ['Command', 'Import ms', 'Wall ms (median)', 'Heaviest Imports']
+        print(tabulate(table_data, headers, tablefmt="fancy_grid"))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+# Offline benchmark suite: drives provision, every ListManager.list_* command, the
+# DeleteManager bulk paths (delete-bucket --force, delete-vpc --cascade) and both
+# state backends against fakeaws.FakeAWS at growing sizes, with injected per-call
+# latency and throttling. Each (scenario, size) runs in a fresh interpreter, so the
+# peak RSS reported is its own. Reports wall time, API calls, throttled calls,
+# peak RSS and state-file bytes; --json/--out give machine-readable results, and
+# --baseline compares against an earlier --out file (exit status 1 on regression).
+#
+#   python benchmarks/bench_suite.py [--sizes 10 100 1000 10000] [--scenarios ...]
+#       [--latency-ms 5] [--jitter-ms 0] [--throttle-rate 0] [--keep-rate-limits]
+#       [--json] [--out results.json] [--baseline results.json] [--tolerance 0.2]
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+LIST_COMMANDS = ['list_buckets', 'list_iam_users', 'list_iam_roles', 'list_instances', 'list_vpcs',
+                 'list_subnets', 'list_route_tables', 'list_internet_gateways']
+SCENARIOS = ['provision'] + LIST_COMMANDS + ['delete_bucket_force', 'delete_vpc_cascade', 'state_yaml', 'state_sqlite']
+# Rates high enough that the engine never waits on its token buckets, so the
+# results measure SarmaStack rather than AWS's documented limits.
+UNLIMITED_RATES = {service: (1e6, 1e6) for service in ['ec2', 's3', 'iam', 'sts']}
+
+
+def fake_aws(options):
+    from fakeaws import FakeAWS
+    return FakeAWS(options.latency_ms / 1000, options.jitter_ms / 1000, options.throttle_rate)
+
+
+def configure_engine(options):
+    from executor import get_engine
+    if not options.keep_rate_limits:
+        get_engine().configure(rates=UNLIMITED_RATES)
+
+
+def file_bytes(*paths):
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+
+def bench_provision(size, options, workdir):
+    from provision import provision
+    from yamlio import safe_dump
+    fake = fake_aws(options).install()
+    instances = size * 6 // 10
+    buckets = size * 2 // 10
+    users = size - instances - buckets
+    data = {
+        'instances': [{'instance_name': f'web-{i}', 'instance_type': 't3.micro', 'image_id': 'ami-0123456789abcdef0'}
+                      for i in range(instances)],
+        'buckets': [{'bucket_name': f'bench-bucket-{i}', 'region': 'us-east-1'} for i in range(buckets)],
+        'resources': [{'type': 'iam_user', 'user_name': f'user-{i}'} for i in range(users)],
+    }
+    path = os.path.join(workdir, 'infrastructure.yaml')
+    with open(path, 'w') as f:
+        safe_dump(data, f)
+    state_file = os.path.join(workdir, 'state.srstate')
+
+    args = {'file': path, 'state_file': state_file, 'workers': 8}
+    if not options.keep_rate_limits:
+        args['rate_limits'] = UNLIMITED_RATES
+    start = time.perf_counter()
+    provision(args)
+    elapsed = time.perf_counter() - start
+    return elapsed, fake, file_bytes(state_file, state_file + '.journal')
+
+
+def bench_list(command, size, options, workdir):
+    from inventory import Inventory
+    from list import ListManager
+    fake = fake_aws(options).populate(size).install()
+    configure_engine(options)
+    manager = ListManager(Inventory(refresh=True))
+    start = time.perf_counter()
+    getattr(manager, command)()
+    return time.perf_counter() - start, fake, None
+
+
+def bench_delete_bucket_force(size, options, workdir):
+    from delete import DeleteManager
+    fake = fake_aws(options).populate_objects('bench-bucket', size).install()
+    configure_engine(options)
+    start = time.perf_counter()
+    DeleteManager().force_delete_buckets(['bench-bucket'])
+    return time.perf_counter() - start, fake, None
+
+
+def bench_delete_vpc_cascade(size, options, workdir):
+    from delete import DeleteManager
+    fake = fake_aws(options).populate_vpc('vpc-00000001', size).install()
+    configure_engine(options)
+    start = time.perf_counter()
+    DeleteManager().cascade_delete_vpc('vpc-00000001')
+    return time.perf_counter() - start, fake, None
+
+
+# Records 'size' instances one by one (as provision's state writer does), saves,
+# and loads the file again.
+def bench_state(backend, size, options, workdir):
+    from state import open_state_tracker
+    state_file = os.path.join(workdir, 'state.srstate.db' if backend == 'sqlite' else 'state.srstate')
+    start = time.perf_counter()
+    state_tracker = open_state_tracker(state_file, backend)
+    for i in range(size):
+        state_tracker.update_resource_state('instances', f'web-{i}', {'instance_id': f'i-{i:017x}', 'spec_hash': f'{i:064x}'})
+    state_tracker.save_state()
+    open_state_tracker(state_file, backend).get_resource_state('instances', 'web-0')
+    elapsed = time.perf_counter() - start
+    return elapsed, None, file_bytes(state_file, state_file + '.journal', state_file + '-wal')
+
+
+def run_scenario(scenario, size, options):
+    with tempfile.TemporaryDirectory() as workdir:
+        # Parsed YAML is cached by path; a fresh directory per run keeps it cold.
+        # Listings are cached too, and every create or delete call drops cached
+        # listings, so the inventory cache lives here as well rather than in the
+        # user's own.
+        os.environ['SARMASTACK_CACHE_DIR'] = os.path.join(workdir, 'yaml-cache')
+        os.environ['SARMASTACK_INVENTORY_DIR'] = os.path.join(workdir, 'inventory')
+        with contextlib.redirect_stdout(io.StringIO()):
+            if scenario == 'provision':
+                elapsed, fake, state_bytes = bench_provision(size, options, workdir)
+            elif scenario in LIST_COMMANDS:
+                elapsed, fake, state_bytes = bench_list(scenario, size, options, workdir)
+            elif scenario == 'delete_bucket_force':
+                elapsed, fake, state_bytes = bench_delete_bucket_force(size, options, workdir)
+            elif scenario == 'delete_vpc_cascade':
+                elapsed, fake, state_bytes = bench_delete_vpc_cascade(size, options, workdir)
+            else:
+                elapsed, fake, state_bytes = bench_state(scenario.split('_', 1)[1], size, options, workdir)
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak_rss //= 1024
+    return {
+        'scenario': scenario,
+        'size': size,
+        'wall_seconds': round(elapsed, 4),
+        'api_calls': sum(fake.calls.values()) if fake else 0,
+        'throttled_calls': fake.throttled if fake else 0,
+        'calls_by_operation': dict(fake.calls) if fake else {},
+        'peak_rss_kb': peak_rss,
+        'state_bytes': state_bytes,
+        'latency_ms': options.latency_ms,
+        'throttle_rate': options.throttle_rate,
+    }
+
+
+def run_child(scenario, size, options):
+    command = [sys.executable, os.path.abspath(__file__), '--child', scenario, str(size),
+               '--latency-ms', str(options.latency_ms), '--jitter-ms', str(options.jitter_ms),
+               '--throttle-rate', str(options.throttle_rate)]
+    if options.keep_rate_limits:
+        command.append('--keep-rate-limits')
+    result = subprocess.run(command, capture_output=True, text=True, cwd=ROOT)
+    if result.returncode != 0:
+        return {'scenario': scenario, 'size': size, 'error': result.stderr.strip().splitlines()[-1] if result.stderr else 'failed'}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+# Results slower than the baseline by more than 'tolerance', or making more API
+# calls, are regressions.
+def compare(results, baseline, tolerance):
+    previous = {(record['scenario'], record['size']): record for record in baseline}
+    regressions = []
+    for record in results:
+        before = previous.get((record['scenario'], record['size']))
+        if not before or 'error' in record or 'error' in before:
+            continue
+        if record['wall_seconds'] > before['wall_seconds'] * (1 + tolerance):
+            regressions.append(f"{record['scenario']} @ {record['size']}: {before['wall_seconds']}s -> {record['wall_seconds']}s")
+        if record['api_calls'] > before['api_calls']:
+            regressions.append(f"{record['scenario']} @ {record['size']}: {before['api_calls']} -> {record['api_calls']} API calls")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SarmaStack offline benchmark suite')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='Resource counts to run')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS, help='Scenarios to run')
+    parser.add_argument('--latency-ms', type=float, default=5, help='Latency added to every API call')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='Up to this much extra random latency per call')
+    parser.add_argument('--throttle-rate', type=float, default=0, help='Fraction of calls that fail with Throttling')
+    parser.add_argument('--keep-rate-limits', action='store_true', help="Keep the engine's default per-service rate limits")
+    parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+    parser.add_argument('--out', help='Write the results to this JSON file')
+    parser.add_argument('--baseline', help='Compare with results written earlier by --out')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed wall-time increase over the baseline')
+    parser.add_argument('--child', nargs=2, metavar=('SCENARIO', 'SIZE'), help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.child:
+        print(json.dumps(run_scenario(options.child[0], int(options.child[1]), options)))
+        return 0
+
+    results = [run_child(scenario, size, options) for size in options.sizes for scenario in options.scenarios]
+
+    if options.out:
+        with open(options.out, 'w') as f:
+            json.dump(results, f, indent=2)
+    if options.json:
+        print(json.dumps(results, indent=2))
+    else:
+        from tabulate import tabulate
+        table_data = [[r['scenario'], r['size'], r.get('wall_seconds', '-'), r.get('api_calls', '-'), r.get('throttled_calls', '-'),
+                       r.get('peak_rss_kb', '-'), r.get('state_bytes') or '-', r.get('error', '')] for r in results]
+        headers = ['Scenario', 'Size', 'Seconds', 'API Calls', 'Throttled', 'Peak RSS KB', 'State Bytes', 'Error']
+        print(tabulate(table_data, headers, tablefmt="fancy_grid"))
+
+    if options.baseline:
+        with open(options.baseline, 'r') as f:
+            regressions = compare(results, json.load(f), options.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+# Measures YAML loading for infrastructure and state files of growing size: the
+# pure-Python loader, libyaml's C loader, and yamlio.load_file on a warm cache
+# (an unchanged file whose parsed form is already cached).
+#
+#   python benchmarks/bench_yaml.py [--sizes 100 1000 10000] [--runs N] [--json]
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import yaml
+
+DEFAULT_SIZES = [100, 1000, 10000]
+
+
+def infrastructure(size):
+    return {
+        'instances': [
+            {
+                'instance_name': f'web-{i}',
+                'instance_type': 't3.micro',
+                'image_id': 'ami-053b0d53c279acc90',
+                'subnet_id': f'subnet-{i % 16:04d}',
+                'security_group_ids': ['sg-0123456789abcdef0'],
+                'depends_on': [f'app-policy-{i % 8}'],
+            }
+            for i in range(size)
+        ],
+        'resources': [
+            {'type': 'iam_policy', 'policy_name': f'app-policy-{i}', 'policy_document': {
+                'Version': '2012-10-17',
+                'Statement': [{'Effect': 'Allow', 'Action': ['s3:GetObject'], 'Resource': '*'}],
+            }}
+            for i in range(8)
+        ],
+    }
+
+
+def state(size):
+    return {'instances': {f'web-{i}': {'instance_id': f'i-{i:017x}', 'spec_hash': f'{i:064x}'} for i in range(size)}}
+
+
+def timed(function, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SarmaStack YAML loading benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='Resources per file')
+    parser.add_argument('--runs', type=int, default=3, help='Runs per measurement')
+    parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ['SARMASTACK_CACHE_DIR'] = os.path.join(directory, 'cache')
+        import yamlio
+
+        results = []
+        for kind, build in [('infrastructure', infrastructure), ('state', state)]:
+            for size in options.sizes:
+                path = os.path.join(directory, f'{kind}-{size}.yaml')
+                with open(path, 'w') as f:
+                    yaml.safe_dump(build(size), f)
+
+                def load(loader):
+                    with open(path, 'r') as f:
+                        return yaml.load(f, Loader=loader)
+
+                yamlio.load_file(path)
+                results.append({
+                    'file': kind,
+                    'resources': size,
+                    'size_kb': round(os.path.getsize(path) / 1024),
+                    'python_ms': round(timed(lambda: load(yaml.SafeLoader), options.runs), 1),
+                    'libyaml_ms': round(timed(lambda: load(yamlio.SafeLoader), options.runs), 1),
+                    'cached_ms': round(timed(lambda: yamlio.load_file(path), options.runs), 1),
+                })
+
+    if options.json:
+        print(json.dumps(results, indent=2))
+    else:
+        from tabulate import tabulate
+        table_data = [[r['file'], r['resources'], r['size_kb'], r['python_ms'], r['libyaml_ms'], r['cached_ms']] for r in results]
+        headers = ['File', 'Resources', 'KB', 'Pure Python ms', 'libyaml ms', 'Cached ms']
+        print(tabulate(table_data, headers, tablefmt="fancy_grid"))
+        if yamlio.SafeLoader is yaml.SafeLoader:
+            print("libyaml is not available; the libyaml column uses the pure-Python loader.")
+
+
+if __name__ == '__main__':
+    main()
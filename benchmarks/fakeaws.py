@@ -0,0 +1,338 @@
+# In-process stand-in for the AWS APIs used by the benchmarks.
+# Handlers are registered on a client's 'before-call' event, which botocore treats
+# as a short-circuit: whatever the handler returns is used as the parsed response
+# and no HTTP request is ever made.
+
+import collections
+import datetime
+import os
+import random
+import threading
+import time
+from botocore.awsrequest import AWSResponse
+from botocore import xform_name
+
+# Managers build their clients from the ambient configuration; make sure that never
+# reaches for real credentials or fails for lack of a region.
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+
+class FakeEC2:
+    def __init__(self, count=0):
+        self.calls = collections.Counter()
+        launch_time = datetime.datetime(2023, 1, 1)
+        self.vpcs = [
+            {'VpcId': f'vpc-{i:08x}', 'CidrBlock': '10.0.0.0/16', 'State': 'available',
+             'Tags': [{'Key': 'Name', 'Value': f'vpc-{i}'}]}
+            for i in range(count)
+        ]
+        self.subnets = [
+            {'SubnetId': f'subnet-{i:08x}', 'VpcId': f'vpc-{i:08x}', 'CidrBlock': '10.0.1.0/24',
+             'State': 'available', 'AvailabilityZone': 'us-east-1a',
+             'Tags': [{'Key': 'Name', 'Value': f'subnet-{i}'}]}
+            for i in range(count)
+        ]
+        self.route_tables = [
+            {'RouteTableId': f'rtb-{i:08x}', 'VpcId': f'vpc-{i:08x}',
+             'Routes': [{'DestinationCidrBlock': '0.0.0.0/0', 'GatewayId': f'igw-{i:08x}'}],
+             'Associations': [{'SubnetId': f'subnet-{i:08x}', 'Main': False}],
+             'Tags': [{'Key': 'Name', 'Value': f'rtb-{i}'}]}
+            for i in range(count)
+        ]
+        self.internet_gateways = [
+            {'InternetGatewayId': f'igw-{i:08x}', 'Tags': [{'Key': 'Name', 'Value': f'igw-{i}'}]}
+            for i in range(count)
+        ]
+        # Every other instance is untagged, which is how EC2 reports it: no 'Tags' key.
+        self.instances = []
+        for i in range(count):
+            instance = {'InstanceId': f'i-{i:017x}', 'InstanceType': 't2.micro',
+                        'State': {'Name': 'running'}, 'LaunchTime': launch_time}
+            if i % 2 == 0:
+                instance['Tags'] = [{'Key': 'Name', 'Value': f'instance-{i}'}]
+            self.instances.append(instance)
+
+        self.tags = {}
+        for collection, id_key in ((self.instances, 'InstanceId'), (self.vpcs, 'VpcId'), (self.subnets, 'SubnetId'),
+                                   (self.route_tables, 'RouteTableId'), (self.internet_gateways, 'InternetGatewayId')):
+            for resource in collection:
+                self.tags[resource[id_key]] = resource.get('Tags', [])
+
+    def attach(self, client):
+        client.meta.events.register('before-call.ec2', self.handle)
+        return client
+
+    def handle(self, model, params, **kwargs):
+        self.calls[model.name] += 1
+        handler = getattr(self, xform_name(model.name))
+        return AWSResponse(None, 200, {}, None), handler(params)
+
+    def describe_instances(self, params):
+        return {'Reservations': [{'Instances': self.instances}]}
+
+    def describe_vpcs(self, params):
+        return {'Vpcs': self.vpcs}
+
+    def describe_subnets(self, params):
+        return {'Subnets': self.subnets}
+
+    def describe_route_tables(self, params):
+        return {'RouteTables': self.route_tables}
+
+    def describe_internet_gateways(self, params):
+        return {'InternetGateways': self.internet_gateways}
+
+    def describe_tags(self, params):
+        tags = []
+        for f in params.get('Filters', []):
+            if f['Name'] == 'resource-id':
+                for resource_id in f['Values']:
+                    for tag in self.tags.get(resource_id, []):
+                        tags.append({'ResourceId': resource_id, 'Key': tag['Key'], 'Value': tag['Value']})
+        return {'Tags': tags}
+
+
+def make_client(service, region='us-east-1'):
+    import boto3
+    return boto3.client(
+        service,
+        region_name=region,
+        aws_access_key_id='testing',
+        aws_secret_access_key='testing',
+    )
+
+
+# Stateful stand-in for the EC2, S3 and IAM calls SarmaStack makes, for driving whole
+# commands (provision, list-*, delete --force/--cascade) offline. Every call sleeps
+# for the configured latency (plus up to 'jitter' more) and fails with Throttling at
+# the configured rate, so SarmaStack's own concurrency, rate limiting and retries
+# are exercised. Listings are paginated the way AWS does it.
+class FakeAWS:
+    PAGE_SIZE = 1000
+    # EC2 rejects a filter with more values than this.
+    MAX_FILTER_VALUES = 200
+
+    def __init__(self, latency=0.0, jitter=0.0, throttle_rate=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = collections.Counter()
+        self.throttled = 0
+        self.ids = 0
+        self.created = datetime.datetime(2024, 1, 1)
+        self.instances = []
+        self.vpcs = []
+        self.subnets = []
+        self.route_tables = []
+        self.internet_gateways = []
+        self.security_groups = []
+        self.network_interfaces = []
+        self.buckets = {}
+        self.objects = {}
+        self.users = []
+        self.roles = []
+        self.policies = []
+        self.images = []
+        self.failures = collections.defaultdict(list)
+
+    # Registers the stand-in on the client registry's default session; every client
+    # the registry builds afterwards answers from it. 'before-call' only sees the
+    # serialized request, so the call's own parameters are kept in its context first.
+    def install(self):
+        import clients
+        clients.clear_clients()
+        session = clients.get_session()._session
+        session.register('before-parameter-build', self.keep_params)
+        session.register('before-call', self.handle)
+        return self
+
+    # Makes the next 'times' calls of operation (e.g. 'CreateTags') fail with code.
+    def fail(self, operation, code, times=1):
+        with self.lock:
+            self.failures[operation].extend([code] * times)
+        return self
+
+    @staticmethod
+    def keep_params(params, context, **kwargs):
+        context['fake_params'] = dict(params)
+
+    def next_id(self, prefix, width=8):
+        with self.lock:
+            self.ids += 1
+            return f'{prefix}-{self.ids:0{width}x}'
+
+    def handle(self, model, context, **kwargs):
+        params = context.get('fake_params', {})
+        with self.lock:
+            self.calls[model.name] += 1
+            throttle = self.random.random() < self.throttle_rate
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            failure = self.failures[model.name].pop(0) if self.failures[model.name] else None
+        if any(len(ec2_filter.get('Values', [])) > self.MAX_FILTER_VALUES for ec2_filter in params.get('Filters') or []):
+            failure = 'FilterLimitExceeded'
+        if delay:
+            time.sleep(delay)
+        if failure:
+            return AWSResponse(None, 400, {}, None), {'Error': {'Code': failure, 'Message': f'{model.name} failed'}}
+        if throttle:
+            with self.lock:
+                self.throttled += 1
+            return AWSResponse(None, 400, {}, None), {'Error': {'Code': 'Throttling', 'Message': 'Rate exceeded'}}
+        handler = getattr(self, xform_name(model.name), None)
+        return AWSResponse(None, 200, {}, None), handler(params) if handler else {}
+
+    def page(self, items, params, items_key, token_key='NextToken', input_key='NextToken'):
+        start = int(params.get(input_key) or 0)
+        response = {items_key: items[start:start + self.PAGE_SIZE]}
+        if start + self.PAGE_SIZE < len(items):
+            response[token_key] = str(start + self.PAGE_SIZE)
+        return response
+
+    def iam_page(self, items, params, items_key):
+        response = self.page(items, params, items_key, 'Marker', 'Marker')
+        response['IsTruncated'] = 'Marker' in response
+        return response
+
+    # Fills every listing with 'count' resources of each kind.
+    def populate(self, count):
+        for i in range(count):
+            vpc_id, subnet_id, igw_id = f'vpc-{i:08x}', f'subnet-{i:08x}', f'igw-{i:08x}'
+            self.vpcs.append({'VpcId': vpc_id, 'CidrBlock': '10.0.0.0/16', 'State': 'available',
+                              'Tags': [{'Key': 'Name', 'Value': f'vpc-{i}'}]})
+            self.subnets.append({'SubnetId': subnet_id, 'VpcId': vpc_id, 'CidrBlock': '10.0.1.0/24', 'State': 'available',
+                                 'AvailabilityZone': 'us-east-1a', 'Tags': [{'Key': 'Name', 'Value': f'subnet-{i}'}]})
+            self.route_tables.append({'RouteTableId': f'rtb-{i:08x}', 'VpcId': vpc_id,
+                                      'Routes': [{'DestinationCidrBlock': '0.0.0.0/0', 'GatewayId': igw_id}],
+                                      'Associations': [{'RouteTableAssociationId': f'rtbassoc-{i:08x}', 'SubnetId': subnet_id, 'Main': False}],
+                                      'Tags': [{'Key': 'Name', 'Value': f'rtb-{i}'}]})
+            self.internet_gateways.append({'InternetGatewayId': igw_id, 'Attachments': [{'VpcId': vpc_id}],
+                                           'Tags': [{'Key': 'Name', 'Value': f'igw-{i}'}]})
+            self.instances.append({'InstanceId': f'i-{i:017x}', 'InstanceType': 't3.micro', 'State': {'Name': 'running'},
+                                   'LaunchTime': self.created, 'Tags': [{'Key': 'Name', 'Value': f'instance-{i}'}]})
+            self.buckets[f'bucket-{i}'] = self.created
+            self.users.append({'UserName': f'user-{i}', 'Arn': f'arn:aws:iam::123456789012:user/user-{i}'})
+            self.roles.append({'RoleName': f'role-{i}', 'Arn': f'arn:aws:iam::123456789012:role/role-{i}'})
+        return self
+
+    # One VPC holding 'count' dependent objects, for delete-vpc --cascade.
+    def populate_vpc(self, vpc_id, count):
+        quarter = max(1, count // 4)
+        for i in range(quarter):
+            self.subnets.append({'SubnetId': f'subnet-{i:08x}', 'VpcId': vpc_id})
+            self.route_tables.append({'RouteTableId': f'rtb-{i:08x}', 'VpcId': vpc_id,
+                                      'Associations': [{'RouteTableAssociationId': f'rtbassoc-{i:08x}', 'SubnetId': f'subnet-{i:08x}'}]})
+            self.security_groups.append({'GroupId': f'sg-{i:08x}', 'GroupName': f'sg-{i}', 'VpcId': vpc_id,
+                                         'IpPermissions': [{'IpProtocol': '-1', 'UserIdGroupPairs': [{'GroupId': f'sg-{(i + 1) % quarter:08x}'}]}],
+                                         'IpPermissionsEgress': []})
+            self.network_interfaces.append({'NetworkInterfaceId': f'eni-{i:08x}', 'Status': 'available'})
+        self.internet_gateways.append({'InternetGatewayId': 'igw-00000000', 'Attachments': [{'VpcId': vpc_id}]})
+        return self
+
+    def populate_objects(self, bucket_name, count):
+        self.buckets[bucket_name] = self.created
+        self.objects[bucket_name] = [{'Key': f'key-{i}', 'VersionId': f'v{i}'} for i in range(count)]
+        return self
+
+    def describe_instances(self, params):
+        response = self.page(self.instances, params, 'Instances')
+        response['Reservations'] = [{'Instances': response.pop('Instances')}]
+        return response
+
+    def describe_vpcs(self, params):
+        return self.page(self.vpcs, params, 'Vpcs')
+
+    def describe_subnets(self, params):
+        return self.page(self.subnets, params, 'Subnets')
+
+    def describe_route_tables(self, params):
+        return self.page(self.route_tables, params, 'RouteTables')
+
+    def describe_internet_gateways(self, params):
+        return self.page(self.internet_gateways, params, 'InternetGateways')
+
+    def describe_security_groups(self, params):
+        return self.page(self.security_groups, params, 'SecurityGroups')
+
+    def describe_network_interfaces(self, params):
+        return self.page(self.network_interfaces, params, 'NetworkInterfaces')
+
+    # Filters and owners are not applied; every image is public to everyone.
+    def describe_images(self, params):
+        return self.page(self.images, params, 'Images')
+
+    def describe_regions(self, params):
+        return {'Regions': [{'RegionName': 'us-east-1'}]}
+
+    def run_instances(self, params):
+        instances = [{'InstanceId': self.next_id('i', 17), 'InstanceType': params['InstanceType'], 'State': {'Name': 'pending'},
+                      'LaunchTime': self.created} for _ in range(params['MaxCount'])]
+        with self.lock:
+            self.instances.extend(instances)
+        return {'Instances': instances}
+
+    def create_tags(self, params):
+        with self.lock:
+            for instance in self.instances:
+                if instance['InstanceId'] in params['Resources']:
+                    instance.setdefault('Tags', []).extend(params['Tags'])
+        return {}
+
+    def create_vpc(self, params):
+        return {'Vpc': {'VpcId': self.next_id('vpc')}}
+
+    def create_subnet(self, params):
+        return {'Subnet': {'SubnetId': self.next_id('subnet')}}
+
+    def create_internet_gateway(self, params):
+        return {'InternetGateway': {'InternetGatewayId': self.next_id('igw')}}
+
+    def create_route_table(self, params):
+        return {'RouteTable': {'RouteTableId': self.next_id('rtb')}}
+
+    def associate_route_table(self, params):
+        return {'AssociationId': self.next_id('rtbassoc')}
+
+    def list_buckets(self, params):
+        with self.lock:
+            return {'Buckets': [{'Name': name, 'CreationDate': created} for name, created in self.buckets.items()]}
+
+    def create_bucket(self, params):
+        with self.lock:
+            self.buckets[params['Bucket']] = self.created
+        return {}
+
+    def list_object_versions(self, params):
+        response = self.page(self.objects.get(params['Bucket'], []), params, 'Versions', 'NextKeyMarker', 'KeyMarker')
+        response['IsTruncated'] = 'NextKeyMarker' in response
+        if response['IsTruncated']:
+            response['NextVersionIdMarker'] = response['NextKeyMarker']
+        return response
+
+    def delete_objects(self, params):
+        return {}
+
+    def list_users(self, params):
+        return self.iam_page(self.users, params, 'Users')
+
+    def list_roles(self, params):
+        return self.iam_page(self.roles, params, 'Roles')
+
+    def list_policies(self, params):
+        return self.iam_page(self.policies, params, 'Policies')
+
+    def create_user(self, params):
+        return {'User': {'UserName': params['UserName'], 'Arn': f"arn:aws:iam::123456789012:user/{params['UserName']}"}}
+
+    def create_role(self, params):
+        return {'Role': {'RoleName': params['RoleName'], 'Arn': f"arn:aws:iam::123456789012:role/{params['RoleName']}"}}
+
+    def get_role(self, params):
+        return {'Role': {'RoleName': params['RoleName'], 'Arn': f"arn:aws:iam::123456789012:role/{params['RoleName']}"}}
+
+    def create_policy(self, params):
+        return {'Policy': {'PolicyName': params['PolicyName'], 'Arn': f"arn:aws:iam::123456789012:policy/{params['PolicyName']}"}}
+
@@ -0,0 +1,189 @@
+import os
+import threading
+from inventory import track_mutations
+from metrics import instrument_session
+
+# Connection settings shared by every client. The pool must be at least as large as
+# the number of worker threads that may use one client at the same time, otherwise
+# workers queue for a connection (and urllib3 discards the surplus ones).
+DEFAULT_CLIENT_OPTIONS = {
+    'max_pool_connections': int(os.environ.get('SARMASTACK_MAX_POOL_CONNECTIONS', 32)),
+    'tcp_keepalive': True,
+    'connect_timeout': 10,
+    'read_timeout': 60,
+    'retries': {'mode': 'standard', 'max_attempts': 5},
+}
+
+# Credentials from assumed roles are cached here until shortly before they expire,
+# so repeated runs across many accounts do not call sts:AssumeRole every time.
+STS_CACHE_DIR = os.environ.get('SARMASTACK_STS_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'sarmastack', 'sts'))
+ROLE_SESSION_NAME = 'sarmastack'
+
+# Process-wide registry of boto3 sessions (one per profile) and clients keyed by
+# (service, region, profile). A profile may also be the ARN of a role to assume
+# with the default credentials. Both are created on first use only, so commands that
+# never talk to AWS (--help, start) never import boto3 at all. Sessions are not
+# thread-safe, so client creation happens under the lock; the clients themselves are
+# safe to share across worker threads and keep their HTTP connections warm.
+_sessions = {}
+_clients = {}
+_options = dict(DEFAULT_CLIENT_OPTIONS)
+_loader = None
+_lock = threading.Lock()
+
+
+def configure_clients(**options):
+    with _lock:
+        _options.update(options)
+        _clients.clear()
+
+
+# Clients without retries make one attempt per request, for callers that retry
+# themselves (an ExecutionEngine).
+def client_config(retries=True):
+    from botocore.config import Config
+    options = dict(_options)
+    if not retries:
+        options['retries'] = {'mode': (options.get('retries') or {}).get('mode', 'standard'), 'total_max_attempts': 1}
+    return Config(**options)
+
+
+def is_role_arn(profile):
+    return bool(profile) and profile.startswith('arn:') and ':role/' in profile
+
+
+# How an account is labelled in merged output and in per-account state file names:
+# a role's account ID and role name (IAM role names are unique within an account,
+# so two roles in one account never share a label), or the profile name.
+def account_label(profile):
+    if is_role_arn(profile):
+        return f"{profile.split(':')[4]}-{profile.rsplit('/', 1)[-1]}"
+    return profile or 'default'
+
+
+def _get_session(profile):
+    global _loader
+    if profile not in _sessions:
+        import boto3
+        import botocore.session
+        if is_role_arn(profile):
+            core = _assume_role_session(profile)
+        else:
+            core = botocore.session.Session(profile=profile)
+        # All sessions read service models through one loader, so each model is
+        # parsed once per process rather than once per account.
+        if _loader is None:
+            _loader = core.get_component('data_loader')
+        else:
+            core.register_component('data_loader', _loader)
+        instrument_session(core)
+        session = boto3.session.Session(botocore_session=core)
+        # boto3 adds its resource models to the loader's search paths for every
+        # session it wraps; the shared loader only needs them once.
+        _loader.search_paths[:] = list(dict.fromkeys(_loader.search_paths))
+        _sessions[profile] = session
+    return _sessions[profile]
+
+
+# Hands a botocore session the credentials of an assumed role, in place of its
+# default provider chain.
+class RoleArnCredentialProvider:
+    METHOD = 'assume-role'
+    CANONICAL_NAME = 'custom-sarmastack-role-arn'
+
+    def __init__(self, fetcher):
+        self.fetcher = fetcher
+
+    def load(self):
+        from botocore.credentials import DeferredRefreshableCredentials
+        return DeferredRefreshableCredentials(method=self.METHOD, refresh_using=self.fetcher.fetch_credentials)
+
+
+# A botocore session whose credentials come from assuming role_arn. They are
+# fetched on the first call, served from STS_CACHE_DIR while still valid, and
+# refreshed by botocore (under its own lock) before they expire.
+def _assume_role_session(role_arn):
+    import botocore.session
+    from botocore.credentials import AssumeRoleCredentialFetcher, CredentialResolver
+    from botocore.utils import JSONFileCache
+    source = _get_session(None)
+    fetcher = AssumeRoleCredentialFetcher(
+        client_creator=source.client,
+        source_credentials=source.get_credentials(),
+        role_arn=role_arn,
+        extra_args={'RoleSessionName': ROLE_SESSION_NAME},
+        cache=JSONFileCache(STS_CACHE_DIR),
+    )
+    session = botocore.session.Session()
+    session.register_component('credential_provider', CredentialResolver([RoleArnCredentialProvider(fetcher)]))
+    if source.region_name:
+        session.set_config_variable('region', source.region_name)
+    return session
+
+
+def get_session(profile=None):
+    with _lock:
+        return _get_session(profile)
+
+
+def get_client(service, region=None, profile=None, retries=True):
+    key = (service, region, profile, retries)
+    with _lock:
+        if key not in _clients:
+            session = _get_session(profile)
+            client = session.client(service, region_name=region, config=client_config(retries))
+            track_mutations(client)
+            _clients[key] = client
+        return _clients[key]
+
+
+def clear_clients():
+    with _lock:
+        _clients.clear()
+        _sessions.clear()
+
+
+# One manager per region, built by factory(region) on first use. Clients are
+# already pooled per region by the registry; this keeps the managers (and their
+# rate-limited client wrappers) from being rebuilt for every resource.
+class RegionPool:
+    def __init__(self, factory):
+        self.factory = factory
+        self.managers = {}
+        self.lock = threading.Lock()
+
+    def get(self, region=None):
+        with self.lock:
+            if region not in self.managers:
+                self.managers[region] = self.factory(region)
+            return self.managers[region]
+
+    def values(self):
+        with self.lock:
+            return list(self.managers.values())
+
+
+# Class attribute that resolves to a registry client the first time it is read on an
+# instance. The client is for the instance's 'region' and 'profile' attributes if
+# it has them (the default region and credentials otherwise). Managers holding an
+# 'engine' get a client rate limited and retried by it instead of by botocore.
+# Assigning the attribute (e.g. to a stubbed client) overrides it as usual.
+class lazy_client:
+    def __init__(self, service):
+        self.service = service
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        region = getattr(instance, 'region', None)
+        profile = getattr(instance, 'profile', None)
+        engine = getattr(instance, 'engine', None)
+        if engine is not None:
+            client = engine.limit(get_client(self.service, region, profile, retries=False), profile)
+        else:
+            client = get_client(self.service, region, profile)
+        instance.__dict__[self.name] = client
+        return client
@@ -1,31 +1,52 @@
-import boto3
 import json
-import yaml
+import os
+import time
 import botocore
 from botocore.exceptions import ClientError
+from clients import lazy_client
+from executor import get_engine
+from output import print_line
+from tracing import span, traced
+from yamlio import load_file
 
 class CreateManager:
-    def __init__(self):
-        self.s3_client = boto3.client('s3')
-        self.ec2_client = boto3.client('ec2')
-        self.iam_client = boto3.client('iam')
+    s3_client = lazy_client('s3')
+    ec2_client = lazy_client('ec2')
+    iam_client = lazy_client('iam')
+
+    def __init__(self, engine=None, region=None):
+        self.engine = engine or get_engine()
+        self.region = region
     
+    # Largest number of instances launched by a single run_instances call.
+    MAX_INSTANCES_PER_LAUNCH = 100
+    # Attempts at tagging an instance that EC2 does not know about yet.
+    TAG_ATTEMPTS = 6
+
     def create_instance(self, args):
         if args.get('file'):
-            with open(args['file'], 'r') as f:
-                data = yaml.safe_load(f)
-                instances = data.get('instances')
-                if instances:
-                    for instance in instances:
-                        self.create_instance(instance)
-                else:
-                    print("No instance specifications found in the YAML file.")
+            data = load_file(args['file'])
+            instances = data.get('instances')
+            if instances:
+                groups = {}
+                for instance in instances:
+                    groups.setdefault(self.launch_key(instance), []).append(instance)
+                # Keyed by instance ID: names are optional, and need not be unique.
+                created = {}
+                for group in groups.values():
+                    region = group[0].get('region')
+                    manager = CreateManager(self.engine, region) if region and region != self.region else self
+                    for i in range(0, len(group), self.MAX_INSTANCES_PER_LAUNCH):
+                        batch = group[i:i + self.MAX_INSTANCES_PER_LAUNCH]
+                        for instance, instance_id in zip(batch, manager.create_instances(batch)):
+                            created[instance_id] = instance.get('instance_name') or 'default-name'
+                return created
+            else:
+                print_line("No instance specifications found in the YAML file.")
 
         else:
             instance_name = args.get('instance_name') or 'default-name'
             response = self.ec2_client.run_instances(
-                ImageId=args['image_id'],
-                InstanceType=args['instance_type'],
                 MinCount=1,
                 MaxCount=1,
                 TagSpecifications=[
@@ -38,10 +59,82 @@ class CreateManager:
                             },
                         ]
                     },
-                ]
+                ],
+                **self.launch_params(args)
             )
-            print(f"Created instance with id {args['image_id']} and name: {args['instance_name']}")
+            instance_id = response['Instances'][0]['InstanceId']
+            print_line(f"Created instance {instance_id} with name: {instance_name}")
+            return instance_id
+
+    # Launches every spec with one run_instances call; they must all share a launch
+    # key. The Name tags differ per instance, so they are applied afterwards. The
+    # instances exist from the moment run_instances returns, so all of them are
+    # returned (and recorded) even if tagging some of them fails.
+    # Returns the instance IDs in the order of the specs.
+    def create_instances(self, instances):
+        if len(instances) == 1:
+            return [self.create_instance(instances[0])]
+
+        with span('ec2.run_instances', count=len(instances)):
+            response = self.ec2_client.run_instances(
+                MinCount=len(instances),
+                MaxCount=len(instances),
+                **self.launch_params(instances[0])
+            )
+        created = [launched['InstanceId'] for launched in response['Instances']]
+        names = [instance.get('instance_name') or 'default-name' for instance in instances]
+        print_line(f"Created {len(created)} instances with image {instances[0]['image_id']}: {', '.join(names)}")
+
+        with span('ec2.tag_instances', count=len(created)):
+            for instance_id, instance_name in zip(created, names):
+                self.tag_instance(instance_id, instance_name)
+        return created
 
+    # EC2 is eventually consistent: a tag on an instance launched a moment ago can
+    # fail with InvalidInstanceID.NotFound, which botocore does not retry. Returns
+    # whether the tag was applied.
+    def tag_instance(self, instance_id, instance_name):
+        for attempt in range(1, self.TAG_ATTEMPTS + 1):
+            try:
+                self.ec2_client.create_tags(
+                    Resources=[instance_id],
+                    Tags=[{'Key': 'Name', 'Value': instance_name}]
+                )
+                return True
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'InvalidInstanceID.NotFound' or attempt == self.TAG_ATTEMPTS:
+                    print_line(f"Error occurred while tagging instance {instance_id} as {instance_name}: {str(e)}")
+                    return False
+                time.sleep(self.engine.backoff(attempt))
+            except Exception as e:
+                print_line(f"Error occurred while tagging instance {instance_id} as {instance_name}: {str(e)}")
+                return False
+
+    @staticmethod
+    def launch_params(args):
+        params = {
+            'ImageId': args['image_id'],
+            'InstanceType': args['instance_type'],
+        }
+        if args.get('subnet_id'):
+            params['SubnetId'] = args['subnet_id']
+        if args.get('security_group_ids'):
+            params['SecurityGroupIds'] = list(args['security_group_ids'])
+        return params
+
+    # Instances with the same launch key differ only by name and can be launched
+    # together.
+    @staticmethod
+    def launch_key(args):
+        return (
+            args.get('region'),
+            args.get('image_id'),
+            args.get('instance_type'),
+            args.get('subnet_id'),
+            tuple(sorted(args.get('security_group_ids') or [])),
+        )
+
+    @traced('s3.create_bucket')
     def create_bucket(self, args):
         bucket_name = args.get('bucket_name')
         region = args.get('region')
@@ -60,48 +153,81 @@ class CreateManager:
                 else:
                     response = self.s3_client.create_bucket(Bucket=bucket_name)
 
-                print(f"Created bucket {bucket_name} in region {region}")
+                print_line(f"Created bucket {bucket_name} in region {region}")
+                return {'bucket_name': bucket_name, 'region': region}
             except botocore.exceptions.ClientError as e:
                 error_code = e.response['Error']['Code']
                 error_message = e.response['Error']['Message']
-                if error_code == 'BucketAlreadyExists':
-                    print(f"Bucket {bucket_name} already exists.")
+                if error_code == 'BucketAlreadyOwnedByYou':
+                    print_line(f"Bucket {bucket_name} already exists.")
+                    return {'bucket_name': bucket_name, 'region': region}
+                elif error_code == 'BucketAlreadyExists':
+                    print_line(f"Bucket {bucket_name} already exists.")
                 else:
-                    print(f"Error occurred while creating the bucket: {error_message}")
+                    print_line(f"Error occurred while creating the bucket: {error_message}")
             except Exception as e:
-                print(f"Error occurred while creating the bucket: {str(e)}")
+                print_line(f"Error occurred while creating the bucket: {str(e)}")
         else:
-            print("Please provide both 'bucket_name' and 'region' arguments.")
+            print_line("Please provide both 'bucket_name' and 'region' arguments.")
 
+    @traced('iam.create_user')
     def create_iam_user(self, user_data):
         user_name = user_data.get('user_name')
         try:
-            self.iam_client.create_user(UserName=user_name)
-            print(f"Created IAM user: {user_name}")
+            response = self.iam_client.create_user(UserName=user_name)
+            print_line(f"Created IAM user: {user_name}")
+            return {'user_name': user_name, 'arn': response['User']['Arn']}
         except ClientError as e:
             if e.response['Error']['Code'] == 'EntityAlreadyExists':
-                print(f"IAM user {user_name} already exists.")
+                print_line(f"IAM user {user_name} already exists.")
+                response = self.iam_client.get_user(UserName=user_name)
+                return {'user_name': user_name, 'arn': response['User']['Arn']}
             else:
-                print(f"Error creating IAM user {user_name}: {str(e)}")
+                print_line(f"Error creating IAM user {user_name}: {str(e)}")
 
+    @traced('iam.create_role')
+    # A role left behind by an earlier, partly failed run is taken over, as users
+    # are; any other error reaches the caller (the scheduler marks the role failed).
     def create_iam_role(self, role_name, assume_role_policy):
         try:
             response = self.iam_client.create_role(
                 RoleName=role_name,
-                AssumeRolePolicyDocument=json.dumps(assume_role_policy)
+                AssumeRolePolicyDocument=self.read_policy_document(assume_role_policy)
             )
-            print(f"Created IAM role: {role_name}")
-        except Exception as e:
-            print(f"Error occurred while creating IAM role: {str(e)}")
+            print_line(f"Created IAM role: {role_name}")
+            return {'role_name': role_name, 'arn': response['Role']['Arn']}
+        except self.iam_client.exceptions.EntityAlreadyExistsException:
+            print_line(f"IAM role {role_name} already exists.")
+            response = self.iam_client.get_role(RoleName=role_name)
+            return {'role_name': role_name, 'arn': response['Role']['Arn']}
 
+    @traced('iam.create_policy')
     def create_iam_policy(self, args):
-        with open(args['policy_document'], 'r') as f:
-            policy_document = f.read()
+        policy_document = self.read_policy_document(args['policy_document'])
         response = self.iam_client.create_policy(
             PolicyName=args['policy_name'],
             PolicyDocument=policy_document
         )
-        print(f"Created IAM policy: {args['policy_name']}")
+        print_line(f"Created IAM policy: {args['policy_name']}")
+
+        policy_arn = response['Policy']['Arn']
+        for role_name in args.get('roles') or []:
+            self.iam_client.attach_role_policy(RoleName=role_name, PolicyArn=policy_arn)
+            print_line(f"Attached IAM policy {args['policy_name']} to role {role_name}")
+        for user_name in args.get('users') or []:
+            self.iam_client.attach_user_policy(UserName=user_name, PolicyArn=policy_arn)
+            print_line(f"Attached IAM policy {args['policy_name']} to user {user_name}")
+
+        return {'policy_name': args['policy_name'], 'arn': policy_arn}
+
+    @staticmethod
+    def read_policy_document(policy_document):
+        if isinstance(policy_document, dict):
+            return json.dumps(policy_document)
+        if os.path.isfile(policy_document):
+            with open(policy_document, 'r') as f:
+                return f.read()
+        return policy_document
 
     def get_location_constraint(self, region):
         if region == 'us-east-1':
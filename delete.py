@@ -1,113 +1,323 @@
-import boto3
-import yaml
+import threading
+import time
+from clients import DEFAULT_CLIENT_OPTIONS, configure_clients, lazy_client
+from executor import THROTTLING_ERROR_CODES, get_engine
+from list import ListManager
+from output import print_line
+from yamlio import load_file
 
 class DeleteManager:
+    s3_client = lazy_client('s3')
+    ec2_client = lazy_client('ec2')
+    iam_client = lazy_client('iam')
+
+    # Largest number of keys a single delete_objects call accepts.
+    MAX_DELETE_OBJECTS = 1000
+
+    def __init__(self, engine=None):
+        self.engine = engine or get_engine()
+
     def delete_instance(self, args):
         if args.get('file'):
-            with open(args['file'], 'r') as f:
-                data = yaml.safe_load(f)
-                instances = data.get('instances')
-                if instances:
-                    instance_ids = [instance['instance_id'] for instance in instances]
-                    self.delete_instance({'instance_ids': instance_ids})
-                else:
-                    print("No instance specifications found in the YAML file.")
+            data = load_file(args['file'])
+            instances = data.get('instances')
+            if instances:
+                instance_ids = [instance['instance_id'] for instance in instances]
+                self.delete_instance({'instance_ids': instance_ids})
+            else:
+                print_line("No instance specifications found in the YAML file.")
         else:
-            ec2_client = boto3.client('ec2')
             instance_ids = args.get('instance_ids')
             if instance_ids:
-                response = ec2_client.terminate_instances(InstanceIds=instance_ids)
-                print(f"Deleted instances: {args['instance_ids']}")
+                response = self.ec2_client.terminate_instances(InstanceIds=instance_ids)
+                print_line(f"Deleted instances: {args['instance_ids']}")
     
     def delete_bucket(self, args):
-        s3_client = boto3.client('s3')
-
         bucket_names = args.get('bucket_name')
 
-        if bucket_names:
+        if bucket_names and args.get('force'):
+            self.engine.configure(max_workers=args.get('workers'))
+            if self.engine.max_workers > DEFAULT_CLIENT_OPTIONS['max_pool_connections']:
+                configure_clients(max_pool_connections=self.engine.max_workers)
+            self.force_delete_buckets(bucket_names)
+        elif bucket_names:
             for bucket_name in bucket_names:
                 try:
-                    s3_client.delete_bucket(Bucket=bucket_name)
-                    print(f"Deleted bucket {bucket_name}")
+                    self.s3_client.delete_bucket(Bucket=bucket_name)
+                    print_line(f"Deleted bucket {bucket_name}")
                 except Exception as e:
-                    print(f"Error occurred while deleting bucket {bucket_name}: {str(e)}")
+                    print_line(f"Error occurred while deleting bucket {bucket_name}: {str(e)}")
         else:
-            print("Please provide the 'bucket_names' argument with a list of bucket names to delete.")
+            print_line("Please provide the 'bucket_names' argument with a list of bucket names to delete.")
+
+    # Empties every bucket and deletes it. Each bucket's object versions and delete
+    # markers are listed on their own thread and streamed in batches of up to
+    # MAX_DELETE_OBJECTS keys to delete_objects calls on the engine's worker pool,
+    # so batches from all buckets are deleted in parallel.
+    def force_delete_buckets(self, bucket_names):
+        from tabulate import tabulate
+        results = {}
+        threads = []
+        for bucket_name in bucket_names:
+            thread = threading.Thread(target=self.force_delete_bucket, args=(bucket_name, results), name=f'empty-{bucket_name}')
+            threads.append(thread)
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        table_data = []
+        total = 0
+        for bucket_name in bucket_names:
+            result = results[bucket_name]
+            total += result['deleted']
+            rate = result['deleted'] / result['seconds'] if result['seconds'] else 0
+            table_data.append([bucket_name, result['deleted'], result['errors'], f"{result['seconds']:.1f}", f"{rate:.0f}", result['status']])
+        headers = ['Bucket', 'Objects Deleted', 'Errors', 'Seconds', 'Objects/sec', 'Status']
+        print_line(tabulate(table_data, headers, tablefmt="fancy_grid"))
+        seconds = max(result['seconds'] for result in results.values())
+        print_line(f"Deleted {total} objects in {seconds:.1f}s ({total / seconds if seconds else 0:.0f} objects/sec).")
+
+    def force_delete_bucket(self, bucket_name, results):
+        started = time.monotonic()
+        result = {'deleted': 0, 'errors': 0, 'status': 'deleted'}
+        # Caps the batches queued for one bucket, so listing never runs far ahead of
+        # deleting.
+        window = threading.BoundedSemaphore(self.engine.max_workers * 2)
+        futures = []
+
+        def submit(objects):
+            window.acquire()
+            future = self.engine.submit(self.delete_objects, bucket_name, objects)
+            future.add_done_callback(lambda _: window.release())
+            futures.append(future)
+
+        try:
+            batch = []
+            for page in ListManager.iter_pages(self.s3_client, 'list_object_versions', Bucket=bucket_name):
+                for version in page.get('Versions', []) + page.get('DeleteMarkers', []):
+                    batch.append({'Key': version['Key'], 'VersionId': version['VersionId']})
+                    if len(batch) == self.MAX_DELETE_OBJECTS:
+                        submit(batch)
+                        batch = []
+            if batch:
+                submit(batch)
+
+            for future in futures:
+                deleted, errors = future.result()
+                result['deleted'] += deleted
+                result['errors'] += len(errors)
+                for error in errors[:1]:
+                    print_line(f"Error occurred while deleting {error.get('Key')} from bucket {bucket_name}: {error.get('Message')}")
+
+            if result['errors']:
+                result['status'] = 'not empty'
+            else:
+                self.s3_client.delete_bucket(Bucket=bucket_name)
+        except Exception as e:
+            result['status'] = 'failed'
+            print_line(f"Error occurred while deleting bucket {bucket_name}: {str(e)}")
+        result['seconds'] = time.monotonic() - started
+        results[bucket_name] = result
+
+    # Deletes one batch of object versions and returns (deleted, errors). Keys that
+    # S3 reports as throttled are retried with backoff.
+    def delete_objects(self, bucket_name, objects):
+        deleted = 0
+        failed = []
+        for attempt in range(1, self.engine.max_attempts + 1):
+            response = self.s3_client.delete_objects(Bucket=bucket_name, Delete={'Objects': objects, 'Quiet': True})
+            errors = response.get('Errors', [])
+            deleted += len(objects) - len(errors)
+            throttled = [error for error in errors if error.get('Code') in THROTTLING_ERROR_CODES]
+            failed += [error for error in errors if error.get('Code') not in THROTTLING_ERROR_CODES]
+            if not throttled:
+                break
+            if attempt == self.engine.max_attempts:
+                failed += throttled
+                break
+            time.sleep(self.engine.backoff(attempt))
+            objects = [{'Key': error['Key'], 'VersionId': error['VersionId']} for error in throttled]
+        return deleted, failed
 
     def delete_iam_user(self, args):
-        iam_client = boto3.client('iam')
         user_name = args.get('user_name')
 
         if user_name:
             try:
-                response = iam_client.delete_user(UserName=user_name)
-                print(f"Deleted IAM user: {user_name}")
+                response = self.iam_client.delete_user(UserName=user_name)
+                print_line(f"Deleted IAM user: {user_name}")
             except Exception as e:
-                print(f"Error occurred while deleting IAM user: {str(e)}")
+                print_line(f"Error occurred while deleting IAM user: {str(e)}")
         else:
-            print("Please provide the 'user_name' argument.")
+            print_line("Please provide the 'user_name' argument.")
     
     def delete_iam_role(self, args):
-        iam_client = boto3.client('iam')
         role_name = args.get('role_name')
 
         if role_name:
             try:
-                response = iam_client.delete_role(RoleName=role_name)
-                print(f"Deleted IAM role: {role_name}")
+                response = self.iam_client.delete_role(RoleName=role_name)
+                print_line(f"Deleted IAM role: {role_name}")
             except Exception as e:
-                print(f"Error occurred while deleting IAM roles: {str(e)}")
+                print_line(f"Error occurred while deleting IAM roles: {str(e)}")
         else:
-            print("Please provide the 'role_name' argument.")
+            print_line("Please provide the 'role_name' argument.")
     
     def delete_vpc(self, args):
-        ec2_client = boto3.client('ec2')
         vpc_id = args.get('vpc_id')
 
-        if vpc_id:
+        if vpc_id and args.get('cascade'):
+            self.cascade_delete_vpc(vpc_id)
+        elif vpc_id:
             try:
-                response = ec2_client.delete_vpc(VpcId=vpc_id)
-                print(f"Deleted VPC: {vpc_id}")
+                response = self.ec2_client.delete_vpc(VpcId=vpc_id)
+                print_line(f"Deleted VPC: {vpc_id}")
             except Exception as e:
-                print(f"Error occurred while deleting VPC: {str(e)}")
+                print_line(f"Error occurred while deleting VPC: {str(e)}")
         else:
-            print("Please provide the 'vpc_id' argument.")
+            print_line("Please provide the 'vpc_id' argument.")
     
+    # Deletes a VPC together with everything that keeps delete_vpc from succeeding.
+    # Dependents are found with one filtered describe per type (run in parallel) and
+    # removed in dependency waves; each wave's calls run in parallel, so the number
+    # of round trips depends on the depth of the graph, not on the number of objects.
+    def cascade_delete_vpc(self, vpc_id):
+        try:
+            dependencies = self.discover_vpc_dependencies(vpc_id)
+        except Exception as e:
+            print_line(f"Error occurred while describing VPC {vpc_id}: {str(e)}")
+            return
+
+        in_use = [eni['NetworkInterfaceId'] for eni in dependencies['network_interfaces'] if eni['Status'] != 'available']
+        if in_use:
+            print_line(f"VPC {vpc_id} has network interfaces in use: {', '.join(in_use)}. "
+                  f"Delete the instances, NAT gateways or load balancers using them first.")
+            return
+
+        print_line(f"Found {', '.join(f'{len(items)} {kind}' for kind, items in dependencies.items())} in VPC {vpc_id}")
+        for wave in self.vpc_teardown_waves(vpc_id, dependencies):
+            if not self.run_wave(wave):
+                print_line(f"Stopped deleting VPC {vpc_id}; fix the errors above and run the command again.")
+                return
+
+    def discover_vpc_dependencies(self, vpc_id):
+        lookups = {
+            'internet_gateways': ('describe_internet_gateways', 'attachment.vpc-id', 'InternetGateways'),
+            'route_tables': ('describe_route_tables', 'vpc-id', 'RouteTables'),
+            'subnets': ('describe_subnets', 'vpc-id', 'Subnets'),
+            'security_groups': ('describe_security_groups', 'vpc-id', 'SecurityGroups'),
+            'network_interfaces': ('describe_network_interfaces', 'vpc-id', 'NetworkInterfaces'),
+        }
+
+        def describe(operation, filter_name, items_key):
+            items = []
+            for page in ListManager.iter_pages(self.ec2_client, operation, Filters=[{'Name': filter_name, 'Values': [vpc_id]}]):
+                items.extend(page[items_key])
+            return items
+
+        futures = {kind: self.engine.submit(describe, *lookup) for kind, lookup in lookups.items()}
+        return {kind: future.result() for kind, future in futures.items()}
+
+    # Each wave is a list of (description, method, kwargs) that only depend on
+    # earlier waves.
+    def vpc_teardown_waves(self, vpc_id, dependencies):
+        route_tables = [table for table in dependencies['route_tables']
+                        if not any(association.get('Main') for association in table.get('Associations', []))]
+        security_groups = [group for group in dependencies['security_groups'] if group['GroupName'] != 'default']
+        group_ids = {group['GroupId'] for group in security_groups}
+
+        detach = []
+        for gateway in dependencies['internet_gateways']:
+            detach.append((f"Detached Internet Gateway: {gateway['InternetGatewayId']}", 'detach_internet_gateway',
+                           {'InternetGatewayId': gateway['InternetGatewayId'], 'VpcId': vpc_id}))
+        for table in dependencies['route_tables']:
+            for association in table.get('Associations', []):
+                if not association.get('Main') and association.get('SubnetId'):
+                    detach.append((f"Disassociated Route Table {table['RouteTableId']} from {association['SubnetId']}",
+                                   'disassociate_route_table', {'AssociationId': association['RouteTableAssociationId']}))
+        for eni in dependencies['network_interfaces']:
+            detach.append((f"Deleted Network Interface: {eni['NetworkInterfaceId']}", 'delete_network_interface',
+                           {'NetworkInterfaceId': eni['NetworkInterfaceId']}))
+        # Security groups that reference each other cannot be deleted until those
+        # rules are gone.
+        for group in dependencies['security_groups']:
+            for direction, operation in [('IpPermissions', 'revoke_security_group_ingress'),
+                                         ('IpPermissionsEgress', 'revoke_security_group_egress')]:
+                permissions = self.referencing_permissions(group.get(direction, []), group_ids)
+                if permissions:
+                    detach.append((f"Revoked {direction} rules of Security Group {group['GroupId']}", operation,
+                                   {'GroupId': group['GroupId'], 'IpPermissions': permissions}))
+
+        delete = []
+        for gateway in dependencies['internet_gateways']:
+            delete.append((f"Deleted Internet Gateway: {gateway['InternetGatewayId']}", 'delete_internet_gateway',
+                           {'InternetGatewayId': gateway['InternetGatewayId']}))
+        for table in route_tables:
+            delete.append((f"Deleted Route Table: {table['RouteTableId']}", 'delete_route_table',
+                           {'RouteTableId': table['RouteTableId']}))
+        for subnet in dependencies['subnets']:
+            delete.append((f"Deleted Subnet: {subnet['SubnetId']}", 'delete_subnet', {'SubnetId': subnet['SubnetId']}))
+        for group in security_groups:
+            delete.append((f"Deleted Security Group: {group['GroupId']}", 'delete_security_group', {'GroupId': group['GroupId']}))
+
+        return [detach, delete, [(f"Deleted VPC: {vpc_id}", 'delete_vpc', {'VpcId': vpc_id})]]
+
+    @staticmethod
+    def referencing_permissions(permissions, group_ids):
+        result = []
+        for permission in permissions:
+            pairs = [pair for pair in permission.get('UserIdGroupPairs', []) if pair.get('GroupId') in group_ids]
+            if pairs:
+                referencing = {key: permission[key] for key in ('IpProtocol', 'FromPort', 'ToPort') if key in permission}
+                referencing['UserIdGroupPairs'] = pairs
+                result.append(referencing)
+        return result
+
+    def run_wave(self, wave):
+        futures = [(description, operation, self.engine.submit(getattr(self.ec2_client, operation), **kwargs))
+                   for description, operation, kwargs in wave]
+        ok = True
+        for description, operation, future in futures:
+            try:
+                future.result()
+                print_line(description)
+            except Exception as e:
+                ok = False
+                print_line(f"Error occurred during {operation}: {str(e)}")
+        return ok
+
     def delete_subnet(self, args):
-        ec2_client = boto3.client('ec2')
         subnet_id = args.get('subnet_id')
 
         if subnet_id:
             try:
-                response = ec2_client.delete_subnet(SubnetId=subnet_id)
-                print(f"Delete Subnet: {subnet_id}")
+                response = self.ec2_client.delete_subnet(SubnetId=subnet_id)
+                print_line(f"Delete Subnet: {subnet_id}")
             except Exception as e:
-                print(f"Error occured while deleting Subnet: {str(e)}")
+                print_line(f"Error occured while deleting Subnet: {str(e)}")
         else:
-            print("Please provide the 'subnet_id' argument.")
+            print_line("Please provide the 'subnet_id' argument.")
     
     def delete_route_table(self, args):
-        ec2_client = boto3.client('ec2')
         route_table_id = args.get('route_table_id')
 
         if route_table_id:
             try:
-                response = ec2_client.delete_route_table(RouteTableId=route_table_id)
-                print(f"Delted Route Table: {route_table_id}")
+                response = self.ec2_client.delete_route_table(RouteTableId=route_table_id)
+                print_line(f"Delted Route Table: {route_table_id}")
             except Exception as e:
-                print(f"Error occured while deleting Route Table: {str(e)}")
+                print_line(f"Error occured while deleting Route Table: {str(e)}")
         else:
-            print("Please provide the 'route_table_id' argument.")
+            print_line("Please provide the 'route_table_id' argument.")
 
     def delete_internet_gateway(self, args):
-        ec2_client = boto3.client('ec2')
         internet_gateay_id = args.get('internet_gateway_id')
 
         if internet_gateay_id:
             try:
-                response = ec2_client.delete_internet_gateway(InternetGatewayId=internet_gateay_id)
-                print(f"Deleted Internet Gateway: {internet_gateay_id}")
+                response = self.ec2_client.delete_internet_gateway(InternetGatewayId=internet_gateay_id)
+                print_line(f"Deleted Internet Gateway: {internet_gateay_id}")
             except Exception as e:
-                print(f"Error occurdd while deleting Internet Gateway: {str(e)}")
+                print_line(f"Error occurdd while deleting Internet Gateway: {str(e)}")
         else:
-            print("Please provide the 'internet_gateway_id' argument.")
\ No newline at end of file
+            print_line("Please provide the 'internet_gateway_id' argument.")
\ No newline at end of file
@@ -0,0 +1,229 @@
+import contextvars
+import functools
+import random
+import threading
+import time
+
+DEFAULT_MAX_WORKERS = 8
+
+# Sustained calls per second and burst size for each service. EC2 and IAM follow
+# the account-level token buckets AWS documents for mutating API actions; S3 bucket
+# operations tolerate considerably more. Services not listed use DEFAULT_RATE.
+DEFAULT_RATES = {
+    'ec2': (20, 50),
+    'iam': (10, 20),
+    's3': (50, 100),
+    'sts': (20, 40),
+}
+DEFAULT_RATE = (20, 40)
+
+THROTTLING_ERROR_CODES = {
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestThrottled',
+    'RequestThrottledException',
+    'RequestLimitExceeded',
+    'TooManyRequestsException',
+    'SlowDown',
+    'PriorRequestNotComplete',
+    'BandwidthLimitExceeded',
+}
+
+# Errors worth another attempt however fast requests are sent; the same ones
+# botocore's standard retry mode treats as transient.
+TRANSIENT_ERROR_CODES = {'RequestTimeout', 'RequestTimeoutException', 'PriorRequestNotComplete'}
+TRANSIENT_STATUS_CODES = {500, 502, 503, 504}
+
+
+# Duck-typed on botocore's ClientError so this module can be imported without
+# pulling in botocore.
+def is_throttling_error(error):
+    response = getattr(error, 'response', None)
+    return isinstance(response, dict) and response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+
+
+# Throttles, transient error codes and 5xx responses, and failures to reach the
+# endpoint at all (botocore's connection and timeout errors).
+def is_retryable_error(error):
+    response = getattr(error, 'response', None)
+    if isinstance(response, dict):
+        return (is_throttling_error(error)
+                or response.get('Error', {}).get('Code') in TRANSIENT_ERROR_CODES
+                or response.get('ResponseMetadata', {}).get('HTTPStatusCode') in TRANSIENT_STATUS_CODES)
+    if not type(error).__module__.startswith('botocore'):
+        return False
+    from botocore.exceptions import ConnectionError, HTTPClientError
+    return isinstance(error, (ConnectionError, HTTPClientError))
+
+
+class TokenBucket:
+    # The refill rate never drops below this fraction of the configured rate.
+    MIN_RATE_FRACTION = 0.05
+
+    # Rates must be positive. A capacity under one token could never be acquired, so
+    # it is raised to one.
+    def __init__(self, rate, capacity):
+        if rate <= 0:
+            raise ValueError(f"Rate must be positive, got {rate}")
+        capacity = max(capacity, 1)
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reset(self, rate, capacity):
+        if rate <= 0:
+            raise ValueError(f"Rate must be positive, got {rate}")
+        capacity = max(capacity, 1)
+        with self.lock:
+            self.max_rate = rate
+            self.rate = rate
+            self.capacity = capacity
+            self.tokens = min(self.tokens, capacity)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    # Adaptive rate: halve on throttling, creep back up on success.
+    def throttled(self):
+        with self.lock:
+            self._refill()
+            self.rate = max(self.max_rate * self.MIN_RATE_FRACTION, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+
+    def succeeded(self):
+        with self.lock:
+            if self.rate < self.max_rate:
+                self._refill()
+                self.rate = min(self.max_rate, self.rate + self.max_rate * self.MIN_RATE_FRACTION)
+
+
+class ExecutionEngine:
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, rates=None, max_attempts=8, base_delay=0.5, max_delay=30):
+        self.max_workers = max_workers
+        self.rates = dict(DEFAULT_RATES)
+        self.rates.update(rates or {})
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.buckets = {}
+        self.pool = None
+        self.lock = threading.Lock()
+
+    def configure(self, max_workers=None, rates=None):
+        with self.lock:
+            if max_workers and max_workers != self.max_workers:
+                self.max_workers = max_workers
+                if self.pool is not None:
+                    self.pool.shutdown(wait=True)
+                    self.pool = None
+            for service, (rate, capacity) in (rates or {}).items():
+                self.rates[service] = (rate, capacity)
+                for (bucket_service, _, _), bucket in self.buckets.items():
+                    if bucket_service == service:
+                        bucket.reset(rate, capacity)
+
+    # AWS throttles each account and region separately, so each gets its own bucket.
+    def bucket(self, service, region=None, profile=None):
+        key = (service, region, profile)
+        with self.lock:
+            if key not in self.buckets:
+                rate, capacity = self.rates.get(service, DEFAULT_RATE)
+                self.buckets[key] = TokenBucket(rate, capacity)
+            return self.buckets[key]
+
+    # Work runs in a copy of the submitter's context (e.g. the tracing span it was
+    # submitted from), as it would have had it run inline.
+    def submit(self, fn, *args, **kwargs):
+        with self.lock:
+            if self.pool is None:
+                import concurrent.futures
+                self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+            return self.pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+    def map(self, fn, *iterables):
+        futures = [self.submit(fn, *args) for args in zip(*iterables)]
+        return [future.result() for future in futures]
+
+    def shutdown(self):
+        with self.lock:
+            if self.pool is not None:
+                self.pool.shutdown(wait=True)
+                self.pool = None
+
+    # Full-jitter exponential backoff.
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, fn, *args, **kwargs):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if not is_retryable_error(e) or attempt == self.max_attempts:
+                    raise
+                time.sleep(self.backoff(attempt))
+
+    # Every request made through the client, including those of its paginators and
+    # waiters, first takes a token from its service's bucket; the outcome of each
+    # call feeds the bucket's adaptive rate. Requests are retried here, by call(),
+    # and not by botocore as well: the client must come from
+    # get_client(..., retries=False), or each of the engine's attempts would be
+    # several of botocore's.
+    def limit(self, client, profile=None):
+        if '_make_api_call' in vars(client):
+            return client
+        service_model = client.meta.service_model
+        bucket = self.bucket(service_model.service_name, client.meta.region_name, profile)
+        service_id = service_model.service_id.hyphenize()
+        events = client.meta.events
+        events.register_first(f'before-call.{service_id}', functools.partial(_acquire, bucket), unique_id='sarmastack-rate-limit')
+        events.register(f'after-call.{service_id}', functools.partial(_record, bucket), unique_id='sarmastack-rate-adapt')
+        client._make_api_call = functools.partial(self._retrying_call, client._make_api_call, service_model)
+        return client
+
+    # botocore fills in idempotency tokens (run_instances' ClientToken, say) per
+    # call; filling them in first makes every attempt send the same one, so AWS
+    # does not act twice on a request whose first response was lost.
+    def _retrying_call(self, make_api_call, service_model, operation_name, api_params):
+        from botocore.handlers import generate_idempotent_uuid
+        generate_idempotent_uuid(api_params, service_model.operation_model(operation_name))
+        return self.call(make_api_call, operation_name, api_params)
+
+
+def _acquire(bucket, **kwargs):
+    bucket.acquire()
+
+
+def _record(bucket, http_response, parsed, **kwargs):
+    if parsed.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES:
+        bucket.throttled()
+    elif http_response.status_code < 300:
+        bucket.succeeded()
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = ExecutionEngine()
+        return _engine
@@ -0,0 +1,190 @@
+import glob
+import json
+import os
+import re
+import threading
+import time
+
+# Rows printed by the list-* commands are cached on disk per resource type, so
+# running the same listing again within its TTL reads the cache instead of AWS.
+# They are stored as JSON lines (the time they were fetched, then one row per
+# line), so reading a cache file never runs code and neither writing nor reading
+# one holds a whole listing in memory. Timestamps are kept as the text every
+# output format prints them as.
+# SARMASTACK_INVENTORY_CACHE=0 turns the cache off.
+INVENTORY_DIR = os.environ.get('SARMASTACK_INVENTORY_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'sarmastack', 'inventory'))
+INVENTORY_ENABLED = os.environ.get('SARMASTACK_INVENTORY_CACHE', '1') != '0'
+
+# Seconds a listing stays fresh. Instance state changes on its own (an instance
+# moves from pending to running), so instances expire soonest.
+DEFAULT_TTLS = {
+    'instances': 30,
+    'buckets': 300,
+    'iam_users': 600,
+    'iam_roles': 600,
+    'vpcs': 300,
+    'subnets': 300,
+    'route_tables': 300,
+    'internet_gateways': 300,
+    'regions': 86400,
+}
+DEFAULT_TTL = 60
+
+# API operations that change what a listing shows. When SarmaStack makes one of
+# these calls successfully, the cached listings it affects are dropped.
+MUTATIONS = {
+    'RunInstances': ['instances'],
+    'StartInstances': ['instances'],
+    'StopInstances': ['instances'],
+    'TerminateInstances': ['instances'],
+    'ModifyInstanceAttribute': ['instances'],
+    'CreateTags': ['instances', 'vpcs', 'subnets', 'route_tables', 'internet_gateways'],
+    'CreateBucket': ['buckets'],
+    'DeleteBucket': ['buckets'],
+    'CreateUser': ['iam_users'],
+    'DeleteUser': ['iam_users'],
+    'CreateRole': ['iam_roles'],
+    'DeleteRole': ['iam_roles'],
+    'CreateVpc': ['vpcs', 'route_tables'],
+    'DeleteVpc': ['vpcs', 'route_tables'],
+    'CreateSubnet': ['subnets'],
+    'DeleteSubnet': ['subnets', 'route_tables'],
+    'CreateRouteTable': ['route_tables'],
+    'DeleteRouteTable': ['route_tables'],
+    'CreateRoute': ['route_tables'],
+    'ReplaceRoute': ['route_tables'],
+    'AssociateRouteTable': ['route_tables'],
+    'DisassociateRouteTable': ['route_tables'],
+    'CreateInternetGateway': ['internet_gateways'],
+    'DeleteInternetGateway': ['internet_gateways', 'route_tables'],
+    'AttachInternetGateway': ['internet_gateways'],
+    'DetachInternetGateway': ['internet_gateways'],
+}
+
+
+# Cached listings are kept apart per profile (or assumed role) and region. A
+# region set in the environment is used as it is, since it overrides the one in
+# the AWS config files; otherwise the region the profile's session resolves to is
+# part of the key, so changing it in ~/.aws/config never serves the old region's
+# rows. The session is the registry's, and is reused by the listing itself.
+def scope(region=None, profile=None):
+    region = region or os.environ.get('AWS_REGION') or os.environ.get('AWS_DEFAULT_REGION') or session_region(profile) or 'default'
+    profile = profile or os.environ.get('AWS_PROFILE') or 'default'
+    return re.sub(r'[^\w.-]', '_', f'{profile}-{region}')
+
+
+def session_region(profile=None):
+    from clients import get_session
+    return get_session(profile).region_name
+
+
+def cache_file(resource_type, region=None, profile=None):
+    return os.path.join(INVENTORY_DIR, scope(region, profile), f'{resource_type}.jsonl')
+
+
+class Inventory:
+    def __init__(self, max_age=None, refresh=False):
+        self.max_age = max_age
+        self.refresh = refresh
+
+    def configure(self, max_age=None, refresh=False):
+        self.max_age = max_age
+        self.refresh = refresh
+
+    def ttl(self, resource_type):
+        if self.max_age is not None:
+            return self.max_age
+        return DEFAULT_TTLS.get(resource_type, DEFAULT_TTL)
+
+    # Rows for resource_type: from the cache while it is fresh, otherwise from
+    # fetch(), streamed through and cached once fully read. Either way rows are
+    # handed on one at a time, so a listing never has to fit in memory.
+    def rows(self, resource_type, fetch, region=None, profile=None):
+        if INVENTORY_ENABLED and not self.refresh:
+            cached = self.read(resource_type, region, profile)
+            if cached is not None:
+                return cached
+        return self.read_through(resource_type, fetch(), region, profile)
+
+    # Each row is written to a temporary file as it goes by; the file only replaces
+    # the cached one once the listing has been read to the end.
+    def read_through(self, resource_type, rows, region=None, profile=None):
+        if not INVENTORY_ENABLED:
+            yield from rows
+            return
+        target = cache_file(resource_type, region, profile)
+        tmp_file = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            f = open(tmp_file, 'w')
+            f.write(json.dumps({'fetched_at': time.time()}) + '\n')
+        except OSError:
+            yield from rows
+            return
+        complete = False
+        try:
+            for row in rows:
+                if f is not None:
+                    try:
+                        f.write(json.dumps(row, default=str) + '\n')
+                    except OSError:
+                        # The cache is only an optimization; a full disk is fine.
+                        f.close()
+                        f = None
+                yield row
+            complete = f is not None
+        finally:
+            if f is not None:
+                f.close()
+            try:
+                if complete:
+                    os.replace(tmp_file, target)
+                else:
+                    os.remove(tmp_file)
+            except OSError:
+                pass
+
+    # Returns an iterator over the cached rows, or None if there are none or they
+    # are stale.
+    def read(self, resource_type, region=None, profile=None):
+        try:
+            f = open(cache_file(resource_type, region, profile), 'r')
+        except Exception:
+            return None
+        try:
+            fetched_at = json.loads(f.readline())['fetched_at']
+        except Exception:
+            f.close()
+            return None
+        if time.time() - fetched_at > self.ttl(resource_type):
+            f.close()
+            return None
+        return self.iter_file(f)
+
+    @staticmethod
+    def iter_file(f):
+        with f:
+            for line in f:
+                yield json.loads(line)
+
+
+# Drops the cached listings for the given resource types in every profile and
+# region, or all of them if none are given.
+def invalidate(*resource_types):
+    for resource_type in resource_types or ['*']:
+        for path in glob.glob(os.path.join(INVENTORY_DIR, '*', f'{resource_type}.jsonl')):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def invalidate_after_call(model, http_response, **kwargs):
+    resource_types = MUTATIONS.get(model.name)
+    if resource_types and http_response is not None and http_response.status_code < 300:
+        invalidate(*resource_types)
+
+
+# Registered on every client built by the client registry.
+def track_mutations(client):
+    client.meta.events.register('after-call', invalidate_after_call, unique_id='sarmastack-inventory')
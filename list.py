@@ -1,198 +1,253 @@
-import boto3
-from tabulate import tabulate 
+import concurrent.futures
+import queue
+import sys
+from clients import account_label, lazy_client
+from executor import get_engine
+from inventory import Inventory
+from output import write_rows
 
 class ListManager:
-    def __init__(self):
-        self.s3_client = boto3.client('s3')
-        self.iam_client = boto3.client('iam')
-        self.ec2_client = boto3.client('ec2')
+    s3_client = lazy_client('s3')
+    iam_client = lazy_client('iam')
+    ec2_client = lazy_client('ec2')
 
-    def list_buckets(self):
-        try:
-            response = self.s3_client.list_buckets()
-            buckets = response['Buckets']
-            table_data = []
-
-            if buckets:
-                for bucket in buckets:
-                    bucket_name = bucket['Name']
-                    creation_date = bucket['CreationDate']
-                    table_data.append([bucket_name, creation_date])
-                    
-                headers = ['Bucket Name', 'Creation Date']
-                print(tabulate(table_data, headers, tablefmt="fancy_grid"))
+    # Most (account, region) pairs listed at the same time.
+    MAX_CONCURRENT_LISTINGS = 32
+
+    # Every listing, by inventory resource type: the method yielding its rows, the
+    # column headers, and whether it is listed per region.
+    LISTINGS = {
+        'buckets': {'iter': 'iter_buckets', 'headers': ['Bucket Name', 'Creation Date'], 'regional': False},
+        'iam_users': {'iter': 'iter_iam_users', 'headers': ['User Name'], 'regional': False},
+        'iam_roles': {'iter': 'iter_iam_roles', 'headers': ['Role Name'], 'regional': False},
+        'instances': {'iter': 'iter_instances', 'headers': ['Instance Name', 'Instance ID', 'Instance Type', 'State', 'Launch Time'], 'regional': True},
+        'vpcs': {'iter': 'iter_vpcs', 'headers': ['Name', 'ID', 'Cidr Block', 'State'], 'regional': True},
+        'subnets': {'iter': 'iter_subnets', 'headers': ['Name', 'ID', 'VPC ID', 'Cidr Block', 'Availability Zone', 'State'], 'regional': True},
+        'route_tables': {'iter': 'iter_route_tables', 'headers': ['Route Table Name', 'Route Table ID & Destination', 'VPC ID & Target'], 'regional': True},
+        'internet_gateways': {'iter': 'iter_internet_gateways', 'headers': ['Name', 'ID'], 'regional': True},
+    }
+
+    def __init__(self, inventory=None, region=None, profile=None, engine=None):
+        self.inventory = inventory or Inventory()
+        self.region = region
+        self.profile = profile
+        self.engine = engine or get_engine()
+        # {resource_type: {target: error}} for accounts and regions that failed.
+        self.errors = {}
+
+    # Yields one response page at a time so rows can be streamed out as soon as the
+    # first page arrives. Operations without a paginator are called once.
+    @staticmethod
+    def iter_pages(client, operation, **kwargs):
+        if client.can_paginate(operation):
+            paginator = client.get_paginator(operation)
+            yield from paginator.paginate(**kwargs)
+        else:
+            yield getattr(client, operation)(**kwargs)
+
+    # Regions for a --regions value: 'all' is every region enabled for the account,
+    # anything else a comma-separated list.
+    def resolve_regions(self, regions):
+        if regions == 'all':
+            return [row[0] for row in self.inventory.rows('regions', self.iter_enabled_regions, profile=self.profile)]
+        return [region.strip() for region in regions.split(',') if region.strip()]
+
+    def iter_enabled_regions(self):
+        response = self.ec2_client.describe_regions(
+            Filters=[{'Name': 'opt-in-status', 'Values': ['opt-in-not-required', 'opted-in']}]
+        )
+        for region in sorted(region['RegionName'] for region in response['Regions']):
+            yield [region]
+
+    # Rows of a listing from the default account and region or, with accounts and/or
+    # regions, from every (account, region) pair at once. Each pair is listed (and
+    # cached) on its own worker, and rows are prefixed with their account and region
+    # and merged in the order they arrive, so the slowest pair sets the wall-clock
+    # time instead of the sum of all of them. Calls from every pair go through the
+    # shared engine, which rate limits each account and region on its own. Returns
+    # (rows, headers).
+    def listing(self, resource_type, regions=None, accounts=None):
+        iter_name = self.LISTINGS[resource_type]['iter']
+        headers = self.LISTINGS[resource_type]['headers']
+        if not regions and not accounts:
+            return self.inventory.rows(resource_type, getattr(self, iter_name), self.region, self.profile), headers
+        profiles = accounts or [self.profile]
+        # The regions enabled for the first account stand in for all of them.
+        region_names = ListManager(self.inventory, None, profiles[0], self.engine).resolve_regions(regions) if regions else [self.region]
+        targets = [(profile, region) for profile in profiles for region in region_names]
+        prefix_headers = (['Account'] if accounts else []) + (['Region'] if regions else [])
+        return self.merge(resource_type, iter_name, targets, bool(accounts), bool(regions)), prefix_headers + headers
+
+    def merge(self, resource_type, iter_name, targets, label_accounts, label_regions):
+        rows = queue.Queue()
+        errors = {}
+
+        def list_target(profile, region):
+            prefix = ([account_label(profile)] if label_accounts else []) + ([region] if label_regions else [])
+            try:
+                manager = ListManager(self.inventory, region, profile, self.engine)
+                for row in self.inventory.rows(resource_type, getattr(manager, iter_name), region, profile):
+                    rows.put(prefix + row)
+            except Exception as e:
+                errors[' '.join(prefix)] = e
+            finally:
+                rows.put(None)
+
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=min(self.MAX_CONCURRENT_LISTINGS, len(targets)))
+        for profile, region in targets:
+            pool.submit(list_target, profile, region)
+        pool.shutdown(wait=False)
+        remaining = len(targets)
+        while remaining:
+            row = rows.get()
+            if row is None:
+                remaining -= 1
             else:
-                print("No buckets found.")
+                yield row
+        # An account or region that fails (e.g. one the credentials cannot reach)
+        # does not hide the others.
+        if errors:
+            self.errors[resource_type] = {target: str(error) for target, error in errors.items()}
+        for target, error in sorted(errors.items()):
+            print(f"Error occurred while listing {resource_type} in {target}: {str(error)}", file=sys.stderr)
+
+    def iter_buckets(self):
+        for page in self.iter_pages(self.s3_client, 'list_buckets'):
+            for bucket in page['Buckets']:
+                yield [bucket['Name'], bucket['CreationDate']]
+
+    def iter_iam_users(self):
+        for page in self.iter_pages(self.iam_client, 'list_users'):
+            for user in page['Users']:
+                yield [user['UserName']]
+
+    def iter_iam_roles(self):
+        for page in self.iter_pages(self.iam_client, 'list_roles'):
+            for role in page['Roles']:
+                yield [role['RoleName']]
+
+    def iter_instances(self):
+        for page in self.iter_pages(self.ec2_client, 'describe_instances'):
+            for reservation in page['Reservations']:
+                for instance in reservation['Instances']:
+                    instance_id = instance['InstanceId']
+                    instance_type = instance['InstanceType']
+                    state = instance['State']['Name']
+                    launch_time = instance['LaunchTime'].strftime('%Y-%m-%d %H:%M:%S')
+                    instance_name = self.get_name_tag(instance)
+                    yield [instance_name, instance_id, instance_type, state, launch_time]
+
+    def iter_vpcs(self):
+        for page in self.iter_pages(self.ec2_client, 'describe_vpcs'):
+            for vpc in page['Vpcs']:
+                vpc_id = vpc['VpcId']
+                cidr_block = vpc['CidrBlock']
+                state = vpc['State']
+                vpc_name = self.get_name_tag(vpc)
+                yield [vpc_name, vpc_id, cidr_block, state]
+
+    def iter_subnets(self):
+        for page in self.iter_pages(self.ec2_client, 'describe_subnets'):
+            for subnet in page['Subnets']:
+                subnet_id = subnet['SubnetId']
+                vpc_id = subnet['VpcId']
+                cidr_block = subnet['CidrBlock']
+                state = subnet['State']
+                availability_zone = subnet['AvailabilityZone']
+                subnet_name = self.get_name_tag(subnet)
+                yield [subnet_name, subnet_id, vpc_id, cidr_block, availability_zone, state]
+
+    def iter_route_tables(self):
+        for page in self.iter_pages(self.ec2_client, 'describe_route_tables'):
+            for route_table in page['RouteTables']:
+                route_table_id = route_table['RouteTableId']
+                vpc_id = route_table['VpcId']
+                routes = route_table['Routes']
+                associations = route_table['Associations']
+                route_table_name = self.get_name_tag(route_table)
+
+                yield [route_table_name, route_table_id, vpc_id]
+
+                for route in routes:
+                    destination_cidr_block = route.get('DestinationCidrBlock')
+                    gateway_id = route.get('GatewayId')
+                    if destination_cidr_block and gateway_id:
+                        yield ["", destination_cidr_block, gateway_id]
+
+                        for association in associations:
+                            subnet_id = association.get('SubnetId')
+                            main = association.get('Main')
+                            if subnet_id:
+                                yield ["", f"Subnet ID: {subnet_id}", f"Main: {main}"]
+
+    def iter_internet_gateways(self):
+        for page in self.iter_pages(self.ec2_client, 'describe_internet_gateways'):
+            for internet_gateway in page['InternetGateways']:
+                internet_gateway_id = internet_gateway['InternetGatewayId']
+                internet_gateway_name = self.get_name_tag(internet_gateway)
+                yield [internet_gateway_name, internet_gateway_id]
+
+    def list_buckets(self, output='table', accounts=None):
+        try:
+            rows, headers = self.listing('buckets', accounts=accounts)
+            write_rows(rows, headers, output, "No buckets found.")
         except Exception as e:
             print(f"Error occurred while listing buckets: {str(e)}")
 
-    def list_iam_users(self):
+    def list_iam_users(self, output='table', accounts=None):
         try:
-            response = self.iam_client.list_users()
-            users = response['Users']
-            table_data = []
-            
-            if users:
-                for user in users:
-                    user_name = user['UserName']
-                    table_data.append([user_name])
-                
-                headers = ['User Name']
-                print(tabulate(table_data, headers, tablefmt="fancy_grid"))
-            else:
-                print("No IAM users found.")
+            rows, headers = self.listing('iam_users', accounts=accounts)
+            write_rows(rows, headers, output, "No IAM users found.")
         except Exception as e:
             print(f"Error occurred while listing IAM users: {str(e)}")
-    
-    def list_iam_roles(self):
+
+    def list_iam_roles(self, output='table', accounts=None):
         try:
-            response = self.iam_client.list_roles()
-            roles = response['Roles']
-            table_data = []
-
-            if roles:
-                for role in roles:
-                    role_name = role['RoleName']
-                    table_data.append([role_name])
-                
-                headers = ['Role Name']
-                print(tabulate(table_data, headers, tablefmt='fancy_grid'))
-            else:
-                print("No IAM roles found.")
+            rows, headers = self.listing('iam_roles', accounts=accounts)
+            write_rows(rows, headers, output, "No IAM roles found.")
         except Exception as e:
             print(f"Error occurred while listing IAM : {str(e)}")
-    
-    def list_instances(self):
-        response = self.ec2_client.describe_instances()
-        instances = response['Reservations']
-        table_data = []
-
-        if instances:
-            for reservation in instances:
-                for instance in reservation['Instances']:
-                    instance_id = instance['InstanceId']
-                    instance_type = instance['InstanceType']
-                    state = instance['State']['Name']
-                    launch_time = instance['LaunchTime'].strftime('%Y-%m-%d %H:%M:%S')
-                    tags_response = self.ec2_client.describe_tags(Filters=[{'Name': 'resource-id', 'Values': [instance_id]}])
-                    tags = {tag['Key']: tag['Value'] for tag in tags_response['Tags']}
-                    instance_name = tags.get('Name', 'N/A')
-                    table_data.append([instance_name, instance_id, instance_type, state, launch_time])
-
-            headers = ['Instance Name', 'Instance ID', 'Instance Type', 'State', 'Launch Time']
-            if table_data:
-                print(tabulate(table_data, headers, tablefmt="fancy_grid"))
-            else:
-                print("No instances found.")
-        else:
-            print("No instances found.")
-        
-    def list_vpcs(self):
+
+    def list_instances(self, output='table', regions=None, accounts=None):
+        rows, headers = self.listing('instances', regions, accounts)
+        write_rows(rows, headers, output, "No instances found.")
+
+    def list_vpcs(self, output='table', regions=None, accounts=None):
         try:
-            response = self.ec2_client.describe_vpcs()
-            vpcs = response['Vpcs']
-            table_data = []
-            
-            if vpcs:
-                for vpc in vpcs:
-                    vpc_id = vpc['VpcId']
-                    cidr_block = vpc['CidrBlock']
-                    state = vpc['State']
-                    tags_response = self.ec2_client.describe_tags(Filters=[{'Name': 'resource-id', 'Values': [vpc_id]}])
-                    tags = {tag['Key']: tag['Value'] for tag in tags_response['Tags']}
-                    vpc_name = tags.get('Name', 'N/A')                
-                    table_data.append([vpc_name, vpc_id, cidr_block, state])
-                
-                headers = ['Name', 'ID', 'Cidr Block', 'State']
-                print(tabulate(table_data, headers, tablefmt='fancy_grid'))
-            else:
-                print("No VPCs found.")
+            rows, headers = self.listing('vpcs', regions, accounts)
+            write_rows(rows, headers, output, "No VPCs found.")
         except Exception as e:
             print(f"Error occurred while listing VPCs: {str(e)}")
-    
-    def list_subnets(self):
+
+    def list_subnets(self, output='table', regions=None, accounts=None):
         try:
-            response = self.ec2_client.describe_subnets()
-            subnets = response['Subnets']
-            table_data = []
-            
-            if subnets:
-                for subnet in subnets:
-                    subnet_id = subnet['SubnetId']
-                    vpc_id = subnet['VpcId']
-                    cidr_block = subnet['CidrBlock']
-                    state = subnet['State']
-                    availability_zone = subnet['AvailabilityZone']
-                    tags_response = self.ec2_client.describe_tags(Filters=[{'Name': 'resource-id', 'Values': [subnet_id]}])
-                    tags = {tag['Key']: tag['Value'] for tag in tags_response['Tags']}
-                    subnet_name = tags.get('Name', 'N/A')
-                    table_data.append([subnet_name, subnet_id, vpc_id, cidr_block, availability_zone, state])
-                
-                headers = ['Name', 'ID', 'VPC ID', 'Cidr Block', 'Availability Zone', 'State']
-                print(tabulate(table_data, headers, tablefmt='fancy_grid'))
-            else:
-                print("No Subnets found.")
+            rows, headers = self.listing('subnets', regions, accounts)
+            write_rows(rows, headers, output, "No Subnets found.")
         except Exception as e:
-            print(f"Error occurred while listing Subnets: {str(e)}")   
-    
-    def list_route_tables(self):
+            print(f"Error occurred while listing Subnets: {str(e)}")
+
+    def list_route_tables(self, output='table', regions=None, accounts=None):
         try:
-            response = self.ec2_client.describe_route_tables()
-            route_tables = response['RouteTables']
-            table_data = []
-            
-            if route_tables:
-                for route_table in route_tables:
-                    route_table_id = route_table['RouteTableId']
-                    vpc_id = route_table['VpcId']
-                    routes = route_table['Routes']
-                    associations = route_table['Associations']
-                    tags_response = self.ec2_client.describe_tags(Filters=[{'Name': 'resource-id', 'Values': [route_table_id]}])
-                    tags = {tag['Key']: tag['Value'] for tag in tags_response['Tags']}
-                    route_table_name = tags.get('Name', 'N/A')
-                    
-                    table_data.append([route_table_name, route_table_id, vpc_id])
-                    
-                    for route in routes:
-                        destination_cidr_block = route.get('DestinationCidrBlock')
-                        gateway_id = route.get('GatewayId')
-                        if destination_cidr_block and gateway_id:
-                            table_data.append(["", destination_cidr_block, gateway_id])
-                            
-                            for association in associations:
-                                subnet_id = association.get('SubnetId')
-                                main = association.get('Main')
-                                if subnet_id:
-                                    table_data.append(["", f"Subnet ID: {subnet_id}", f"Main: {main}"])
-
-                headers = ['Route Table Name', 'Route Table ID & Destination', 'VPC ID & Target']
-                print(tabulate(table_data, headers, tablefmt="fancy_grid"))
-            else:
-                print("No Route Tables found.")
+            rows, headers = self.listing('route_tables', regions, accounts)
+            write_rows(rows, headers, output, "No Route Tables found.")
         except Exception as e:
             print(f"Error occurred while listing Route Tables: {str(e)}")
-    
-    def list_internet_gateways(self):
+
+    def list_internet_gateways(self, output='table', regions=None, accounts=None):
         try:
-            response = self.ec2_client.describe_internet_gateways()
-            internetgateways = response['InternetGateways']
-            table_data = []
-
-            if internetgateways:
-                for intertgateway in internetgateways:
-                    internetgateway_id = intertgateway['InternetGatewayId']
-                    tags_response = self.ec2_client.describe_tags(Filters=[{'Name': 'resource-id', 'Values': [internetgateway_id]}])
-                    tags = {tag['Key']: tag['Value'] for tag in tags_response['Tags']}
-                    internetgateway_name = tags.get('Name', 'N/A')
-                    table_data.append([internetgateway_name, internetgateway_id])
-                
-                headers = ['Name', 'ID']
-                print(tabulate(table_data, headers, tablefmt='fancy_grid'))
-            else:
-                print("No Internet Gateways Found.")
+            rows, headers = self.listing('internet_gateways', regions, accounts)
+            write_rows(rows, headers, output, "No Internet Gateways Found.")
         except Exception as e:
             print(f"Error occured while listing Internet Gateways: {str(e)}")
 
+    # EC2 describe responses already carry each resource's tags inline (the key is
+    # simply absent for untagged resources), so no per-row describe_tags is needed.
+    @staticmethod
+    def get_name_tag(resource, default='N/A'):
+        for tag in resource.get('Tags', []):
+            if tag['Key'] == 'Name':
+                return tag['Value']
+        return default
 
     @staticmethod
     def get_location_constraint(region):
@@ -203,4 +258,4 @@ class ListManager:
             'us-west-2': 'us-west-2',
             'eu-west-1': 'EU',
         }
-        return region_mapping.get(region, region)
\ No newline at end of file
+        return region_mapping.get(region, region)
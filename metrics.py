@@ -0,0 +1,244 @@
+import bisect
+import json
+import os
+import sys
+import threading
+import time
+import urllib.parse
+from executor import THROTTLING_ERROR_CODES
+
+# Per-call instrumentation of every AWS API call, off unless --metrics or
+# --metrics-out is given. Handlers sit on the botocore event system of each session
+# the client registry creates, so every client (including the STS clients that
+# assume roles) reports through them.
+METRICS_FORMATS = ['json', 'prom']
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+
+class CallStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.throttles = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def observe(self, seconds):
+        self.calls += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    # Upper bound of the bucket holding the q-th quantile; the slowest call when it
+    # falls in the last (unbounded) bucket.
+    def quantile(self, q):
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            seen += count
+            if seen >= q * self.calls:
+                return min(bound, self.max_seconds)
+        return self.max_seconds
+
+
+class Metrics:
+    def __init__(self):
+        self.stats = {}
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    # botocore copies a session's handlers into every client it creates. Within an
+    # API call, before-call runs once the rate limiter has let it through and
+    # after-call (after-call-error if it raised) once botocore's own retries are
+    # over; needs-retry runs after every attempt in between.
+    def instrument(self, session):
+        session.register('before-call', self.before_call, unique_id='sarmastack-metrics-start')
+        session.register('needs-retry', self.needs_retry, unique_id='sarmastack-metrics-retry')
+        session.register('after-call', self.after_call, unique_id='sarmastack-metrics-end')
+        session.register('after-call-error', self.after_call_error, unique_id='sarmastack-metrics-error')
+
+    def before_call(self, model, params, context, **kwargs):
+        context['metrics_key'] = (model.service_model.service_name, model.name)
+        context['metrics_started'] = time.perf_counter()
+        context['metrics_request_bytes'] = request_size(params.get('body'))
+
+    def needs_retry(self, request_dict, attempts, response=None, **kwargs):
+        context = request_dict.get('context', {})
+        context['metrics_attempts'] = attempts
+        if response is not None and error_code(response[1]) in THROTTLING_ERROR_CODES:
+            context['metrics_throttles'] = context.get('metrics_throttles', 0) + 1
+
+    def after_call(self, http_response, parsed, context, **kwargs):
+        failed = http_response is None or http_response.status_code >= 300
+        self.record(context, failed, error_code(parsed) in THROTTLING_ERROR_CODES, response_size(http_response))
+
+    def after_call_error(self, exception, context, **kwargs):
+        self.record(context, True, False, 0)
+
+    def record(self, context, failed, throttled, response_bytes):
+        if 'metrics_started' not in context:
+            return
+        seconds = time.perf_counter() - context['metrics_started']
+        if 'metrics_attempts' in context:
+            retries = context['metrics_attempts'] - 1
+            throttles = context.get('metrics_throttles', 0)
+        else:
+            # Answered without going through botocore's endpoint (e.g. by a stub).
+            retries = 0
+            throttles = int(throttled)
+        with self.lock:
+            stats = self.stats.setdefault(context['metrics_key'], CallStats())
+            stats.observe(seconds)
+            stats.errors += int(failed)
+            stats.retries += retries
+            stats.throttles += throttles
+            stats.request_bytes += context.get('metrics_request_bytes', 0)
+            stats.response_bytes += response_bytes
+
+    def snapshot(self):
+        with self.lock:
+            return sorted(self.stats.items())
+
+    def to_json(self):
+        return {
+            'wall_seconds': round(time.monotonic() - self.started, 3),
+            'latency_buckets': LATENCY_BUCKETS,
+            'operations': [
+                {
+                    'service': service,
+                    'operation': operation,
+                    'calls': stats.calls,
+                    'errors': stats.errors,
+                    'retries': stats.retries,
+                    'throttles': stats.throttles,
+                    'request_bytes': stats.request_bytes,
+                    'response_bytes': stats.response_bytes,
+                    'seconds_total': round(stats.seconds, 6),
+                    'seconds_max': round(stats.max_seconds, 6),
+                    'histogram': stats.buckets,
+                }
+                for (service, operation), stats in self.snapshot()
+            ],
+        }
+
+    # Prometheus text exposition format, as read by node_exporter's textfile
+    # collector.
+    def to_prometheus(self):
+        operations = self.snapshot()
+        lines = [
+            '# HELP sarmastack_aws_call_duration_seconds Time spent in AWS API calls, including botocore retries.',
+            '# TYPE sarmastack_aws_call_duration_seconds histogram',
+        ]
+        for (service, operation), stats in operations:
+            labels = f'service="{service}",operation="{operation}"'
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ['+Inf'], stats.buckets):
+                cumulative += count
+                lines.append(f'sarmastack_aws_call_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'sarmastack_aws_call_duration_seconds_sum{{{labels}}} {stats.seconds:.6f}')
+            lines.append(f'sarmastack_aws_call_duration_seconds_count{{{labels}}} {stats.calls}')
+        counters = [
+            ('errors', 'AWS API calls that failed.'),
+            ('retries', 'Attempts botocore retried.'),
+            ('throttles', 'Attempts that were throttled.'),
+            ('request_bytes', 'Bytes sent in AWS API requests.'),
+            ('response_bytes', 'Bytes received in AWS API responses.'),
+        ]
+        for name, help_text in counters:
+            lines.append(f'# HELP sarmastack_aws_{name}_total {help_text}')
+            lines.append(f'# TYPE sarmastack_aws_{name}_total counter')
+            for (service, operation), stats in operations:
+                lines.append(f'sarmastack_aws_{name}_total{{service="{service}",operation="{operation}"}} {getattr(stats, name)}')
+        lines.append('# HELP sarmastack_wall_seconds Wall-clock time of the SarmaStack run.')
+        lines.append('# TYPE sarmastack_wall_seconds gauge')
+        lines.append(f'sarmastack_wall_seconds {time.monotonic() - self.started:.3f}')
+        return '\n'.join(lines) + '\n'
+
+    # Written to a temporary file and moved into place, so a collector never reads a
+    # half-written file. Files ending in .prom get the Prometheus format.
+    def write(self, path, output_format=None):
+        output_format = output_format or ('prom' if path.endswith('.prom') else 'json')
+        tmp_file = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w') as f:
+            if output_format == 'prom':
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.to_json(), f, indent=2)
+        os.replace(tmp_file, path)
+
+    # Calls run on many workers at once, so 'API seconds' can add up to more than
+    # the wall-clock time; far less than it points at time spent outside AWS.
+    def report(self, stream=None):
+        from tabulate import tabulate
+        stream = stream or sys.stderr
+        operations = self.snapshot()
+        table_data = [
+            [service, operation, stats.calls, stats.errors, stats.retries, stats.throttles,
+             f"{stats.seconds / stats.calls * 1000:.1f}", f"{stats.quantile(0.5) * 1000:.0f}", f"{stats.quantile(0.95) * 1000:.0f}",
+             f"{stats.max_seconds * 1000:.1f}", f"{stats.seconds:.2f}", stats.request_bytes, stats.response_bytes]
+            for (service, operation), stats in operations
+        ]
+        headers = ['Service', 'Operation', 'Calls', 'Errors', 'Retries', 'Throttles', 'Mean ms', 'p50 ms', 'p95 ms',
+                   'Max ms', 'API Seconds', 'Bytes Out', 'Bytes In']
+        print(tabulate(table_data, headers, tablefmt="fancy_grid"), file=stream)
+        calls = sum(stats.calls for _, stats in operations)
+        seconds = sum(stats.seconds for _, stats in operations)
+        print(f"{calls} AWS API calls, {seconds:.2f}s in calls, {time.monotonic() - self.started:.2f}s wall-clock.", file=stream)
+
+    def finish(self, show=True, path=None):
+        if show:
+            self.report()
+        if path:
+            self.write(path)
+            print(f"Wrote metrics to {path}", file=sys.stderr)
+
+
+def error_code(parsed):
+    return parsed.get('Error', {}).get('Code') if isinstance(parsed, dict) else None
+
+
+# Query-protocol services (EC2, IAM, STS) hand the body over as a dict of
+# parameters that is form-encoded later.
+def request_size(body):
+    if isinstance(body, dict):
+        return len(urllib.parse.urlencode(body))
+    if isinstance(body, (bytes, str)):
+        return len(body)
+    return 0
+
+
+# Taken from Content-Length so streamed bodies (S3 objects) are never read here.
+def response_size(http_response):
+    if http_response is None:
+        return 0
+    try:
+        return int(http_response.headers.get('content-length') or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def enable_metrics():
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics()
+        return _metrics
+
+
+def get_metrics():
+    return _metrics
+
+
+# Called by the client registry for every session it creates.
+def instrument_session(session):
+    if _metrics is not None:
+        _metrics.instrument(session)
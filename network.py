@@ -1,65 +1,80 @@
-import boto3
+from clients import lazy_client
+from executor import get_engine
+from output import print_line
 
 class NetworkManager:
-    def __init__(self):
-        self.ec2_client = boto3.client('ec2')
-        self.vpc_client = boto3.client('ec2')
+    ec2_client = lazy_client('ec2')
+    vpc_client = lazy_client('ec2')
+
+    def __init__(self, engine=None, region=None):
+        self.engine = engine or get_engine()
+        self.region = region
+
+    # Tags are applied by the create call itself, so naming a resource costs no
+    # extra create_tags round trip.
+    @staticmethod
+    def tag_specifications(resource_type, name):
+        if not name:
+            return []
+        return [
+            {
+                'ResourceType': resource_type,
+                'Tags': [
+                    {
+                        'Key': 'Name',
+                        'Value': name
+                    }
+                ]
+            }
+        ]
 
     def create_vpc(self, vpc_name, cidr_block):
         response = self.vpc_client.create_vpc(
-            CidrBlock=cidr_block
+            CidrBlock=cidr_block,
+            TagSpecifications=self.tag_specifications('vpc', vpc_name)
         )
         vpc_id = response['Vpc']['VpcId']
 
-        self.vpc_client.create_tags(
-            Resources=[vpc_id],
-            Tags=[
-                {
-                    'Key': 'Name',
-                    'Value': vpc_name
-                }
-            ]
-        )
-
-        print(f"Created VPC with Name: {vpc_name} and ID: {vpc_id}")
+        print_line(f"Created VPC with Name: {vpc_name} and ID: {vpc_id}")
+        return vpc_id
 
-    def create_subnet(self, subnet_name, vpc_id, cidr_block, availability_zone):
-        response = self.ec2_client.create_subnet(
-            VpcId=vpc_id,
-            CidrBlock=cidr_block,
-            AvailabilityZone=availability_zone
-        )
+    def create_subnet(self, subnet_name, vpc_id, cidr_block, availability_zone=None):
+        params = {
+            'VpcId': vpc_id,
+            'CidrBlock': cidr_block,
+            'TagSpecifications': self.tag_specifications('subnet', subnet_name),
+        }
+        if availability_zone:
+            params['AvailabilityZone'] = availability_zone
+        response = self.ec2_client.create_subnet(**params)
         subnet_id = response['Subnet']['SubnetId']
 
-        self.vpc_client.create_tags(
-            Resources=[subnet_id],
-            Tags=[
-                {
-                    'Key': 'Name',
-                    'Value': subnet_name
-                }
-            ]
-        )
-        print(f"Created subnet with Name: {subnet_name} and ID: {subnet_id}")
+        print_line(f"Created subnet with Name: {subnet_name} and ID: {subnet_id}")
+        return subnet_id
 
-    def create_internet_gateway(self):
-        response = self.ec2_client.create_internet_gateway()
+    def create_internet_gateway(self, name=None):
+        response = self.ec2_client.create_internet_gateway(
+            TagSpecifications=self.tag_specifications('internet-gateway', name)
+        )
         internet_gateway_id = response['InternetGateway']['InternetGatewayId']
-        print(f"Created internet gateway with ID: {internet_gateway_id}")
+        print_line(f"Created internet gateway with ID: {internet_gateway_id}")
+        return internet_gateway_id
 
     def attach_internet_gateway(self, vpc_id, internet_gateway_id):
         self.ec2_client.attach_internet_gateway(
             VpcId=vpc_id,
             InternetGatewayId=internet_gateway_id
         )
-        print(f"Attached internet gateway {internet_gateway_id} to VPC {vpc_id}")
+        print_line(f"Attached internet gateway {internet_gateway_id} to VPC {vpc_id}")
 
-    def create_route_table(self, vpc_id):
+    def create_route_table(self, vpc_id, name=None):
         response = self.ec2_client.create_route_table(
-            VpcId=vpc_id
+            VpcId=vpc_id,
+            TagSpecifications=self.tag_specifications('route-table', name)
         )
         route_table_id = response['RouteTable']['RouteTableId']
-        print(f"Created route table with ID: {route_table_id}")
+        print_line(f"Created route table with ID: {route_table_id}")
+        return route_table_id
 
     def create_route(self, route_table_id, destination_cidr_block, gateway_id):
         self.ec2_client.create_route(
@@ -67,7 +82,7 @@ class NetworkManager:
             DestinationCidrBlock=destination_cidr_block,
             GatewayId=gateway_id
         )
-        print(f"Created route in route table {route_table_id}")
+        print_line(f"Created route in route table {route_table_id}")
 
     def associate_subnet_with_route_table(self, subnet_id, route_table_id):
         response = self.ec2_client.associate_route_table(
@@ -75,11 +90,59 @@ class NetworkManager:
             RouteTableId=route_table_id
         )
         association_id = response['AssociationId']
-        print(f"Associated subnet {subnet_id} with route table {route_table_id}")
+        print_line(f"Associated subnet {subnet_id} with route table {route_table_id}")
+        return association_id
 
     def enable_vpc_dns_hostnames(self, vpc_id):
         self.vpc_client.modify_vpc_attribute(
             VpcId=vpc_id,
             EnableDnsHostnames={'Value': True}
         )
-        print(f"Enabled DNS hostnames for VPC {vpc_id}")
+        print_line(f"Enabled DNS hostnames for VPC {vpc_id}")
+
+    # Provision entry points: each takes a spec whose references to other network
+    # resources have already been resolved to IDs, and returns the state to record.
+    def create_vpc_resource(self, spec):
+        vpc_id = self.create_vpc(spec.get('vpc_name'), spec.get('cidr_block'))
+        if spec.get('enable_dns_hostnames'):
+            self.enable_vpc_dns_hostnames(vpc_id)
+        return {'vpc_id': vpc_id, 'cidr_block': spec.get('cidr_block')}
+
+    def create_subnet_resource(self, spec):
+        subnet_id = self.create_subnet(spec.get('subnet_name'), spec.get('vpc_id'), spec.get('cidr_block'), spec.get('availability_zone'))
+        return {'subnet_id': subnet_id, 'cidr_block': spec.get('cidr_block')}
+
+    def create_internet_gateway_resource(self, spec):
+        internet_gateway_id = self.create_internet_gateway(spec.get('internet_gateway_name'))
+        if spec.get('vpc_id'):
+            self.attach_internet_gateway(spec['vpc_id'], internet_gateway_id)
+        return {'internet_gateway_id': internet_gateway_id}
+
+    def create_route_table_resource(self, spec):
+        route_table_id = self.create_route_table(spec.get('vpc_id'), spec.get('route_table_name'))
+        self.apply_routes(route_table_id, spec)
+        return {'route_table_id': route_table_id}
+
+    # Adds the spec's routes and subnet associations to a route table. Routes and
+    # associations that already exist are replaced or left alone, so this can be run
+    # again on an existing table.
+    def apply_routes(self, route_table_id, spec):
+        from botocore.exceptions import ClientError
+        for route in spec.get('routes') or []:
+            try:
+                self.create_route(route_table_id, route.get('destination_cidr_block'), route.get('gateway_id'))
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'RouteAlreadyExists':
+                    raise
+                self.ec2_client.replace_route(
+                    RouteTableId=route_table_id,
+                    DestinationCidrBlock=route.get('destination_cidr_block'),
+                    GatewayId=route.get('gateway_id')
+                )
+                print_line(f"Replaced route in route table {route_table_id}")
+        for subnet_id in spec.get('subnet_ids') or []:
+            try:
+                self.associate_subnet_with_route_table(subnet_id, route_table_id)
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'Resource.AlreadyAssociated':
+                    raise
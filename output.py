@@ -0,0 +1,114 @@
+import csv
+import itertools
+import json
+import sys
+import tempfile
+import threading
+
+OUTPUT_FORMATS = ['table', 'jsonl', 'csv']
+
+_print_lock = threading.Lock()
+
+# Listings up to this many rows are laid out by tabulate in one go; longer ones are
+# spooled to disk (see write_table) and printed this many rows at a time.
+TABLE_CHUNK_ROWS = 100
+
+
+# Progress messages come from many worker threads at once. print() writes the
+# message and its newline separately, so two of them can run into one line; this
+# writes each message whole, under one lock shared by every module.
+def print_line(message='', stream=None):
+    stream = stream or sys.stdout
+    with _print_lock:
+        stream.write(f"{message}\n")
+        stream.flush()
+
+
+def write_rows(rows, headers, output='table', empty_message=None, stream=None):
+    stream = stream or sys.stdout
+    if output == 'jsonl':
+        count = write_jsonl(rows, headers, stream)
+    elif output == 'csv':
+        count = write_csv(rows, headers, stream)
+    elif output == 'table':
+        count = write_table(rows, headers, stream)
+    else:
+        raise ValueError(f"Unsupported output format: {output}")
+
+    if count == 0 and empty_message and output == 'table':
+        print(empty_message, file=stream)
+    return count
+
+
+# A grid's column widths depend on every row, so tabulating a long listing chunk by
+# chunk gives each chunk different widths. Short listings go to tabulate as they
+# are. Longer ones are spooled to a temporary file while the widths are measured,
+# then drawn as one fancy_grid table; memory stays flat, at the cost of printing
+# only once the last row is in. Use --output jsonl or csv to see rows as they come.
+def write_table(rows, headers, stream):
+    rows = iter(rows)
+    first = list(itertools.islice(rows, TABLE_CHUNK_ROWS + 1))
+    if not first:
+        return 0
+    if len(first) <= TABLE_CHUNK_ROWS:
+        from tabulate import tabulate
+        print(tabulate(first, headers, tablefmt="fancy_grid"), file=stream, flush=True)
+        return len(first)
+
+    # tabulate keeps two spaces of room next to every header; so does this.
+    widths = [len(str(header)) + 2 for header in headers]
+    count = 0
+    with tempfile.TemporaryFile('w+') as spool:
+        for row in itertools.chain(first, rows):
+            cells = ['' if cell is None else str(cell) for cell in row]
+            widths += [0] * (len(cells) - len(widths))
+            for i, cell in enumerate(cells):
+                widths[i] = max(widths[i], len(cell))
+            spool.write(json.dumps(cells) + '\n')
+            count += 1
+
+        def border(left, fill, middle, right):
+            return left + middle.join(fill * (width + 2) for width in widths) + right
+
+        def line(cells):
+            cells = list(cells)
+            cells += [''] * (len(widths) - len(cells))
+            return '│ ' + ' │ '.join(cell.ljust(width) for cell, width in zip(cells, widths)) + ' │'
+
+        lines = [border('╒', '═', '╤', '╕')]
+        if headers:
+            lines += [line([str(header) for header in headers]), border('╞', '═', '╪', '╡')]
+        separator = border('├', '─', '┼', '┤')
+        spool.seek(0)
+        for i, text in enumerate(spool):
+            if i:
+                lines.append(separator)
+            lines.append(line(json.loads(text)))
+            if len(lines) >= 2 * TABLE_CHUNK_ROWS:
+                stream.write('\n'.join(lines) + '\n')
+                stream.flush()
+                lines = []
+        lines.append(border('╘', '═', '╧', '╛'))
+        stream.write('\n'.join(lines) + '\n')
+        stream.flush()
+    return count
+
+
+def write_jsonl(rows, headers, stream):
+    count = 0
+    for row in rows:
+        stream.write(json.dumps(dict(zip(headers, row)), default=str) + '\n')
+        count += 1
+    stream.flush()
+    return count
+
+
+def write_csv(rows, headers, stream):
+    writer = csv.writer(stream)
+    writer.writerow(headers)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    stream.flush()
+    return count
@@ -0,0 +1,273 @@
+import concurrent.futures
+import json
+import scheduler
+from clients import RegionPool, account_label, lazy_client
+from executor import get_engine
+from list import ListManager
+from output import write_rows
+from state import cloud_id, open_state_tracker
+from yamlio import load_file
+
+PLAN_ACTIONS = ['create', 'update', 'delete', 'no-op']
+
+# Most accounts planned at the same time by plan --profiles/--role-arns.
+MAX_CONCURRENT_ACCOUNTS = 16
+
+# Instance states that still count as the resource existing.
+LIVE_INSTANCE_STATES = ['pending', 'running', 'stopping', 'stopped']
+
+
+class Plan:
+    def __init__(self, resources, changes):
+        self.resources = resources
+        self.changes = changes
+
+    def count(self, action):
+        return sum(1 for change in self.changes if change['action'] == action)
+
+    # Keys of the YAML resources that provision must not create again.
+    def done(self):
+        return {(change['kind'], change['name']) for change in self.changes
+                if change['action'] != 'create' and not change.get('changed')}
+
+    # Keys of the resources whose spec changed since they were provisioned.
+    def changed(self):
+        return {(change['kind'], change['name']) for change in self.changes if change.get('changed')}
+
+    # Brings state in line with what the refresh found, without calling AWS: live
+    # resources missing from (or stale in) state are recorded, and entries for
+    # resources that are already gone are dropped.
+    def sync_state(self, state_tracker):
+        for change in self.changes:
+            state_type = scheduler.RESOURCE_KINDS[change['kind']]['state_type']
+            if change['action'] == 'update' and not change.get('changed'):
+                state_tracker.update_resource_state(state_type, change['name'], change['state'])
+            elif change['action'] == 'delete' and not change.get('state'):
+                state_tracker.remove_resource_state(state_type, change['name'])
+
+    def rows(self):
+        for change in self.changes:
+            yield [change['action'], scheduler.RESOURCE_KINDS[change['kind']]['label'], change['name'], change['reason']]
+
+    def report(self, output='table'):
+        write_rows(self.rows(), ['Action', 'Type', 'Name', 'Reason'], output, "No resources found.")
+        if output == 'table':
+            print(self.summary())
+
+    def summary(self):
+        return (f"Plan: {self.count('create')} to create, {self.count('update')} to update, "
+                f"{self.count('delete')} to delete, {self.count('no-op')} unchanged.")
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'resources': self.resources, 'changes': self.changes}, f, indent=2, default=str)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as f:
+            data = json.load(f)
+        return cls(data['resources'], data['changes'])
+
+
+class Planner:
+    s3_client = lazy_client('s3')
+    iam_client = lazy_client('iam')
+    ec2_client = lazy_client('ec2')
+
+    # EC2 describe calls accept at most this many values per filter.
+    MAX_FILTER_VALUES = 200
+
+    def __init__(self, engine=None, region=None, profile=None):
+        self.engine = engine or get_engine()
+        self.region = region
+        self.profile = profile
+        self.regional = RegionPool(lambda region: Planner(self.engine, region, self.profile))
+
+    def plan(self, data, state_tracker):
+        nodes = scheduler.build_graph(data)
+        tracked = {kind: state_tracker.resources(config['state_type'])
+                   for kind, config in scheduler.RESOURCE_KINDS.items()}
+        live = self.refresh(nodes, tracked)
+
+        changes = []
+        for wave in scheduler.waves(nodes):
+            for node in wave:
+                changes.append(self.diff(node, tracked[node.kind].get(node.name), live[node.kind].get(node.name)))
+
+        for kind, resources in tracked.items():
+            for name, resource_state in resources.items():
+                if (kind, name) in nodes:
+                    continue
+                live_state = live[kind].get(name)
+                reason = "In state, not in the YAML file." if live_state else "In state, but no longer exists in AWS."
+                changes.append({'action': 'delete', 'kind': kind, 'name': name, 'reason': reason, 'state': live_state})
+
+        return Plan(data, changes)
+
+    @staticmethod
+    def diff(node, tracked_state, live_state):
+        change = {'kind': node.kind, 'name': node.name}
+        recorded = tracked_state.get('spec_hash') if isinstance(tracked_state, dict) else None
+        if live_state is None:
+            change.update(action='create', reason="Not found in AWS." if tracked_state else "New resource.")
+        elif tracked_state is None:
+            change.update(action='update', reason="Exists in AWS, not in state.", state=live_state)
+        elif cloud_id(live_state) and cloud_id(tracked_state) != cloud_id(live_state):
+            change.update(action='update', reason=f"State has {cloud_id(tracked_state)}, AWS has {cloud_id(live_state)}.", state=live_state)
+        elif recorded and recorded != node.digest:
+            change.update(action='update', reason="Spec changed.", changed=True)
+        else:
+            change.update(action='no-op', reason="Up to date.")
+        return change
+
+    # One listing per kind of resource in the YAML file or in state (per region for
+    # regional kinds), all running at once, returning {kind: {name: state}} in the
+    # same shape provision records.
+    def refresh(self, nodes, tracked):
+        names = {}
+        for kind, resources in tracked.items():
+            for name, resource_state in resources.items():
+                region = resource_state.get('region') if isinstance(resource_state, dict) else None
+                names.setdefault(self.refresh_key(kind, region), set()).add(name)
+        for node in nodes.values():
+            names.setdefault(self.refresh_key(node.kind, node.region), set()).add(node.name)
+
+        futures = {key: self.engine.submit(self.regional.get(key[1]).refresh_kind, key[0], sorted(kind_names))
+                   for key, kind_names in names.items()}
+        live = {kind: {} for kind in scheduler.RESOURCE_KINDS}
+        for (kind, _), future in futures.items():
+            live[kind].update(future.result())
+        return live
+
+    @staticmethod
+    def refresh_key(kind, region):
+        return (kind, region if scheduler.RESOURCE_KINDS[kind].get('regional') else None)
+
+    def refresh_kind(self, kind, names):
+        refreshers = {
+            'vpc': lambda names: self.refresh_tagged(names, 'describe_vpcs', 'Vpcs', 'VpcId', 'vpc_id'),
+            'subnet': lambda names: self.refresh_tagged(names, 'describe_subnets', 'Subnets', 'SubnetId', 'subnet_id'),
+            'internet_gateway': lambda names: self.refresh_tagged(
+                names, 'describe_internet_gateways', 'InternetGateways', 'InternetGatewayId', 'internet_gateway_id'),
+            'route_table': lambda names: self.refresh_tagged(names, 'describe_route_tables', 'RouteTables', 'RouteTableId', 'route_table_id'),
+            'instance': self.refresh_instances,
+            'bucket': self.refresh_buckets,
+            'iam_user': self.refresh_iam_users,
+            'iam_role': self.refresh_iam_roles,
+            'iam_policy': self.refresh_iam_policies,
+        }
+        live = refreshers[kind](names)
+        if self.region and scheduler.RESOURCE_KINDS[kind].get('regional'):
+            for live_state in live.values():
+                live_state['region'] = self.region
+        return live
+
+    def refresh_instances(self, names):
+        live = {}
+        for i in range(0, len(names), self.MAX_FILTER_VALUES):
+            filters = [
+                {'Name': 'tag:Name', 'Values': names[i:i + self.MAX_FILTER_VALUES]},
+                {'Name': 'instance-state-name', 'Values': LIVE_INSTANCE_STATES},
+            ]
+            for page in ListManager.iter_pages(self.ec2_client, 'describe_instances', Filters=filters):
+                for reservation in page['Reservations']:
+                    for instance in reservation['Instances']:
+                        name = ListManager.get_name_tag(instance, None)
+                        if name:
+                            live[name] = {'instance_id': instance['InstanceId']}
+        return live
+
+    # Network resources are matched to the YAML by their Name tag.
+    def refresh_tagged(self, names, operation, items_key, id_key, state_key):
+        live = {}
+        for i in range(0, len(names), self.MAX_FILTER_VALUES):
+            filters = [{'Name': 'tag:Name', 'Values': names[i:i + self.MAX_FILTER_VALUES]}]
+            for page in ListManager.iter_pages(self.ec2_client, operation, Filters=filters):
+                for item in page[items_key]:
+                    name = ListManager.get_name_tag(item, None)
+                    if name:
+                        live[name] = {state_key: item[id_key]}
+        return live
+
+    def refresh_buckets(self, names):
+        wanted = set(names)
+        live = {}
+        for page in ListManager.iter_pages(self.s3_client, 'list_buckets'):
+            for bucket in page['Buckets']:
+                if bucket['Name'] in wanted:
+                    live[bucket['Name']] = {'bucket_name': bucket['Name']}
+        return live
+
+    def refresh_iam_users(self, names):
+        return self.refresh_iam(names, 'list_users', 'Users', 'UserName', 'user_name')
+
+    def refresh_iam_roles(self, names):
+        return self.refresh_iam(names, 'list_roles', 'Roles', 'RoleName', 'role_name')
+
+    def refresh_iam_policies(self, names):
+        return self.refresh_iam(names, 'list_policies', 'Policies', 'PolicyName', 'policy_name', Scope='Local')
+
+    def refresh_iam(self, names, operation, items_key, name_key, state_key, **kwargs):
+        wanted = set(names)
+        live = {}
+        for page in ListManager.iter_pages(self.iam_client, operation, **kwargs):
+            for item in page[items_key]:
+                if item[name_key] in wanted:
+                    live[item[name_key]] = {state_key: item[name_key], 'arn': item['Arn']}
+        return live
+
+
+def plan(args):
+    data = load_file(args['file'])
+    get_engine().configure(max_workers=args.get('workers'))
+    if args.get('accounts'):
+        return plan_accounts(data, args)
+
+    state_tracker = open_state_tracker(args.get('state_file'), args.get('state_backend'))
+    try:
+        result = Planner().plan(data, state_tracker)
+    except ValueError as e:
+        print(f"Error occurred while reading {args['file']}: {str(e)}")
+        return None
+
+    result.report(args.get('output') or 'table')
+    if args.get('out'):
+        result.save(args['out'])
+        print(f"Saved plan to {args['out']}. Apply it with: provision --plan {args['out']}")
+    return result
+
+
+# Plans the same YAML file against every account at once, each with its own
+# credentials and state file, and prints one result labelled by account. The
+# refresh calls of all accounts share the engine's workers and rate limits.
+def plan_accounts(data, args):
+    if args.get('out'):
+        print("--out saves the plan of a single account; leave out --profiles and --role-arns to save one.")
+        return None
+    try:
+        scheduler.build_graph(data)
+    except ValueError as e:
+        print(f"Error occurred while reading {args['file']}: {str(e)}")
+        return None
+
+    def plan_account(profile):
+        state_tracker = open_state_tracker(args.get('state_file'), args.get('state_backend'), account_label(profile))
+        return Planner(profile=profile).plan(data, state_tracker)
+
+    accounts = args['accounts']
+    results = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_ACCOUNTS, len(accounts))) as pool:
+        futures = {profile: pool.submit(plan_account, profile) for profile in accounts}
+        for profile, future in futures.items():
+            try:
+                results[profile] = future.result()
+            except Exception as e:
+                print(f"Error occurred while planning account {account_label(profile)}: {str(e)}")
+
+    output = args.get('output') or 'table'
+    rows = ([account_label(profile)] + row for profile, result in results.items() for row in result.rows())
+    write_rows(rows, ['Account', 'Action', 'Type', 'Name', 'Reason'], output, "No resources found.")
+    if output == 'table':
+        for profile, result in results.items():
+            print(f"{account_label(profile)}: {result.summary()}")
+    return results
@@ -1,91 +1,230 @@
-import yaml
-import multiprocessing
-from state import StateTracker
+import time
+import scheduler
+from clients import DEFAULT_CLIENT_OPTIONS, RegionPool, configure_clients
+from executor import get_engine
+from state import StateWriter, open_state_tracker
+from tracing import span
+from plan import Plan
 from create import CreateManager
+from network import NetworkManager
+from update import UpdateManager
+from waiter import ReadinessWaiter
+from yamlio import load_file
+from output import print_line
 
-def provision(args):
-    state_tracker = StateTracker()
-    create_manager = CreateManager()
-
-    with open(args['file'], 'r') as f:
-        data = yaml.safe_load(f)
-
-    processes = []
-
-    if 'instances' in data:
-        instances = data['instances']
-        for instance in instances:
-            instance_name = instance.get('instance_name')
-            if not state_tracker.resource_exists('instances', instance_name):
-                if args.get('build'):
-                    print(f"Would create instance: {instance_name}")
-                else:
-                    process = multiprocessing.Process(target=create_manager.create_instance, args=(instance,))
-                    processes.append(process)
-                    process.start()
-                    state_tracker.update_resource_state('instances', instance_name, {})
-            else:
-                print(f"Instance '{instance_name}' already exists. Skipping creation.")
-
-    if 'buckets' in data:
-        buckets = data['buckets']
-        for bucket in buckets:
-            bucket_name = bucket.get('bucket_name')
-            if not state_tracker.resource_exists('buckets', bucket_name):
-                if args.get('build'):
-                    print(f"Would create bucket: {bucket_name}")
-                else:
-                    process = multiprocessing.Process(target=create_manager.create_bucket, args=(bucket,))
-                    processes.append(process)
-                    process.start()
-                    state_tracker.update_resource_state('buckets', bucket_name, {})
-            else:
-                print(f"Bucket '{bucket_name}' already exists. Skipping creation.")
-
-    if 'resources' in data:
-        resources = data['resources']
-        for resource in resources:
-            resource_type = resource.get('type')
-            resource_name = resource.get('name')
-            if resource_type == 'iam_user':
-                if not state_tracker.resource_exists('iam_users', resource_name):
-                    if args.get('build'):
-                        print(f"Would create IAM user: {resource_name}")
-                    else:
-                        process = multiprocessing.Process(target=create_manager.create_iam_user, args=(resource,))
-                        processes.append(process)
-                        process.start()
-                        state_tracker.update_resource_state('iam_users', resource_name, {})
-                else:
-                    print(f"IAM user '{resource_name}' already exists. Skipping creation.")
-            elif resource_type == 'iam_role':
-                if not state_tracker.resource_exists('iam_roles', resource_name):
-                    if args.get('build'):
-                        print(f"Would create IAM role: {resource_name}")
-                    else:
-                        role_name = resource.get('role_name')
-                        assume_role_policy = resource.get('assume_role_policy')
-                        process = multiprocessing.Process(target=create_manager.create_iam_role, args=(role_name, assume_role_policy))
-                        processes.append(process)
-                        process.start()
-                        state_tracker.update_resource_state('iam_roles', resource_name, {})
-                else:
-                    print(f"IAM role '{resource_name}' already exists. Skipping creation.")
-            elif resource_type == 'iam_policy':
-                if not state_tracker.resource_exists('iam_policies', resource_name):
-                    if args.get('build'):
-                        print(f"Would create IAM policy: {resource_name}")
+# Traced as one span, with a child span per stage (loading, diffing against state,
+# running, saving) and per resource created or updated.
+def provision(args, plan=None):
+    with span('provision', file=args.get('plan') or args.get('file') or ''):
+        return _provision(args, plan)
+
+
+def _provision(args, plan=None):
+    engine = get_engine()
+    engine.configure(max_workers=args.get('workers'), rates=args.get('rate_limits'))
+    # Give every worker its own warm connection to each service.
+    if engine.max_workers > DEFAULT_CLIENT_OPTIONS['max_pool_connections']:
+        configure_clients(max_pool_connections=engine.max_workers)
+
+    state_tracker = open_state_tracker(args.get('state_file'), args.get('state_backend'))
+    # Resources with a 'region' key are made with that region's clients (the
+    # configured region otherwise). Regions share nothing but the worker pool, so
+    # resources in different regions are created side by side.
+    create_managers = RegionPool(lambda region: CreateManager(engine, region))
+    network_managers = RegionPool(lambda region: NetworkManager(engine, region))
+    update_managers = RegionPool(lambda region: UpdateManager(engine, region))
+
+    # A saved plan already carries the YAML it was made from and what exists, so
+    # nothing is read or checked again.
+    if plan is None and args.get('plan'):
+        with span('load_plan'):
+            plan = Plan.load(args['plan'])
+    if plan is not None:
+        data = plan.resources
+    elif args.get('file'):
+        with span('load_yaml'):
+            data = load_file(args['file'])
+    else:
+        print_line("Please provide a YAML file (-f) or a saved plan (--plan).")
+        return
+
+    try:
+        with span('build_graph'):
+            nodes = scheduler.build_graph(data)
+    except ValueError as e:
+        print_line(f"Error occurred while reading {args.get('plan') or args['file']}: {str(e)}")
+        return
+
+    # Each creator returns what should be recorded in state (IDs, ARNs, region), or
+    # None if the resource was not created.
+    def network(spec):
+        return network_managers.get(spec.get('region'))
+
+    def create(spec):
+        return create_managers.get(spec.get('region'))
+
+    def update(spec):
+        return update_managers.get(spec.get('region'))
+
+    creators = {
+        'vpc': lambda spec: network(spec).create_vpc_resource(spec),
+        'subnet': lambda spec: network(spec).create_subnet_resource(spec),
+        'internet_gateway': lambda spec: network(spec).create_internet_gateway_resource(spec),
+        'route_table': lambda spec: network(spec).create_route_table_resource(spec),
+        'instance': lambda spec: {'instance_id': create(spec).create_instance(spec)},
+        'bucket': lambda spec: create(spec).create_bucket(spec),
+        'iam_user': lambda spec: create(spec).create_iam_user(spec),
+        'iam_role': lambda spec: create(spec).create_iam_role(spec.get('role_name'), spec.get('assume_role_policy')),
+        'iam_policy': lambda spec: create(spec).create_iam_policy(spec),
+    }
+
+    # Resources whose spec (or a dependency's) changed since they were recorded are
+    # updated in place, starting from the state recorded for them.
+    updaters = {
+        kind: lambda spec, resource_state, kind=kind: getattr(update(spec), f'update_{kind}')(spec, resource_state)
+        for kind in scheduler.RESOURCE_KINDS
+    }
+
+    changed = {}
+    if plan is not None:
+        existing = plan.done()
+        if args.get('build'):
+            plan.report()
+            return
+        plan.sync_state(state_tracker)
+        for key in plan.changed():
+            node = nodes[key]
+            changed[key] = state_tracker.get_resource_state(node.state_type, node.name)
+        left = [change['name'] for change in plan.changes if change['action'] == 'delete' and change.get('state')]
+        if left:
+            print_line(f"Not deleting resources that are no longer in the YAML file: {', '.join(left)}")
+    else:
+        existing = set()
+        with span('diff_state', resources=len(nodes)):
+            for wave in scheduler.waves(nodes):
+                for node in wave:
+                    if not state_tracker.resource_exists(node.state_type, node.name):
+                        if args.get('build'):
+                            print_line(f"Would create {node.label}: {node.name}")
+                        continue
+                    resource_state = state_tracker.get_resource_state(node.state_type, node.name)
+                    recorded = resource_state.get('spec_hash') if isinstance(resource_state, dict) else None
+                    if recorded is None or recorded == node.digest:
+                        print_line(f"{node.label} '{node.name}' already exists. Skipping creation.")
+                        existing.add(node.key)
+                        # Entries recorded before specs were hashed are taken as current.
+                        if recorded is None and isinstance(resource_state, dict) and not args.get('build'):
+                            state_tracker.update_resource_state(node.state_type, node.name, dict(resource_state, spec_hash=node.digest))
+                    elif args.get('build'):
+                        print_line(f"Would update {node.label}: {node.name}")
                     else:
-                        process = multiprocessing.Process(target=create_manager.create_iam_policy, args=(resource,))
-                        processes.append(process)
-                        process.start()
-                        state_tracker.update_resource_state('iam_policies', resource_name, {})
-                else:
-                    print(f"IAM policy '{resource_name}' already exists. Skipping creation.")
+                        changed[node.key] = resource_state
+
+    if args.get('build'):
+        return
+
+    # State of every resource that is already there or has been created in this run,
+    # for resolving references by logical name. Dependencies always finish (and
+    # land here, via on_done) before their dependents are started.
+    known = {key: state_tracker.get_resource_state(nodes[key].state_type, key[1]) for key in existing if key in nodes}
+
+    def lookup(key):
+        id_key = scheduler.RESOURCE_KINDS[key[0]].get('id_key')
+        resource_state = known.get(key)
+        if id_key and isinstance(resource_state, dict):
+            return resource_state.get(id_key)
+        return None
+
+    # What is recorded for a resource: its state, the hash of its spec and, for
+    # resources outside the configured region, the region it lives in.
+    def record(node, resource_state):
+        recorded = dict(resource_state, spec_hash=node.digest)
+        if node.region:
+            recorded['region'] = node.region
+        return recorded
+
+    # Workers hand back a result per resource: {'state': ..., 'seconds': ...}.
+    def apply(node):
+        started = time.monotonic()
+        action = 'update' if node.key in changed else 'create'
+        with span(f'{action} {node.kind}', resource=node.name, region=node.region or ''):
+            spec = scheduler.resolve_spec(node, lookup)
+            if node.key in changed:
+                recorded_region = changed[node.key].get('region')
+                if recorded_region and recorded_region != spec.get('region'):
+                    raise RuntimeError(f"{node.label} '{node.name}' is in {recorded_region} and cannot be moved to another region.")
+                resource_state = updaters[node.kind](spec, changed[node.key])
             else:
-                print(f"Unsupported resource type: {resource_type}")
+                resource_state = creators[node.kind](spec)
+            if resource_state is None:
+                raise RuntimeError(f"{node.label} '{node.name}' was not created.")
+        return {'state': record(node, resource_state), 'seconds': time.monotonic() - started}
+
+    # Instances that become ready together and share a launch key go out as one
+    # run_instances call.
+    def batch_key(node):
+        if node.kind == 'instance' and node.key not in changed:
+            return CreateManager.launch_key(scheduler.resolve_spec(node, lookup))
+        return None
+
+    def create_instances(batch):
+        started = time.monotonic()
+        specs = [scheduler.resolve_spec(node, lookup) for node in batch]
+        with span('create instance batch', resources=len(batch), region=batch[0].region or ''):
+            created = create(specs[0]).create_instances(specs)
+        seconds = time.monotonic() - started
+        return {node.key: {'state': record(node, {'instance_id': instance_id}), 'seconds': seconds}
+                for node, instance_id in zip(batch, created) if instance_id}
+
+    # Only the state writer thread touches the state file; results reach it in
+    # completion order and failures are never recorded.
+    state_writer = StateWriter(state_tracker)
+    waiters = RegionPool(lambda region: ReadinessWaiter(create_managers.get(region).ec2_client, create_managers.get(region).s3_client))
+    results = []
+
+    def on_done(node, result, error):
+        results.append((node, result, error))
+        if error:
+            return
+        known[node.key] = result['state']
+        state_writer.put(node.state_type, node.name, result['state'])
+        if args.get('wait'):
+            waiter = waiters.get(node.region)
+            if node.kind == 'vpc':
+                waiter.add_vpc(result['state']['vpc_id'], node.name)
+            elif node.kind == 'instance':
+                waiter.add_instance(result['state']['instance_id'], node.name)
+            elif node.kind == 'bucket':
+                waiter.add_bucket(node.name)
+
+    try:
+        with span('run', resources=len(nodes) - len(existing)):
+            scheduler.run(
+                nodes,
+                apply,
+                engine=engine,
+                done=existing,
+                on_done=on_done,
+                batch_key=batch_key,
+                batch_task=create_instances,
+                batch_size=CreateManager.MAX_INSTANCES_PER_LAUNCH,
+            )
+    finally:
+        with span('state.flush'):
+            state_writer.close()
+        state_tracker.save_state()
 
-    for process in processes:
-        process.join()
+    created = [node for node, _, error in results if not error and node.key not in changed]
+    updated = [node for node, _, error in results if not error and node.key in changed]
+    failed = [node for node, _, error in results if error]
+    print_line(f"Created {len(created)} resources, updated {len(updated)}, {len(failed)} failed.")
+    if failed:
+        print_line(f"Failed: {', '.join(f'{node.label} {node.name}' for node in failed)}")
 
-    state_tracker.save_state()
+    if args.get('wait'):
+        print_line("Waiting for resources to become ready...")
+        # Each region is polled by its own waiter, all at the same time.
+        with span('wait'):
+            engine.map(lambda waiter: waiter.wait(), waiters.values())
+        for waiter in waiters.values():
+            waiter.report()
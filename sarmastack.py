@@ -5,23 +5,29 @@
 # Copyright: GPLv3
 
 import argparse
-import boto3
+import atexit
+import importlib
 import os 
 import shutil
-from list import ListManager
-from delete import DeleteManager
-from create import CreateManager
-from stop import StopManager
-from network import NetworkManager
-from state import StateTracker
-from provision import provision
-
-manager = ListManager()
-delete_manager = DeleteManager()
-create_manager = CreateManager()
-stop_manager = StopManager()
-network_manager = NetworkManager()
-state_tracker = StateTracker()
+from output import OUTPUT_FORMATS, write_rows
+from executor import DEFAULT_MAX_WORKERS
+
+# Managers are only built (and their modules imported) once a command needs them,
+# so --help and start never import boto3 or read the state file.
+MANAGERS = {
+    'list': ('list', 'ListManager'),
+    'delete': ('delete', 'DeleteManager'),
+    'create': ('create', 'CreateManager'),
+    'stop': ('stop', 'StopManager'),
+    'network': ('network', 'NetworkManager'),
+}
+_managers = {}
+
+def get_manager(name):
+    if name not in _managers:
+        module_name, class_name = MANAGERS[name]
+        _managers[name] = getattr(importlib.import_module(module_name), class_name)()
+    return _managers[name]
 
 
 # This will give SarmaStack the ability to start a new project working directory with configuration samples.
@@ -42,26 +48,87 @@ def start(args):
     print("Initialization complete.")
 
 def suggest_ami(args):
-    ec2_client = boto3.client('ec2')
-    response = ec2_client.describe_images(
-        Filters=[
-            {
-                'Name': args['filter_name'],
-                'Values': args['filter_values']
-            }
-        ]
-    )
-    ami_ids = [image['ImageId'] for image in response['Images']]
-    ami_names = [image['Name'] for image in response['Images']]
-
-    print("Suggested AMI image IDs:")
-    for ami_id, ami_name in zip(ami_ids, ami_names):
-        print(f"AMI ID: {ami_id}, OS Name: {ami_name}")
+    from ami import AmiCatalog, catalog_can_answer, search_live
+    filters = {}
+    if args.get('filter_name'):
+        filters[args['filter_name']] = args.get('filter_values') or ['*']
+    search_args = {
+        'name_prefix': args.get('name_prefix'),
+        'os_name': args.get('os'),
+        'architecture': args.get('architecture'),
+        'filters': filters,
+        'limit': 1 if args.get('newest') else args.get('limit'),
+    }
+
+    # Filters the catalog cannot answer (or owners it does not hold) go to EC2.
+    if not catalog_can_answer(filters):
+        try:
+            images = search_live(args.get('region'), **search_args)
+        except Exception as e:
+            print(f"Error occurred while describing AMI images: {str(e)}")
+            return
+    else:
+        try:
+            # Without --max-age the catalog's own TTL (SARMASTACK_AMI_TTL) applies.
+            catalog_args = {'ttl': args['max_age'] * 3600} if args.get('max_age') is not None else {}
+            catalog = AmiCatalog(args.get('region'), **catalog_args)
+            catalog.ensure_fresh(force=args.get('refresh'))
+        except Exception as e:
+            print(f"Error occurred while loading the AMI catalog: {str(e)}")
+            return
+        images = catalog.search(**search_args)
+    rows = ([image['image_id'], image['name'], image['os'], image['architecture'], image['creation_date']] for image in images)
+    write_rows(rows, ['AMI ID', 'Name', 'OS', 'Architecture', 'Created'], args.get('output') or 'table', "No matching AMI images found.")
+
+def wait_for_instances(instances):
+    from waiter import ReadinessWaiter
+    waiter = ReadinessWaiter(get_manager('create').ec2_client)
+    for instance_id, instance_name in instances.items():
+        waiter.add_instance(instance_id, instance_name)
+    print("Waiting for instances to become ready...")
+    waiter.wait()
+    waiter.report()
+
+def parse_rate_limit(value):
+    try:
+        service, limit = value.split('=', 1)
+        rate, _, burst = limit.partition(':')
+        rate = float(rate)
+        burst = float(burst) if burst else rate * 2
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid rate limit '{value}', expected service=rate[:burst]")
+    if rate <= 0 or burst <= 0:
+        raise argparse.ArgumentTypeError(f"Invalid rate limit '{value}', rate and burst must be positive")
+    # A bucket holding less than one token could never hand one out.
+    return service, (rate, max(burst, 1))
+
+# Accounts given by --profiles (comma-separated profile names) and --role-arns
+# (comma-separated role ARNs, or a file with one per line), in that order.
+def parse_accounts(args):
+    accounts = [profile.strip() for profile in (args.get('profiles') or '').split(',') if profile.strip()]
+    role_arns = args.get('role_arns')
+    if role_arns:
+        if os.path.isfile(role_arns):
+            with open(role_arns, 'r') as f:
+                accounts += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+        else:
+            accounts += [role_arn.strip() for role_arn in role_arns.split(',') if role_arn.strip()]
+    return accounts
+
+def add_account_arguments(parser):
+    parser.add_argument('--profiles', help='Comma-separated AWS profiles to read, all at once')
+    parser.add_argument('--role-arns', help='Comma-separated role ARNs to assume and read, all at once, or a file with one per line')
 
 def main():
     
     # Main argument parser
     parser = argparse.ArgumentParser(description='SarmaStack IaC by Michael Cruz Sanchez')
+    parser.add_argument('--state-file', help='Path to the state file (default: state.srstate, or state.srstate.db for sqlite)')
+    parser.add_argument('--state-backend', choices=['yaml', 'sqlite'], help='State storage backend (default: yaml, or sqlite for .db files)')
+    parser.add_argument('--metrics', action='store_true', help='Print latency, retries, throttles and bytes per AWS API operation at exit')
+    parser.add_argument('--metrics-out', help='Also write the metrics to this file: Prometheus text format for .prom files, JSON otherwise')
+    parser.add_argument('--trace', help='Write a trace of the run (stages and resources as spans) to this file at exit')
+    parser.add_argument('--trace-format', choices=['chrome', 'otlp'], default='chrome', help='Trace file format: Chrome trace events or OTLP JSON')
     subparsers = parser.add_subparsers(title='Commands', dest='command')
 
     network_parser = subparsers.add_parser('network', help='Network actions')
@@ -77,6 +144,8 @@ def main():
     network_parser.add_argument('-dcb', '--destination-cidr-block', help='Destination CIDR block for route')
     network_parser.add_argument('-vpn', '--vpc-name', help='Name of the VPC')
     network_parser.add_argument('-sbn', '--subnet-name', help='Name of the Subnet')
+    network_parser.add_argument('-sbi', '--subnet-id', help='ID of the Subnet')
+    network_parser.add_argument('-n', '--name', help='Name of the internet gateway or route table')
 
     # Options for the network command not bieng used right now.
     # network_parser.add_argument('--cidr-block', help='CIDR block for VPC or subnet')
@@ -102,6 +171,7 @@ def main():
     create_instance_parser.add_argument('-it', '--instance-type', required=True, help='Type of the instance')
     create_instance_parser.add_argument('-id', '--image-id', required=True, help='ID of the AMI image')
     create_instance_parser.add_argument('-f', '--file', help='Path to the YAML file')
+    create_instance_parser.add_argument('--wait', action='store_true', help='Wait until the instances are running')
 
     stop_instance_parser = subparsers.add_parser('stop-instance', help='Stop an instance')
     stop_instance_parser.add_argument('-id', '--instance_id', help='ID of the instance')
@@ -136,12 +206,25 @@ def main():
     list_route_tables = subparsers.add_parser('list-route-tables', help='List Route Tables') 
 
     list_insternet_gateways_parser = subparsers.add_parser('list-internet-gateways', help='List the Internet Gateways')
+
+    for list_parser in [list_bucke_parser, list_users_parser, list_instances_parser, list_vpcs_parser, list_subnets_parser,
+                        list_roles_parser, list_route_tables, list_insternet_gateways_parser]:
+        list_parser.add_argument('-o', '--output', choices=OUTPUT_FORMATS, default='table', help='Output format')
+        list_parser.add_argument('--refresh', action='store_true', help='Ignore the local inventory cache and read from AWS')
+        list_parser.add_argument('--max-age', type=float, help='Seconds a cached listing may be reused (default depends on the resource type)')
+        add_account_arguments(list_parser)
+    # Buckets and IAM are global, so only the regional listings take --regions.
+    for list_parser in [list_instances_parser, list_vpcs_parser, list_subnets_parser, list_route_tables, list_insternet_gateways_parser]:
+        list_parser.add_argument('--regions', help="Regions to list, all at once: 'all' or a comma-separated list (default: the configured region)")
     
     delete_bucket_parser = subparsers.add_parser('delete-bucket', help='Delete a Bucket')
     delete_bucket_parser.add_argument('-bn', '--bucket_name', nargs='+', help='Name of the bucket')
+    delete_bucket_parser.add_argument('--force', action='store_true', help='Delete every object and object version first')
+    delete_bucket_parser.add_argument('-w', '--workers', type=int, default=DEFAULT_MAX_WORKERS, help='Maximum number of delete_objects calls at once')
 
     delete_vpc_parser = subparsers.add_parser('delete-vpc', help='Delete a Vpc')
     delete_vpc_parser.add_argument('-vpi', '--vpc_id', help='Name of the vpc')
+    delete_vpc_parser.add_argument('--cascade', action='store_true', help='Also delete the subnets, route tables, gateways, security groups and network interfaces in the VPC')
 
     delete_subnet_parser = subparsers.add_parser('delete-subnet', help='Delete a Subnet')
     delete_subnet_parser.add_argument('-sbi', '--subnet_id', help='Name of the Subnet')
@@ -155,85 +238,130 @@ def main():
     suggest_ami_parser = subparsers.add_parser('suggest-ami', help='Suggest AMI image IDs')
     suggest_ami_parser.add_argument('-fn', '--filter-name', help='Name of the filter')
     suggest_ami_parser.add_argument('-fv', '--filter-values', nargs='+', help='Values for the filter')
+    suggest_ami_parser.add_argument('-np', '--name-prefix', help='Only images whose name starts with this')
+    suggest_ami_parser.add_argument('--os', help='Only images for this OS, e.g. ubuntu, amazon-linux, debian, rhel, windows')
+    suggest_ami_parser.add_argument('--architecture', choices=['x86_64', 'arm64'], help='Only images for this architecture')
+    suggest_ami_parser.add_argument('--newest', action='store_true', help='Only show the newest matching image')
+    suggest_ami_parser.add_argument('--limit', type=int, default=10, help='Maximum number of images to show')
+    suggest_ami_parser.add_argument('--region', help='Region to suggest images for')
+    suggest_ami_parser.add_argument('--refresh', action='store_true', help='Refresh the local AMI catalog first')
+    suggest_ami_parser.add_argument('--max-age', type=float, help='Hours before the local AMI catalog is refreshed (default: 24, or SARMASTACK_AMI_TTL seconds)')
+    suggest_ami_parser.add_argument('-o', '--output', choices=OUTPUT_FORMATS, default='table', help='Output format')
 
     provision_parser = subparsers.add_parser('provision', help='Provision infrastructure from YAML file')
     provision_parser.add_argument('-f', '--file', help='Path to the YAML file')
+    provision_parser.add_argument('--plan', help='Apply a plan saved by the plan command instead of reading the YAML file')
+    provision_parser.add_argument('--wait', action='store_true', help='Wait until the created resources are ready')
+    provision_parser.add_argument('-w', '--workers', type=int, default=DEFAULT_MAX_WORKERS, help='Maximum number of resources created at once')
+    provision_parser.add_argument('-rl', '--rate-limit', action='append', type=parse_rate_limit, dest='rate_limits',
+                                  help='Calls per second for a service, e.g. ec2=20 or iam=10:20 (rate:burst)')
+
+    plan_parser = subparsers.add_parser('plan', help='Show what provision would create, update or delete')
+    plan_parser.add_argument('-f', '--file', required=True, help='Path to the YAML file')
+    plan_parser.add_argument('--out', help='Save the plan to this file for provision --plan')
+    plan_parser.add_argument('-o', '--output', choices=OUTPUT_FORMATS, default='table', help='Output format')
+    plan_parser.add_argument('-w', '--workers', type=int, default=DEFAULT_MAX_WORKERS, help='Maximum number of AWS listings at once')
+    add_account_arguments(plan_parser)
+
+    inventory_parser = subparsers.add_parser('inventory', help='Save a snapshot of every listing, read all at once')
+    inventory_parser.add_argument('--out', help='Snapshot file (default: inventory-<timestamp>.json)')
+    inventory_parser.add_argument('--format', choices=['json', 'jsonl'], default='json', help='Snapshot file format')
+    inventory_parser.add_argument('--regions', help="Regions to read: 'all' or a comma-separated list (default: the configured region)")
+    add_account_arguments(inventory_parser)
 
     start_parser = subparsers.add_parser('start', help='Initialize working directory')
     start_parser.add_argument('directory', help='Working directory')
     
     args = vars(parser.parse_args())
+    if args.get('rate_limits'):
+        args['rate_limits'] = dict(args['rate_limits'])
+    args['accounts'] = parse_accounts(args)
+
+    if args.get('metrics') or args.get('metrics_out'):
+        from metrics import enable_metrics
+        atexit.register(enable_metrics().finish, args.get('metrics'), args.get('metrics_out'))
+    if args.get('trace'):
+        from tracing import enable_tracing
+        atexit.register(enable_tracing().finish_trace, args['trace'], args['trace_format'])
+
+    if (args['command'] or '').startswith('list-'):
+        get_manager('list').inventory.configure(max_age=args.get('max_age'), refresh=args.get('refresh'))
 
     # Create commands
     if args['command'] == 'create-instance':
-        create_manager.create_instance(args)
+        created = get_manager('create').create_instance(args)
+        if args.get('wait') and created:
+            wait_for_instances(created if isinstance(created, dict) else {created: args.get('instance_name')})
     elif args['command'] == 'create-bucket':
-        create_manager.create_bucket(args)
+        get_manager('create').create_bucket(args)
     elif args['command'] == 'create-iam-user':
-        create_manager.create_iam_user(args)
+        get_manager('create').create_iam_user(args)
     elif args['command'] == 'create-iam-role':
-        create_manager.create_iam_role(args)
+        try:
+            get_manager('create').create_iam_role(args.get('role_name'), args.get('assume_role_policy'))
+        except Exception as e:
+            print(f"Error occurred while creating IAM role: {str(e)}")
     elif args['command'] == 'create-iam-policy':
-        create_manager.create_iam_policy(args)
+        get_manager('create').create_iam_policy(args)
     
     # Stop commands
     elif args['command'] == 'stop-instances':
-        stop_manager.stop_instance(args)
+        get_manager('stop').stop_instance(args)
     
     # Delete commands
     elif args['command'] == 'delete-instance':
-        delete_manager.delete_instance(args)
+        get_manager('delete').delete_instance(args)
     elif args['command'] == 'delete-bucket':
-        delete_manager.delete_bucket(args)
+        get_manager('delete').delete_bucket(args)
     elif args['command'] == 'delete-iam-user':
-        delete_manager.delete_iam_user(args)
+        get_manager('delete').delete_iam_user(args)
     elif args['command'] == 'delete-iam-role':
-        delete_manager.delete_iam_role(args)
+        get_manager('delete').delete_iam_role(args)
     elif args['command'] == 'delete-vpc':
-        delete_manager.delete_vpc(args)
+        get_manager('delete').delete_vpc(args)
     elif args['command'] == 'delete-subnet':
-        delete_manager.delete_subnet(args)
+        get_manager('delete').delete_subnet(args)
     elif args['command'] == 'delete-route-table':
-        delete_manager.delete_route_table(args)
+        get_manager('delete').delete_route_table(args)
     elif args['command'] == 'delete-internet-gateway':
-        delete_manager.delete_internet_gateway(args)
+        get_manager('delete').delete_internet_gateway(args)
     
     # List commands
     elif args['command'] == 'list-buckets':
-        manager.list_buckets()
+        get_manager('list').list_buckets(args['output'], args['accounts'])
     elif args['command'] == 'list-users':
-        manager.list_iam_users()
+        get_manager('list').list_iam_users(args['output'], args['accounts'])
     elif args['command'] == 'list-instances':
-        manager.list_instances()
+        get_manager('list').list_instances(args['output'], args.get('regions'), args['accounts'])
     elif args['command'] == 'list-vpcs':
-        manager.list_vpcs()
+        get_manager('list').list_vpcs(args['output'], args.get('regions'), args['accounts'])
     elif args['command'] == 'list-subnets':
-        manager.list_subnets()
+        get_manager('list').list_subnets(args['output'], args.get('regions'), args['accounts'])
     elif args['command'] == 'list-roles':
-        manager.list_iam_roles()
+        get_manager('list').list_iam_roles(args['output'], args['accounts'])
     elif args['command'] == 'list-route-tables':
-        manager.list_route_tables()
+        get_manager('list').list_route_tables(args['output'], args.get('regions'), args['accounts'])
     elif args['command'] == 'list-internet-gateways':
-        manager.list_internet_gateways()
+        get_manager('list').list_internet_gateways(args['output'], args.get('regions'), args['accounts'])
 
     # Network commands
     elif args['command'] == 'network':
         if args['action'] == 'create-vpc':
-            network_manager.create_vpc(args.get('vpc_name'), args.get('cidr_block'))
+            get_manager('network').create_vpc(args.get('vpc_name'), args.get('cidr_block'))
         elif args['action'] == 'create-subnet':
-            network_manager.create_subnet(args.get('subnet_name'), args.get('vpc_id'), args.get('cidr_block'), args.get('availability_zone'))
+            get_manager('network').create_subnet(args.get('subnet_name'), args.get('vpc_id'), args.get('cidr_block'), args.get('availability_zone'))
         elif args['action'] == 'create-internet-gateway':
-            network_manager.create_internet_gateway()
+            get_manager('network').create_internet_gateway(args.get('name'))
         elif args['action'] == 'attach-internet-gateway':
-            network_manager.attach_internet_gateway(args.get('vpc_id'), args.get('internet_gateway_id'))
+            get_manager('network').attach_internet_gateway(args.get('vpc_id'), args.get('internet_gateway_id'))
         elif args['action'] == 'create-route-table':
-            network_manager.create_route_table(args.vpc_id)
+            get_manager('network').create_route_table(args.get('vpc_id'), args.get('name'))
         elif args['action'] == 'create-route':
-            network_manager.create_route(args.get('route_table_id'), args.get('destination_cidr_block'), args.get('internet_gateway_id'))
+            get_manager('network').create_route(args.get('route_table_id'), args.get('destination_cidr_block'), args.get('internet_gateway_id'))
         elif args['action'] == 'associate-subnet-with-route-table':
-            network_manager.associate_subnet_with_route_table(args.get('subnet_id'), args.get('route_table_id'))
+            get_manager('network').associate_subnet_with_route_table(args.get('subnet_id'), args.get('route_table_id'))
         elif args['action'] == 'enable-vpc-dns-hostnames':
-            network_manager.enable_vpc_dns_hostnames(args.get('vpc_id'))
+            get_manager('network').enable_vpc_dns_hostnames(args.get('vpc_id'))
         else:
             print("Invalid action for 'network' command.")
     # Suggest commands
@@ -246,7 +374,14 @@ def main():
 
     # Provision commands
     elif args['command'] == 'provision':
+        from provision import provision
         provision(args)
+    elif args['command'] == 'plan':
+        from plan import plan
+        plan(args)
+    elif args['command'] == 'inventory':
+        from snapshot import snapshot
+        snapshot(args)
     else:
         parser.print_help()
 
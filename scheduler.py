@@ -0,0 +1,352 @@
+import concurrent.futures
+import hashlib
+import json
+import os
+from executor import get_engine
+from output import print_line
+
+# Every kind of resource provision knows about: where it lives in the YAML, the state
+# type it is tracked under, which keys hold its logical name (the first is the one
+# its creator reads), and which keys refer to other resources in the same file
+# (field -> kind of the resource it names; 'a.b' means key 'b' of each item in list
+# 'a'). Kinds with an 'id_key' are referred to by
+# that ID in API calls, so a reference holding their logical name is replaced by the
+# ID recorded for them before the referring resource is created. 'regional' kinds
+# are looked up in AWS separately in each region they are provisioned in.
+RESOURCE_KINDS = {
+    'vpc': {
+        'label': 'VPC',
+        'state_type': 'vpcs',
+        'name_keys': ['vpc_name', 'name'],
+        'references': {},
+        'id_key': 'vpc_id',
+        'regional': True,
+    },
+    'subnet': {
+        'label': 'Subnet',
+        'state_type': 'subnets',
+        'name_keys': ['subnet_name', 'name'],
+        'references': {'vpc_id': 'vpc'},
+        'id_key': 'subnet_id',
+        'regional': True,
+    },
+    'internet_gateway': {
+        'label': 'Internet gateway',
+        'state_type': 'internet_gateways',
+        'name_keys': ['internet_gateway_name', 'name'],
+        'references': {'vpc_id': 'vpc'},
+        'id_key': 'internet_gateway_id',
+        'regional': True,
+    },
+    'route_table': {
+        'label': 'Route table',
+        'state_type': 'route_tables',
+        'name_keys': ['route_table_name', 'name'],
+        'references': {'vpc_id': 'vpc', 'subnet_ids': 'subnet', 'routes.gateway_id': 'internet_gateway'},
+        'id_key': 'route_table_id',
+        'regional': True,
+    },
+    'instance': {
+        'label': 'Instance',
+        'state_type': 'instances',
+        'name_keys': ['instance_name'],
+        'references': {'subnet_id': 'subnet'},
+        'regional': True,
+    },
+    'bucket': {
+        'label': 'Bucket',
+        'state_type': 'buckets',
+        'name_keys': ['bucket_name'],
+        'references': {},
+    },
+    'iam_user': {
+        'label': 'IAM user',
+        'state_type': 'iam_users',
+        'name_keys': ['user_name', 'name'],
+        'references': {},
+    },
+    'iam_role': {
+        'label': 'IAM role',
+        'state_type': 'iam_roles',
+        'name_keys': ['role_name', 'name'],
+        'references': {},
+    },
+    'iam_policy': {
+        'label': 'IAM policy',
+        'state_type': 'iam_policies',
+        'name_keys': ['policy_name', 'name'],
+        'references': {'roles': 'iam_role', 'users': 'iam_user'},
+    },
+}
+
+# Spec keys that do not describe the resource itself; they are left out of its hash.
+HASH_IGNORED_KEYS = ['type', 'depends_on']
+
+# Top-level YAML sections holding a single kind of resource. Anything under
+# 'resources' carries its kind in a 'type' key instead.
+SECTIONS = {
+    'vpcs': 'vpc',
+    'subnets': 'subnet',
+    'internet_gateways': 'internet_gateway',
+    'route_tables': 'route_table',
+    'instances': 'instance',
+    'buckets': 'bucket',
+}
+
+
+class Node:
+    def __init__(self, kind, name, spec):
+        self.kind = kind
+        self.name = name
+        self.spec = spec
+        self.depends_on = set()
+        self.dependents = set()
+        self.digest = None
+
+    @property
+    def key(self):
+        return (self.kind, self.name)
+
+    @property
+    def label(self):
+        return RESOURCE_KINDS[self.kind]['label']
+
+    @property
+    def state_type(self):
+        return RESOURCE_KINDS[self.kind]['state_type']
+
+    # Region the resource is made in (its spec's 'region'); None for the configured
+    # region.
+    @property
+    def region(self):
+        return self.spec.get('region')
+
+    def __repr__(self):
+        return f"Node({self.kind}.{self.name})"
+
+
+def resource_name(kind, spec):
+    for key in RESOURCE_KINDS[kind]['name_keys']:
+        if spec.get(key):
+            return spec[key]
+    return None
+
+
+def iter_specs(data):
+    for section, kind in SECTIONS.items():
+        for spec in data.get(section) or []:
+            yield kind, spec
+    for spec in data.get('resources') or []:
+        kind = spec.get('type')
+        if kind in RESOURCE_KINDS:
+            yield kind, spec
+        else:
+            print_line(f"Unsupported resource type: {kind}")
+
+
+def build_graph(data):
+    nodes = {}
+    for kind, spec in iter_specs(data or {}):
+        node = Node(kind, resource_name(kind, spec), spec)
+        if node.key in nodes:
+            raise ValueError(f"Duplicate {node.label} '{node.name}' in the YAML file.")
+        nodes[node.key] = node
+
+    by_name = {}
+    for node in nodes.values():
+        by_name.setdefault(node.name, []).append(node)
+
+    for node in nodes.values():
+        # Implicit edges: a field naming another resource in the same file.
+        for field, target_kind in RESOURCE_KINDS[node.kind]['references'].items():
+            for target in reference_values(node.spec, field):
+                if (target_kind, target) in nodes:
+                    add_edge(nodes[(target_kind, target)], node)
+
+        # Explicit edges: depends_on entries are either 'name' or 'kind.name'.
+        for target in as_list(node.spec.get('depends_on')):
+            add_edge(resolve_reference(target, nodes, by_name, node), node)
+
+    assign_digests(nodes, waves(nodes))
+    return nodes
+
+
+def resolve_reference(reference, nodes, by_name, node):
+    kind, _, name = reference.partition('.')
+    if name and (kind, name) in nodes:
+        return nodes[(kind, name)]
+    candidates = by_name.get(reference, [])
+    if len(candidates) == 1:
+        return candidates[0]
+    if candidates:
+        raise ValueError(f"{node.label} '{node.name}' depends on ambiguous resource '{reference}'; use 'kind.name'.")
+    raise ValueError(f"{node.label} '{node.name}' depends on unknown resource '{reference}'.")
+
+
+def reference_values(spec, field):
+    name, _, key = field.partition('.')
+    if key:
+        return [item.get(key) for item in as_list(spec.get(name)) if isinstance(item, dict) and item.get(key)]
+    return as_list(spec.get(name))
+
+
+# Returns a copy of the node's spec with every reference that lookup(key) resolves
+# replaced by the result; other values (such as literal IDs) are kept as they are.
+# A resource named by 'name' alone gets its name under the key its creator reads.
+def resolve_spec(node, lookup):
+    spec = dict(node.spec)
+    name_key = RESOURCE_KINDS[node.kind]['name_keys'][0]
+    if node.name and not spec.get(name_key):
+        spec[name_key] = node.name
+    for field, target_kind in RESOURCE_KINDS[node.kind]['references'].items():
+        if 'id_key' not in RESOURCE_KINDS[target_kind]:
+            continue
+
+        def resolve(value):
+            resolved = lookup((target_kind, value)) if isinstance(value, str) else None
+            return value if resolved is None else resolved
+
+        name, _, key = field.partition('.')
+        value = spec.get(name)
+        if value is None:
+            continue
+        if key:
+            spec[name] = [dict(item, **{key: resolve(item[key])}) if isinstance(item, dict) and key in item else item
+                          for item in as_list(value)]
+        elif isinstance(value, (list, tuple)):
+            spec[name] = [resolve(item) for item in value]
+        else:
+            spec[name] = resolve(value)
+    return spec
+
+
+def add_edge(dependency, dependent):
+    if dependency is not dependent:
+        dependent.depends_on.add(dependency.key)
+        dependency.dependents.add(dependent.key)
+
+
+def as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple, set)):
+        return list(value)
+    return [value]
+
+
+# Hash of a resource's normalized spec. A policy document given as a file path is
+# hashed by content, so editing the file counts as a change.
+def spec_hash(spec):
+    normalized = {key: value for key, value in spec.items() if key not in HASH_IGNORED_KEYS}
+    document = normalized.get('policy_document')
+    if isinstance(document, str) and os.path.isfile(document):
+        with open(document, 'r') as f:
+            normalized['policy_document'] = f.read()
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True, default=str).encode()).hexdigest()
+
+
+# A node's digest covers its own spec and the digests of everything it depends on,
+# so a change to one resource also changes the digest of its dependents.
+def assign_digests(nodes, levels):
+    for wave in levels:
+        for node in wave:
+            digest = hashlib.sha256(spec_hash(node.spec).encode())
+            for key in sorted(node.depends_on, key=str):
+                digest.update(nodes[key].digest.encode())
+            node.digest = digest.hexdigest()
+
+
+# Groups nodes into dependency levels: every node only depends on nodes in earlier
+# waves. Raises ValueError if the graph has a cycle.
+def waves(nodes):
+    remaining = {key: len(node.depends_on) for key, node in nodes.items()}
+    ready = [key for key, count in remaining.items() if count == 0]
+    levels = []
+    while ready:
+        levels.append([nodes[key] for key in ready])
+        next_ready = []
+        for key in ready:
+            del remaining[key]
+            for dependent in nodes[key].dependents:
+                remaining[dependent] -= 1
+                if remaining[dependent] == 0:
+                    next_ready.append(dependent)
+        ready = next_ready
+    if remaining:
+        cycle = ', '.join(f"{kind}.{name}" for kind, name in sorted(remaining, key=str))
+        raise ValueError(f"Dependency cycle between: {cycle}")
+    return levels
+
+
+# Runs task(node) for every node on the shared execution engine's bounded pool,
+# starting each node as soon as everything it depends on has finished. Nodes in
+# 'done' count as already finished. on_done(node, result, error) is called from the
+# calling thread as nodes complete; dependents of a failed node are skipped.
+#
+# If batch_key is given, nodes that become ready together and share a non-None
+# key are handed to batch_task(nodes) as one unit of work (at most batch_size at a
+# time), which must return a {node.key: result} dict; nodes missing from it failed.
+def run(nodes, task, engine=None, done=(), on_done=None, batch_key=None, batch_task=None, batch_size=None):
+    engine = engine or get_engine()
+    finished = set(done)
+    failed = set()
+    waiting = {key: set(node.depends_on) - finished for key, node in nodes.items() if key not in finished}
+    running = {}
+
+    while waiting or running:
+        ready = [key for key, deps in waiting.items() if not deps]
+        for key in ready:
+            del waiting[key]
+        for batch, batched in group_ready([nodes[key] for key in ready], batch_key, batch_size):
+            if batched:
+                running[engine.submit(batch_task, batch)] = (batch, batched)
+            else:
+                running[engine.submit(task, batch[0])] = (batch, batched)
+
+        if not running:
+            break
+
+        completed, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in completed:
+            batch, batched = running.pop(future)
+            error = future.exception()
+            if error:
+                results = {}
+            elif batched:
+                results = future.result()
+            else:
+                results = {batch[0].key: future.result()}
+
+            for node in batch:
+                node_error = error
+                if not node_error and node.key not in results:
+                    node_error = RuntimeError(f"{node.label} '{node.name}' was not created.")
+                if node_error:
+                    failed.add(node.key)
+                    print_line(f"Error occurred while creating {node.label} '{node.name}': {str(node_error)}")
+                else:
+                    finished.add(node.key)
+                    for dependent in node.dependents:
+                        if dependent in waiting:
+                            waiting[dependent].discard(node.key)
+                if on_done:
+                    on_done(node, results.get(node.key), node_error)
+
+    # Anything still waiting had a dependency fail.
+    for key in waiting:
+        print_line(f"Skipping {nodes[key].label} '{nodes[key].name}' because a dependency failed.")
+    return finished, failed
+
+
+def group_ready(ready, batch_key=None, batch_size=None):
+    groups = {}
+    for node in ready:
+        key = batch_key(node) if batch_key else None
+        if key is None:
+            yield [node], False
+        else:
+            groups.setdefault(key, []).append(node)
+    for group in groups.values():
+        size = batch_size or len(group)
+        for i in range(0, len(group), size):
+            yield group[i:i + size], True
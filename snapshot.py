@@ -0,0 +1,86 @@
+import concurrent.futures
+import datetime
+import json
+import os
+import time
+from inventory import Inventory
+from list import ListManager
+
+SNAPSHOT_FORMATS = ['json', 'jsonl']
+
+
+# Runs every listing at the same time, each on its own worker (and each fanning out
+# over accounts and regions in turn), so the snapshot takes about as long as the
+# slowest listing. All listings start together and read AWS rather than the
+# inventory cache, which they refresh on the way.
+def take_snapshot(regions=None, accounts=None):
+    manager = ListManager(Inventory(refresh=True))
+    if regions == 'all':
+        regions = ','.join(ListManager(manager.inventory, profile=(accounts or [None])[0]).resolve_regions(regions))
+    taken_at = datetime.datetime.now(datetime.timezone.utc)
+
+    def fetch(resource_type):
+        started = time.monotonic()
+        try:
+            rows, headers = manager.listing(resource_type, regions if ListManager.LISTINGS[resource_type]['regional'] else None, accounts)
+            records = [dict(zip(headers, row)) for row in rows]
+            failed = manager.errors.get(resource_type)
+            error = '; '.join(f"{target}: {error}" for target, error in sorted(failed.items())) if failed else None
+            return records, time.monotonic() - started, error
+        except Exception as e:
+            return [], time.monotonic() - started, str(e)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(ListManager.LISTINGS)) as pool:
+        futures = {resource_type: pool.submit(fetch, resource_type) for resource_type in ListManager.LISTINGS}
+
+    snapshot = {
+        'taken_at': taken_at.isoformat(),
+        'accounts': accounts or [],
+        'regions': regions.split(',') if regions else [],
+        'resources': {},
+        'timings': {},
+        'errors': {},
+    }
+    for resource_type, future in futures.items():
+        records, seconds, error = future.result()
+        snapshot['resources'][resource_type] = records
+        snapshot['timings'][resource_type] = round(seconds, 3)
+        if error:
+            snapshot['errors'][resource_type] = error
+    return snapshot
+
+
+# Written to a temporary file and moved into place, so a snapshot file is never
+# seen half written.
+def write_snapshot(snapshot, path, output_format='json'):
+    tmp_file = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w') as f:
+        if output_format == 'jsonl':
+            for resource_type, records in snapshot['resources'].items():
+                for record in records:
+                    f.write(json.dumps(dict(record, resource_type=resource_type, taken_at=snapshot['taken_at']), default=str) + '\n')
+        else:
+            json.dump(snapshot, f, indent=2, default=str)
+    os.replace(tmp_file, path)
+
+
+def snapshot(args):
+    from tabulate import tabulate
+    output_format = args.get('format') or 'json'
+    started = time.monotonic()
+    result = take_snapshot(args.get('regions'), args.get('accounts'))
+    seconds = time.monotonic() - started
+
+    path = args.get('out') or f"inventory-{result['taken_at'][:19].replace(':', '').replace('-', '')}Z.{output_format}"
+    write_snapshot(result, path, output_format)
+
+    table_data = []
+    for resource_type, records in result['resources'].items():
+        status = f"Error: {result['errors'][resource_type]}" if resource_type in result['errors'] else 'OK'
+        table_data.append([resource_type, len(records), f"{result['timings'][resource_type]:.2f}", status])
+    print(tabulate(table_data, ['Resource Type', 'Rows', 'Seconds', 'Status'], tablefmt="fancy_grid"))
+
+    total = sum(len(records) for records in result['resources'].values())
+    print(f"Wrote {total} resources to {path} in {seconds:.2f}s "
+          f"(slowest listing {max(result['timings'].values()):.2f}s, all listings {sum(result['timings'].values()):.2f}s).")
+    return result
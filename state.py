@@ -1,26 +1,238 @@
+import atexit
+import contextlib
+import contextvars
+import json
 import os
-import yaml
+import queue
+import threading
+import time
+from output import print_line
+from tracing import span, traced
+from yamlio import load_file, safe_dump, write_cache
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+STATE_BACKENDS = ['yaml', 'sqlite']
+SQLITE_SUFFIXES = ('.db', '.sqlite', '.sqlite3')
+
+# Keys in a resource's state that hold its cloud-side identifier, most specific first.
+CLOUD_ID_KEYS = ['instance_id', 'vpc_id', 'subnet_id', 'internet_gateway_id', 'route_table_id', 'arn', 'bucket_name']
+
+
+def cloud_id(resource_state):
+    if isinstance(resource_state, dict):
+        for key in CLOUD_ID_KEYS:
+            if resource_state.get(key):
+                return str(resource_state[key])
+    return None
+
+
+# Accepts tags as a plain mapping or as a list of {Key, Value} / {key, value} pairs.
+def resource_tags(resource_state):
+    tags = resource_state.get('tags') if isinstance(resource_state, dict) else None
+    if isinstance(tags, dict):
+        return {str(k): str(v) for k, v in tags.items()}
+    result = {}
+    for tag in tags or []:
+        key = tag.get('Key', tag.get('key'))
+        if key is not None:
+            result[str(key)] = str(tag.get('Value', tag.get('value', '')))
+    return result
+
+
+# Picks the state backend: explicit choice, then SARMASTACK_STATE_BACKEND, then the
+# state file's extension (.db/.sqlite mean SQLite); YAML otherwise. Given an
+# account label, that account's own state file is opened instead.
+def open_state_tracker(state_file=None, backend=None, account=None):
+    backend = backend or os.environ.get('SARMASTACK_STATE_BACKEND')
+    if not backend:
+        backend = 'sqlite' if state_file and state_file.endswith(SQLITE_SUFFIXES) else 'yaml'
+    if backend == 'sqlite':
+        from state_sqlite import SqliteStateTracker as tracker_class
+    elif backend == 'yaml':
+        tracker_class = StateTracker
+    else:
+        raise ValueError(f"Unsupported state backend: {backend}")
+    if account:
+        state_file = account_state_file(state_file or tracker_class.DEFAULT_STATE_FILE, account)
+    with span('state.open', backend=backend):
+        return tracker_class(state_file)
+
+
+# state.srstate -> state.<account>.srstate, so the suffix still picks the backend.
+def account_state_file(state_file, account):
+    root, ext = os.path.splitext(state_file)
+    return f'{root}.{account}{ext}'
+
 
 class StateTracker:
     DEFAULT_STATE_FILE = 'state.srstate'
 
-    def __init__(self, state_file=None):
+    # Journal records are flushed on every write but only fsynced once this many
+    # have accumulated, or FSYNC_INTERVAL seconds have passed, or on close().
+    FSYNC_BATCH = 64
+    FSYNC_INTERVAL = 1.0
+    # Once this many records have been journaled the snapshot is rewritten in the
+    # background and the journal starts over.
+    COMPACT_THRESHOLD = 1000
+
+    def __init__(self, state_file=None, journal=True):
         self.state_file = state_file or self.DEFAULT_STATE_FILE
-        self.state = self.load_state()
+        self.journal_file = self.state_file + '.journal'
+        self.lock_file = self.state_file + '.lock'
+        self.journal = journal
+        self.lock = threading.RLock()
+        self.journal_handle = None
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+        self.journaled = 0
+        self.compactor = None
+        with self.file_lock(shared=True):
+            self.state = self.load_state()
+        if self.journal:
+            atexit.register(self.close)
 
+    # Serializes state file access between SarmaStack processes (flock on a side
+    # file, so the snapshot itself can be replaced atomically). A no-op where fcntl
+    # is unavailable.
+    @contextlib.contextmanager
+    def file_lock(self, shared=False):
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_file, 'a') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    # The state is the snapshot with every journal record replayed on top.
+    @traced('state.load')
     def load_state(self):
+        state = {}
         if os.path.exists(self.state_file):
             try:
-                with open(self.state_file, 'r') as f:
-                    state = yaml.safe_load(f)
-                    return state if state is not None else {}
+                state = load_file(self.state_file) or {}
             except FileNotFoundError:
                 pass
-        return {}
+        self.replay(self.journal_file, state)
+        return state
+
+    @staticmethod
+    def replay(journal_file, state):
+        if not os.path.exists(journal_file):
+            return
+        with open(journal_file, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn line from a process killed mid-write; skip it.
+                    continue
+                resources = state.setdefault(record['type'], {})
+                if record.get('deleted'):
+                    resources.pop(record['name'], None)
+                else:
+                    resources[record['name']] = record['state']
 
+    @traced('state.save')
     def save_state(self):
-        with open(self.state_file, 'w') as f:
-            yaml.safe_dump(self.state, f)
+        if self.journal:
+            self.compact()
+        else:
+            with self.lock, self.file_lock():
+                self.write_snapshot(self.state)
+
+    def write_snapshot(self, state):
+        tmp_file = self.state_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            safe_dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.state_file)
+        write_cache(self.state_file, os.stat(self.state_file), state)
+
+    def append(self, record):
+        with self.lock, self.file_lock():
+            # Another process may have compacted (and removed) the journal since it
+            # was opened; appends must go to the file that is there now.
+            if self.journal_handle is not None and not self.same_file(self.journal_handle, self.journal_file):
+                self.journal_handle.close()
+                self.journal_handle = None
+            if self.journal_handle is None:
+                self.journal_handle = open(self.journal_file, 'a')
+                # A process killed mid-write leaves a torn last line; end it so this
+                # record starts on a line of its own instead of being skipped with it.
+                if not self.ends_with_newline(self.journal_file):
+                    self.journal_handle.write('\n')
+            self.journal_handle.write(json.dumps(record, default=str) + '\n')
+            self.journal_handle.flush()
+            self.unsynced += 1
+            self.journaled += 1
+            if self.unsynced >= self.FSYNC_BATCH or time.monotonic() - self.last_sync >= self.FSYNC_INTERVAL:
+                self.sync()
+            if self.journaled >= self.COMPACT_THRESHOLD and self.compactor is None:
+                self.compactor = threading.Thread(target=contextvars.copy_context().run, args=(self.compact,), name='state-compactor')
+                self.compactor.start()
+
+    @staticmethod
+    def ends_with_newline(path):
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                return True
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+
+    @staticmethod
+    def same_file(handle, path):
+        try:
+            return os.path.samestat(os.fstat(handle.fileno()), os.stat(path))
+        except FileNotFoundError:
+            return False
+
+    @traced('state.fsync')
+    def sync(self):
+        with self.lock:
+            if self.journal_handle is not None and self.unsynced:
+                os.fsync(self.journal_handle.fileno())
+            self.unsynced = 0
+            self.last_sync = time.monotonic()
+
+    # Folds the journal into a fresh snapshot. The on-disk snapshot and journal are
+    # re-read under the exclusive file lock, so records appended by other processes
+    # are kept, and the merged result becomes this tracker's state as well.
+    @traced('state.compact')
+    def compact(self):
+        try:
+            with self.lock, self.file_lock():
+                if self.journal_handle is not None:
+                    self.sync()
+                    self.journal_handle.close()
+                    self.journal_handle = None
+                state = self.load_state()
+                self.write_snapshot(state)
+                if os.path.exists(self.journal_file):
+                    os.remove(self.journal_file)
+                self.state = state
+                self.journaled = 0
+        finally:
+            with self.lock:
+                if self.compactor is threading.current_thread():
+                    self.compactor = None
+
+    def close(self):
+        compactor = self.compactor
+        if compactor is not None and compactor is not threading.current_thread():
+            compactor.join()
+        with self.lock:
+            if self.journal_handle is None and not os.path.exists(self.journal_file):
+                return
+        self.compact()
 
     def get_resource_state(self, resource_type, resource_name):
         if resource_type in self.state:
@@ -29,17 +241,82 @@ class StateTracker:
         return None
 
     def update_resource_state(self, resource_type, resource_name, resource_state):
-        if resource_type not in self.state:
-            self.state[resource_type] = {}
-        self.state[resource_type][resource_name] = resource_state
-        self.save_state()
+        with self.lock:
+            if resource_type not in self.state:
+                self.state[resource_type] = {}
+            self.state[resource_type][resource_name] = resource_state
+            if self.journal:
+                self.append({'type': resource_type, 'name': resource_name, 'state': resource_state})
+            else:
+                self.save_state()
+
+    def remove_resource_state(self, resource_type, resource_name):
+        with self.lock:
+            self.state.get(resource_type, {}).pop(resource_name, None)
+            if self.journal:
+                self.append({'type': resource_type, 'name': resource_name, 'deleted': True})
+            else:
+                self.save_state()
 
     def resource_exists(self, resource_type, resource_name):
         return resource_name in self.state.get(resource_type, {})
 
+    def resources(self, resource_type):
+        return dict(self.state.get(resource_type) or {})
+
+    def find_by_cloud_id(self, value):
+        for resource_type, resources in self.state.items():
+            for resource_name, resource_state in (resources or {}).items():
+                if cloud_id(resource_state) == value:
+                    return resource_type, resource_name, resource_state
+        return None
+
+    def find_by_tag(self, key, value, resource_type=None):
+        matches = []
+        for current_type, resources in self.state.items():
+            if resource_type and current_type != resource_type:
+                continue
+            for resource_name, resource_state in (resources or {}).items():
+                if resource_tags(resource_state).get(key) == value:
+                    matches.append((current_type, resource_name, resource_state))
+        return matches
+
     def create_state_file(self):
         with open(self.state_file, 'w') as f:
             f.write('')
 
     def delete_state_file(self):
+        for path in (self.journal_file, self.lock_file):
+            if os.path.exists(path):
+                os.remove(path)
         os.remove(self.state_file)
+
+
+# Single consumer for resource results coming back from worker threads. Workers (or
+# the scheduler) put results on the queue; only this thread touches the tracker. It
+# runs in the context it was started from, so its writes trace under that span.
+class StateWriter:
+    def __init__(self, state_tracker):
+        self.state_tracker = state_tracker
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=contextvars.copy_context().run, args=(self.run,), name='state-writer', daemon=True)
+        self.thread.start()
+
+    def put(self, resource_type, resource_name, resource_state):
+        self.queue.put((resource_type, resource_name, resource_state))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            resource_type, resource_name, resource_state = item
+            try:
+                with span('state.record', resource=resource_name):
+                    self.state_tracker.update_resource_state(resource_type, resource_name, resource_state)
+            except Exception as e:
+                print_line(f"Error occurred while saving state for {resource_name}: {str(e)}")
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
@@ -0,0 +1,138 @@
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from state import cloud_id, resource_tags
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS resources (
+    type TEXT NOT NULL,
+    name TEXT NOT NULL,
+    cloud_id TEXT,
+    state TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (type, name)
+);
+CREATE INDEX IF NOT EXISTS resources_by_name ON resources (name);
+CREATE INDEX IF NOT EXISTS resources_by_cloud_id ON resources (cloud_id);
+CREATE TABLE IF NOT EXISTS resource_tags (
+    type TEXT NOT NULL,
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (type, name, key),
+    FOREIGN KEY (type, name) REFERENCES resources (type, name) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS resource_tags_by_tag ON resource_tags (key, value);
+'''
+
+# Indexed state store with the same API as StateTracker. Lookups only read the rows
+# they need, so opening the store costs the same however large the stack is; every
+# update is its own transaction.
+class SqliteStateTracker:
+    DEFAULT_STATE_FILE = 'state.srstate.db'
+
+    def __init__(self, state_file=None):
+        self.state_file = state_file or self.DEFAULT_STATE_FILE
+        self.lock = threading.RLock()
+        # The connection is shared with the state writer thread; access is
+        # serialized by self.lock.
+        self.connection = sqlite3.connect(self.state_file, timeout=30, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('PRAGMA foreign_keys=ON')
+        self.connection.executescript(SCHEMA)
+
+    @property
+    def state(self):
+        return self.load_state()
+
+    # Materializes the whole store as the nested {type: {name: state}} dict. Only
+    # meant for exports; nothing on the normal path calls it.
+    def load_state(self):
+        state = {}
+        with self.lock:
+            for resource_type, resource_name, resource_state in self.connection.execute(
+                    'SELECT type, name, state FROM resources ORDER BY type, name'):
+                state.setdefault(resource_type, {})[resource_name] = json.loads(resource_state)
+        return state
+
+    def save_state(self):
+        pass
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def get_resource_state(self, resource_type, resource_name):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT state FROM resources WHERE type = ? AND name = ?', (resource_type, resource_name)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update_resource_state(self, resource_type, resource_name, resource_state):
+        with self.lock, self.transaction() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO resources (type, name, cloud_id, state, updated_at) VALUES (?, ?, ?, ?, ?)',
+                (resource_type, resource_name, cloud_id(resource_state),
+                 json.dumps(resource_state, default=str), time.time()))
+            connection.execute('DELETE FROM resource_tags WHERE type = ? AND name = ?', (resource_type, resource_name))
+            connection.executemany(
+                'INSERT INTO resource_tags (type, name, key, value) VALUES (?, ?, ?, ?)',
+                [(resource_type, resource_name, key, value) for key, value in resource_tags(resource_state).items()])
+
+    def remove_resource_state(self, resource_type, resource_name):
+        with self.lock, self.transaction() as connection:
+            connection.execute('DELETE FROM resources WHERE type = ? AND name = ?', (resource_type, resource_name))
+
+    def resource_exists(self, resource_type, resource_name):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT 1 FROM resources WHERE type = ? AND name = ?', (resource_type, resource_name)).fetchone()
+        return row is not None
+
+    def resources(self, resource_type):
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT name, state FROM resources WHERE type = ?', (resource_type,)).fetchall()
+        return {resource_name: json.loads(resource_state) for resource_name, resource_state in rows}
+
+    def find_by_cloud_id(self, value):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT type, name, state FROM resources WHERE cloud_id = ?', (value,)).fetchone()
+        return (row[0], row[1], json.loads(row[2])) if row else None
+
+    def find_by_tag(self, key, value, resource_type=None):
+        query = ('SELECT r.type, r.name, r.state FROM resource_tags t '
+                 'JOIN resources r ON r.type = t.type AND r.name = t.name '
+                 'WHERE t.key = ? AND t.value = ?')
+        params = [key, value]
+        if resource_type:
+            query += ' AND t.type = ?'
+            params.append(resource_type)
+        with self.lock:
+            rows = self.connection.execute(query, params).fetchall()
+        return [(resource_type, resource_name, json.loads(resource_state)) for resource_type, resource_name, resource_state in rows]
+
+    @contextlib.contextmanager
+    def transaction(self):
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        self.connection.execute('COMMIT')
+
+    def create_state_file(self):
+        pass
+
+    def delete_state_file(self):
+        self.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.state_file + suffix):
+                os.remove(self.state_file + suffix)
+
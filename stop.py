@@ -1,8 +1,7 @@
-import boto3
+from clients import lazy_client
 
 class StopManager:
-    def __init__(self):
-        self.ec2_client = boto3.client('ec2')
+    ec2_client = lazy_client('ec2')
     
     def stop_instance(self, args):
         response = self.ec2_client.stop_instances(
@@ -0,0 +1,34 @@
+import os
+import sys
+import tempfile
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'benchmarks')]
+
+# Caches are read from the environment at import time; keep the tests' own apart
+# from the user's.
+CACHE_ROOT = tempfile.mkdtemp(prefix='sarmastack-tests-')
+os.environ['SARMASTACK_CACHE_DIR'] = os.path.join(CACHE_ROOT, 'yaml')
+os.environ['SARMASTACK_INVENTORY_DIR'] = os.path.join(CACHE_ROOT, 'inventory')
+os.environ['SARMASTACK_STS_CACHE_DIR'] = os.path.join(CACHE_ROOT, 'sts')
+os.environ['SARMASTACK_AMI_CATALOG_DIR'] = os.path.join(CACHE_ROOT, 'ami')
+
+from executor import ExecutionEngine  # noqa: E402
+from fakeaws import FakeAWS  # noqa: E402
+
+
+@pytest.fixture
+def fake_aws():
+    import clients
+    fake = FakeAWS().install()
+    yield fake
+    clients.clear_clients()
+
+
+# A small engine of its own, with backoff short enough for retries to be quick.
+@pytest.fixture
+def engine():
+    engine = ExecutionEngine(max_workers=4, base_delay=0.001, max_delay=0.01)
+    yield engine
+    engine.shutdown()
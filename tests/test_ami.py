@@ -0,0 +1,107 @@
+import importlib
+import os
+import pytest
+from botocore.exceptions import ClientError
+import ami
+from ami import CATALOG_TTL, AmiCatalog, catalog_can_answer, search_live
+
+IMAGES = [
+    {'ImageId': 'ami-1', 'Name': 'al2023-ami-2024.01-x86_64', 'Architecture': 'x86_64', 'ImageOwnerAlias': 'amazon',
+     'PlatformDetails': 'Linux/UNIX', 'CreationDate': '2024-01-10T00:00:00.000Z'},
+    {'ImageId': 'ami-2', 'Name': 'al2023-ami-2024.02-arm64', 'Architecture': 'arm64', 'ImageOwnerAlias': 'amazon',
+     'PlatformDetails': 'Linux/UNIX', 'CreationDate': '2024-02-10T00:00:00.000Z'},
+    {'ImageId': 'ami-3', 'Name': 'ubuntu/images/hvm-ssd/ubuntu-jammy-22.04-amd64', 'Architecture': 'x86_64',
+     'OwnerId': '099720109477', 'PlatformDetails': 'Linux/UNIX', 'CreationDate': '2024-03-10T00:00:00.000Z'},
+    {'ImageId': 'ami-4', 'Name': 'Windows_Server-2022-English-Full-Base', 'Architecture': 'x86_64',
+     'ImageOwnerAlias': 'amazon', 'PlatformDetails': 'Windows', 'CreationDate': '2024-04-10T00:00:00.000Z'},
+]
+
+
+@pytest.fixture
+def catalog(fake_aws):
+    fake_aws.images = list(IMAGES)
+    path = os.path.join(ami.CATALOG_DIR, 'eu-west-1.db')
+    if os.path.exists(path):
+        os.remove(path)
+    catalog = AmiCatalog('eu-west-1')
+    yield catalog
+    catalog.close()
+
+
+def image_ids(images):
+    return [image['image_id'] for image in images]
+
+
+# A bad SARMASTACK_AMI_TTL must not break importing ami (and so unrelated commands).
+def test_bad_ttl_falls_back_to_the_default(monkeypatch, capsys):
+    monkeypatch.setenv('SARMASTACK_AMI_TTL', '1d')
+    importlib.reload(ami)
+    catalog = AmiCatalog('us-east-1')
+    catalog.close()
+
+    assert catalog.ttl == CATALOG_TTL
+    assert "Ignoring SARMASTACK_AMI_TTL='1d'" in capsys.readouterr().err
+
+
+def test_ttl_comes_from_the_environment_unless_given(monkeypatch):
+    monkeypatch.setenv('SARMASTACK_AMI_TTL', '60')
+    catalog = AmiCatalog('us-east-1')
+    catalog.close()
+    assert catalog.ttl == 60
+
+    catalog = AmiCatalog('us-east-1', ttl=3600)
+    catalog.close()
+    assert catalog.ttl == 3600
+
+
+def test_catalog_is_refreshed_once_per_ttl(catalog, fake_aws, capsys):
+    catalog.ensure_fresh()
+    catalog.ensure_fresh()
+    assert fake_aws.calls['DescribeImages'] == 1
+    assert "Refreshed AMI catalog for eu-west-1: 4 images." in capsys.readouterr().out
+
+    catalog.ensure_fresh(force=True)
+    assert fake_aws.calls['DescribeImages'] == 2
+
+    # A catalog filled for other owners does not count as fresh.
+    other = AmiCatalog('eu-west-1', owners=['self'])
+    assert not other.is_fresh()
+    other.close()
+
+
+def test_search_filters_and_sorts_newest_first(catalog):
+    catalog.ensure_fresh()
+    assert image_ids(catalog.search()) == ['ami-4', 'ami-3', 'ami-2', 'ami-1']
+    assert image_ids(catalog.search(name_prefix='al2023')) == ['ami-2', 'ami-1']
+    assert image_ids(catalog.search(os_name='amazon-linux', architecture='x86_64')) == ['ami-1']
+    assert image_ids(catalog.search(os_name='windows')) == ['ami-4']
+    assert image_ids(catalog.search(filters={'name': ['*jammy*', 'Windows_*']})) == ['ami-4', 'ami-3']
+    assert image_ids(catalog.search(filters={'owner-id': ['099720109477'], 'architecture': ['x86_64']})) == ['ami-3']
+    assert image_ids(catalog.search(limit=2)) == ['ami-4', 'ami-3']
+    assert catalog.newest(os_name='amazon-linux')['image_id'] == 'ami-2'
+    assert catalog.newest(name_prefix='debian') is None
+
+
+def test_failed_refresh_falls_back_to_the_cached_catalog(catalog, fake_aws, capsys):
+    fake_aws.fail('DescribeImages', 'UnauthorizedOperation')
+    with pytest.raises(ClientError, match='UnauthorizedOperation'):
+        catalog.ensure_fresh()
+
+    catalog.ensure_fresh()
+    fake_aws.fail('DescribeImages', 'UnauthorizedOperation')
+    catalog.ensure_fresh(force=True)
+    assert "using the cached one" in capsys.readouterr().out
+    assert len(catalog.search()) == 4
+
+
+def test_catalog_can_answer_only_default_owners_and_known_filters():
+    assert catalog_can_answer(None)
+    assert catalog_can_answer({'name': ['al2023*'], 'owner-id': ['amazon', '099720109477']})
+    assert not catalog_can_answer({'owner-id': ['123456789012']})
+    assert not catalog_can_answer({'tag:Team': ['web']})
+
+
+def test_search_live_matches_the_catalog(fake_aws):
+    fake_aws.images = list(IMAGES)
+    assert image_ids(search_live('eu-west-1', os_name='amazon-linux')) == ['ami-2', 'ami-1']
+    assert image_ids(search_live('eu-west-1', limit=1)) == ['ami-4']
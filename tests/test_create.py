@@ -0,0 +1,118 @@
+import pytest
+from botocore.exceptions import ClientError
+from create import CreateManager
+from provision import provision
+from state import StateTracker
+from yamlio import safe_dump
+
+
+def instance_specs(count, **spec):
+    return [dict({'instance_name': f'web-{i}', 'image_id': 'ami-1', 'instance_type': 't3.micro'}, **spec)
+            for i in range(count)]
+
+
+def name_tags(fake_aws):
+    return {instance['InstanceId']: tag['Value'] for instance in fake_aws.instances
+            for tag in instance.get('Tags', []) if tag['Key'] == 'Name'}
+
+
+def test_create_instances_launches_once_and_tags_each(fake_aws, engine):
+    created = CreateManager(engine).create_instances(instance_specs(3))
+
+    assert fake_aws.calls['RunInstances'] == 1
+    assert fake_aws.calls['CreateTags'] == 3
+    assert len(set(created)) == 3
+    assert name_tags(fake_aws) == dict(zip(created, ['web-0', 'web-1', 'web-2']))
+
+
+# Instance names are optional; unnamed instances must not take each other's place.
+def test_create_instances_keeps_unnamed_instances_apart(fake_aws, engine):
+    specs = [{'image_id': 'ami-1', 'instance_type': 't3.micro'} for _ in range(3)]
+    created = CreateManager(engine).create_instances(specs)
+    assert len(set(created)) == 3
+
+
+def test_create_instance_from_file_returns_every_instance(fake_aws, engine, tmp_path):
+    path = tmp_path / 'instances.yaml'
+    with open(path, 'w') as f:
+        safe_dump({'instances': [{'image_id': 'ami-1', 'instance_type': 't3.micro'} for _ in range(2)]
+                   + instance_specs(1, image_id='ami-2')}, f)
+    created = CreateManager(engine).create_instance({'file': str(path)})
+
+    assert fake_aws.calls['RunInstances'] == 2
+    assert sorted(created.values()) == ['default-name', 'default-name', 'web-0']
+
+
+def test_create_instances_retries_tags_on_unknown_instances(fake_aws, engine):
+    fake_aws.fail('CreateTags', 'InvalidInstanceID.NotFound', times=2)
+    created = CreateManager(engine).create_instances(instance_specs(2))
+
+    assert fake_aws.calls['CreateTags'] == 4
+    assert name_tags(fake_aws) == dict(zip(created, ['web-0', 'web-1']))
+
+
+# The instances are running either way, so they must be returned (and recorded).
+def test_create_instances_returns_instances_that_could_not_be_tagged(fake_aws, engine, capsys):
+    fake_aws.fail('CreateTags', 'UnauthorizedOperation')
+    created = CreateManager(engine).create_instances(instance_specs(2))
+
+    assert len(set(created)) == 2
+    assert fake_aws.calls['CreateTags'] == 2
+    assert len(name_tags(fake_aws)) == 1
+    assert "Error occurred while tagging instance" in capsys.readouterr().out
+
+
+def test_provision_batches_instances_sharing_a_launch_key(fake_aws, tmp_path):
+    data = {'instances': instance_specs(5) + instance_specs(1, instance_name='db', instance_type='r6g.large')}
+    path = tmp_path / 'infrastructure.yaml'
+    with open(path, 'w') as f:
+        safe_dump(data, f)
+    state_file = str(tmp_path / 'state.srstate')
+
+    provision({'file': str(path), 'state_file': state_file})
+
+    # One launch for the five web instances, one for db (tagged at launch).
+    assert fake_aws.calls['RunInstances'] == 2
+    recorded = StateTracker(state_file).resources('instances')
+    assert sorted(recorded) == ['db', 'web-0', 'web-1', 'web-2', 'web-3', 'web-4']
+    assert len({resource_state['instance_id'] for resource_state in recorded.values()}) == 6
+
+    # Nothing is launched again on the next run.
+    provision({'file': str(path), 'state_file': state_file})
+    assert fake_aws.calls['RunInstances'] == 2
+
+
+def test_provision_creates_iam_resources_named_by_name_only(fake_aws, tmp_path):
+    policy = {'Version': '2012-10-17', 'Statement': [{'Effect': 'Allow', 'Action': 's3:GetObject', 'Resource': '*'}]}
+    data = {'resources': [
+        {'type': 'iam_user', 'name': 'alice'},
+        {'type': 'iam_role', 'name': 'deploy', 'assume_role_policy': policy},
+        {'type': 'iam_policy', 'name': 'read', 'policy_document': policy, 'roles': ['deploy'], 'users': ['alice']},
+    ]}
+    path = tmp_path / 'infrastructure.yaml'
+    with open(path, 'w') as f:
+        safe_dump(data, f)
+    state_file = str(tmp_path / 'state.srstate')
+
+    provision({'file': str(path), 'state_file': state_file})
+
+    tracker = StateTracker(state_file)
+    assert tracker.get_resource_state('iam_users', 'alice')['arn'].endswith(':user/alice')
+    assert tracker.get_resource_state('iam_roles', 'deploy')['arn'].endswith(':role/deploy')
+    assert tracker.get_resource_state('iam_policies', 'read')['arn'].endswith(':policy/read')
+    assert fake_aws.calls['AttachRolePolicy'] == fake_aws.calls['AttachUserPolicy'] == 1
+
+
+# A provision run after a partial failure finds the role already there.
+def test_create_iam_role_takes_over_an_existing_role(fake_aws, engine):
+    fake_aws.fail('CreateRole', 'EntityAlreadyExists')
+    role = CreateManager(engine).create_iam_role('deploy', {'Version': '2012-10-17', 'Statement': []})
+
+    assert role == {'role_name': 'deploy', 'arn': 'arn:aws:iam::123456789012:role/deploy'}
+    assert fake_aws.calls['GetRole'] == 1
+
+
+def test_create_iam_role_raises_other_errors(fake_aws, engine):
+    fake_aws.fail('CreateRole', 'MalformedPolicyDocument')
+    with pytest.raises(ClientError, match='MalformedPolicyDocument'):
+        CreateManager(engine).create_iam_role('deploy', {'Version': '2012-10-17', 'Statement': []})
@@ -0,0 +1,63 @@
+from delete import DeleteManager
+
+
+def test_force_delete_empties_buckets_in_batches(fake_aws, engine, capsys):
+    fake_aws.populate_objects('logs', 2500).populate_objects('data', 10)
+    DeleteManager(engine).delete_bucket({'bucket_name': ['logs', 'data'], 'force': True})
+
+    assert fake_aws.calls['DeleteObjects'] == 4
+    assert fake_aws.calls['DeleteBucket'] == 2
+    assert "Deleted 2510 objects" in capsys.readouterr().out
+
+
+def test_force_delete_retries_throttled_keys_and_keeps_buckets_with_errors(fake_aws, engine, capsys):
+    fake_aws.populate_objects('logs', 3)
+    responses = [
+        {'Errors': [{'Key': 'key-0', 'VersionId': 'v0', 'Code': 'SlowDown'},
+                    {'Key': 'key-1', 'VersionId': 'v1', 'Code': 'AccessDenied', 'Message': 'Access Denied'}]},
+        {},
+    ]
+    requests = []
+
+    def delete_objects(params):
+        requests.append([item['Key'] for item in params['Delete']['Objects']])
+        return responses.pop(0)
+
+    fake_aws.delete_objects = delete_objects
+    DeleteManager(engine).delete_bucket({'bucket_name': ['logs'], 'force': True})
+
+    assert requests == [['key-0', 'key-1', 'key-2'], ['key-0']]
+    # The key that could not be deleted keeps the bucket from being deleted.
+    assert fake_aws.calls['DeleteBucket'] == 0
+    output = capsys.readouterr().out
+    assert "Error occurred while deleting key-1 from bucket logs: Access Denied" in output
+    assert "not empty" in output
+
+
+def test_cascade_deletes_a_vpc_and_its_dependents(fake_aws, engine, capsys):
+    fake_aws.populate_vpc('vpc-1', 8)
+    DeleteManager(engine).delete_vpc({'vpc_id': 'vpc-1', 'cascade': True})
+
+    for operation, count in [('DetachInternetGateway', 1), ('DisassociateRouteTable', 2), ('DeleteNetworkInterface', 2),
+                             ('RevokeSecurityGroupIngress', 2), ('DeleteInternetGateway', 1), ('DeleteRouteTable', 2),
+                             ('DeleteSubnet', 2), ('DeleteSecurityGroup', 2), ('DeleteVpc', 1)]:
+        assert fake_aws.calls[operation] == count, operation
+    assert "Deleted VPC: vpc-1" in capsys.readouterr().out
+
+
+def test_cascade_stops_after_a_failed_wave(fake_aws, engine, capsys):
+    fake_aws.populate_vpc('vpc-1', 8)
+    fake_aws.fail('DetachInternetGateway', 'DependencyViolation')
+    DeleteManager(engine).delete_vpc({'vpc_id': 'vpc-1', 'cascade': True})
+
+    assert fake_aws.calls['DeleteSubnet'] == fake_aws.calls['DeleteVpc'] == 0
+    assert "Stopped deleting VPC vpc-1" in capsys.readouterr().out
+
+
+def test_cascade_leaves_vpcs_with_interfaces_in_use(fake_aws, engine, capsys):
+    fake_aws.populate_vpc('vpc-1', 4)
+    fake_aws.network_interfaces[0]['Status'] = 'in-use'
+    DeleteManager(engine).delete_vpc({'vpc_id': 'vpc-1', 'cascade': True})
+
+    assert fake_aws.calls['DeleteVpc'] == 0
+    assert "has network interfaces in use: eni-00000000" in capsys.readouterr().out
@@ -0,0 +1,108 @@
+import time
+import pytest
+from botocore.exceptions import ClientError
+import clients
+from clients import lazy_client
+from executor import TokenBucket
+
+
+def client_error(code):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, 'DescribeInstances')
+
+
+class Flaky:
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'done'
+
+
+def test_token_bucket_rejects_bad_rates_and_clamps_capacity():
+    with pytest.raises(ValueError):
+        TokenBucket(0, 10)
+    assert TokenBucket(5, 0.5).capacity == 1
+
+
+def test_token_bucket_paces_calls_past_its_burst():
+    bucket = TokenBucket(50, 2)
+    start = time.monotonic()
+    for _ in range(7):
+        bucket.acquire()
+    # Two tokens are there at once; the other five take 1/50 s each.
+    assert time.monotonic() - start >= 0.09
+
+
+def test_token_bucket_halves_its_rate_on_throttles_and_recovers():
+    bucket = TokenBucket(100, 10)
+    bucket.throttled()
+    assert bucket.rate == 50
+    for _ in range(100):
+        bucket.throttled()
+    assert bucket.rate == 100 * TokenBucket.MIN_RATE_FRACTION
+    for _ in range(100):
+        bucket.succeeded()
+    assert bucket.rate == 100
+
+
+def test_call_retries_throttles_and_transient_errors(engine):
+    fn = Flaky(client_error('Throttling'), client_error('RequestTimeout'))
+    assert engine.call(fn) == 'done'
+    assert fn.calls == 3
+
+
+def test_call_gives_up_after_max_attempts(engine):
+    fn = Flaky(*[client_error('SlowDown')] * engine.max_attempts)
+    with pytest.raises(ClientError, match='SlowDown'):
+        engine.call(fn)
+    assert fn.calls == engine.max_attempts
+
+
+def test_call_raises_other_errors_at_once(engine):
+    fn = Flaky(client_error('AccessDenied'), ValueError('bad'))
+    with pytest.raises(ClientError, match='AccessDenied'):
+        engine.call(fn)
+    with pytest.raises(ValueError):
+        engine.call(fn)
+    assert fn.calls == 2
+
+
+def test_map_keeps_the_order_of_its_inputs(engine):
+    assert engine.map(lambda x: x * 2, range(20)) == [x * 2 for x in range(20)]
+
+
+class Manager:
+    ec2_client = lazy_client('ec2')
+
+    def __init__(self, engine=None):
+        self.engine = engine
+
+
+# The engine is the only retry layer for its clients, paginated calls included.
+def test_engine_clients_are_retried_by_the_engine_alone(fake_aws, engine):
+    ec2_client = Manager(engine).ec2_client
+    assert ec2_client.meta.config.retries['total_max_attempts'] == 1
+    assert Manager().ec2_client.meta.config.retries['total_max_attempts'] == 6
+
+    fake_aws.populate(3)
+    fake_aws.fail('DescribeInstances', 'Throttling', times=2)
+    pages = list(ec2_client.get_paginator('describe_instances').paginate())
+    assert sum(len(reservation['Instances']) for page in pages for reservation in page['Reservations']) == 3
+    assert fake_aws.calls['DescribeInstances'] == 3
+    # Each throttle slowed the region's EC2 bucket down.
+    assert engine.bucket('ec2', ec2_client.meta.region_name).rate < engine.rates['ec2'][0]
+
+
+def test_retried_calls_resend_their_idempotency_token(fake_aws, engine):
+    tokens = []
+    clients.get_session()._session.register(
+        'before-call.ec2.RunInstances', lambda context, **kwargs: tokens.append(context['fake_params']['ClientToken']))
+    fake_aws.fail('RunInstances', 'RequestTimeout')
+    Manager(engine).ec2_client.run_instances(ImageId='ami-1', InstanceType='t3.micro', MinCount=1, MaxCount=1)
+
+    assert len(tokens) == 2
+    assert tokens[0] == tokens[1]
@@ -0,0 +1,80 @@
+import json
+import pytest
+from botocore.exceptions import ClientError
+import inventory
+from clients import get_client
+from inventory import Inventory, cache_file, invalidate
+
+
+class Fetcher:
+    def __init__(self, rows):
+        self.rows = rows
+        self.count = 0
+
+    def __call__(self):
+        self.count += 1
+        return iter(self.rows)
+
+
+@pytest.fixture(autouse=True)
+def empty_inventory():
+    invalidate()
+    yield
+    invalidate()
+
+
+def rows(cache, resource_type, fetch):
+    return list(cache.rows(resource_type, fetch, 'us-east-1', 'test'))
+
+
+def test_listings_are_served_from_the_cache_while_fresh():
+    fetch = Fetcher([['i-1', 'web', '2024-01-01 00:00:00'], ['i-2', None, '2024-01-02 00:00:00']])
+    assert rows(Inventory(), 'instances', fetch) == fetch.rows
+    assert rows(Inventory(), 'instances', fetch) == fetch.rows
+    assert fetch.count == 1
+
+    # --refresh goes to AWS and caches the new rows.
+    assert rows(Inventory(refresh=True), 'instances', fetch) == fetch.rows
+    assert fetch.count == 2
+
+
+def test_stale_listings_are_fetched_again():
+    fetch = Fetcher([['i-1']])
+    rows(Inventory(), 'instances', fetch)
+    path = cache_file('instances', 'us-east-1', 'test')
+    with open(path) as f:
+        lines = f.readlines()
+    fetched_at = json.loads(lines[0])['fetched_at'] - inventory.DEFAULT_TTLS['instances'] - 1
+    with open(path, 'w') as f:
+        f.writelines([json.dumps({'fetched_at': fetched_at}) + '\n'] + lines[1:])
+
+    # --max-age overrides the resource type's own TTL.
+    assert rows(Inventory(max_age=3600), 'instances', fetch) == [['i-1']]
+    assert fetch.count == 1
+    assert rows(Inventory(), 'instances', fetch) == [['i-1']]
+    assert fetch.count == 2
+
+
+# A listing that was not read to the end must not replace the cached one.
+def test_partial_listings_are_not_cached():
+    fetch = Fetcher([['i-1'], ['i-2']])
+    listing = Inventory().rows('instances', fetch, 'us-east-1', 'test')
+    next(listing)
+    listing.close()
+    assert Inventory().read('instances', 'us-east-1', 'test') is None
+
+
+def test_mutating_calls_drop_the_listings_they_affect(fake_aws):
+    rows(Inventory(), 'buckets', Fetcher([['logs']]))
+    rows(Inventory(), 'instances', Fetcher([['i-1']]))
+
+    get_client('s3', 'us-east-1').create_bucket(Bucket='data')
+    assert Inventory().read('buckets', 'us-east-1', 'test') is None
+    assert list(Inventory().read('instances', 'us-east-1', 'test')) == [['i-1']]
+
+    # Failed calls change nothing.
+    rows(Inventory(), 'buckets', Fetcher([['logs']]))
+    fake_aws.fail('CreateBucket', 'BucketAlreadyExists')
+    with pytest.raises(ClientError):
+        get_client('s3', 'us-east-1').create_bucket(Bucket='logs')
+    assert list(Inventory().read('buckets', 'us-east-1', 'test')) == [['logs']]
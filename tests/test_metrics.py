@@ -0,0 +1,76 @@
+import json
+import pytest
+from botocore.exceptions import ClientError
+import metrics
+from clients import get_client, lazy_client
+
+
+class Manager:
+    ec2_client = lazy_client('ec2')
+
+    def __init__(self, engine):
+        self.engine = engine
+
+
+# Sessions are instrumented when the registry creates them, so metrics are
+# enabled before fake_aws builds its session.
+@pytest.fixture
+def recorder(monkeypatch):
+    monkeypatch.setattr(metrics, '_metrics', None)
+    return metrics.enable_metrics()
+
+
+def test_calls_errors_and_throttles_are_counted(recorder, fake_aws):
+    s3_client = get_client('s3', 'us-east-1')
+    s3_client.list_buckets()
+    s3_client.list_buckets()
+    fake_aws.fail('CreateBucket', 'SlowDown')
+    with pytest.raises(ClientError):
+        s3_client.create_bucket(Bucket='logs')
+
+    stats = dict(recorder.snapshot())
+    assert stats[('s3', 'ListBuckets')].calls == 2
+    assert stats[('s3', 'ListBuckets')].errors == 0
+    assert stats[('s3', 'CreateBucket')].errors == stats[('s3', 'CreateBucket')].throttles == 1
+
+
+# The engine retries its clients itself, so each attempt is a call of its own.
+def test_engine_retries_show_up_as_calls(recorder, fake_aws, engine):
+    fake_aws.fail('DescribeRegions', 'Throttling')
+    Manager(engine).ec2_client.describe_regions()
+
+    stats = dict(recorder.snapshot())[('ec2', 'DescribeRegions')]
+    assert (stats.calls, stats.errors, stats.throttles, stats.retries) == (2, 1, 1, 0)
+
+
+def test_metrics_are_written_as_json_or_prometheus(recorder, fake_aws, tmp_path, capsys):
+    get_client('s3', 'us-east-1').list_buckets()
+
+    recorder.finish(show=True, path=str(tmp_path / 'metrics.json'))
+    with open(tmp_path / 'metrics.json') as f:
+        operations = json.load(f)['operations']
+    assert [(operation['service'], operation['operation'], operation['calls']) for operation in operations] == [('s3', 'ListBuckets', 1)]
+    assert sum(operations[0]['histogram']) == 1
+    assert "1 AWS API calls" in capsys.readouterr().err
+
+    recorder.write(str(tmp_path / 'metrics.prom'))
+    with open(tmp_path / 'metrics.prom') as f:
+        text = f.read()
+    assert 'sarmastack_aws_call_duration_seconds_bucket{service="s3",operation="ListBuckets",le="+Inf"} 1' in text
+    assert 'sarmastack_aws_call_duration_seconds_count{service="s3",operation="ListBuckets"} 1' in text
+    assert 'sarmastack_aws_errors_total{service="s3",operation="ListBuckets"} 0' in text
+
+
+def test_sessions_are_not_instrumented_unless_enabled(monkeypatch, fake_aws):
+    monkeypatch.setattr(metrics, '_metrics', None)
+    get_client('s3', 'us-east-1').list_buckets()
+    assert metrics.get_metrics() is None
+
+
+def test_quantiles_come_from_the_histogram():
+    stats = metrics.CallStats()
+    for seconds in [0.001] * 90 + [0.2] * 9 + [40]:
+        stats.observe(seconds)
+    assert stats.quantile(0.5) == 0.005
+    assert stats.quantile(0.95) == 0.25
+    assert stats.quantile(1) == 40
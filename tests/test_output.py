@@ -0,0 +1,63 @@
+import io
+import threading
+from tabulate import tabulate
+from output import TABLE_CHUNK_ROWS, print_line, write_rows
+
+HEADERS = ['Name', 'Instance ID', 'State']
+
+
+def listing(count):
+    # IDs get longer further down, as they do in real listings.
+    return [[f'web-{i}', f'i-{i ** 3:x}', 'running' if i % 2 else None] for i in range(count)]
+
+
+def test_short_table_is_left_to_tabulate():
+    rows = listing(5)
+    stream = io.StringIO()
+    assert write_rows(iter(rows), HEADERS, 'table', stream=stream) == 5
+    assert stream.getvalue() == tabulate(rows, HEADERS, tablefmt="fancy_grid") + '\n'
+
+
+# A long table is one grid with one set of column widths, as tabulate would draw
+# it with every row in memory.
+def test_long_table_is_one_aligned_grid():
+    rows = listing(3 * TABLE_CHUNK_ROWS + 7)
+    stream = io.StringIO()
+    assert write_rows(iter(rows), HEADERS, 'table', stream=stream) == len(rows)
+    expected = tabulate([['' if cell is None else cell for cell in row] for row in rows], HEADERS, tablefmt="fancy_grid")
+    assert stream.getvalue() == expected + '\n'
+    assert len({len(line) for line in stream.getvalue().splitlines()}) == 1
+
+
+def test_empty_table_prints_the_empty_message():
+    stream = io.StringIO()
+    assert write_rows(iter([]), HEADERS, 'table', "No instances found.", stream) == 0
+    assert stream.getvalue() == "No instances found.\n"
+
+
+class RecordingStream:
+    def __init__(self):
+        self.writes = []
+
+    def write(self, text):
+        self.writes.append(text)
+
+    def flush(self):
+        pass
+
+
+def test_print_line_writes_each_message_whole():
+    stream = RecordingStream()
+
+    def worker(n):
+        for i in range(200):
+            print_line(f"Created resource {n}-{i}", stream)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(stream.writes) == 1600
+    assert all(text.startswith('Created resource ') and text.count('\n') == 1 and text.endswith('\n')
+               for text in stream.writes)
@@ -0,0 +1,61 @@
+import scheduler
+from plan import Planner
+from state import StateTracker
+
+DATA = {'buckets': [{'bucket_name': 'logs', 'region': 'us-east-1'}]}
+
+
+def bucket_node(data=DATA):
+    return scheduler.build_graph(data)[('bucket', 'logs')]
+
+
+def test_diff_new_resource():
+    change = Planner.diff(bucket_node(), None, None)
+    assert (change['action'], change['reason']) == ('create', "New resource.")
+
+
+def test_diff_tracked_resource_missing_from_aws():
+    change = Planner.diff(bucket_node(), {'bucket_name': 'logs'}, None)
+    assert (change['action'], change['reason']) == ('create', "Not found in AWS.")
+
+
+def test_diff_live_resource_missing_from_state():
+    live = {'bucket_name': 'logs'}
+    change = Planner.diff(bucket_node(), None, live)
+    assert (change['action'], change['state']) == ('update', live)
+    assert not change.get('changed')
+
+
+def test_diff_state_pointing_at_another_resource():
+    node = scheduler.build_graph({'vpcs': [{'vpc_name': 'main'}]})[('vpc', 'main')]
+    change = Planner.diff(node, {'vpc_id': 'vpc-1', 'spec_hash': node.digest}, {'vpc_id': 'vpc-2'})
+    assert change['action'] == 'update'
+    assert change['reason'] == "State has vpc-1, AWS has vpc-2."
+
+
+def test_diff_changed_spec():
+    node = bucket_node()
+    edited = bucket_node({'buckets': [{'bucket_name': 'logs', 'region': 'eu-west-1'}]})
+    change = Planner.diff(edited, {'bucket_name': 'logs', 'spec_hash': node.digest}, {'bucket_name': 'logs'})
+    assert (change['action'], change['changed']) == ('update', True)
+
+
+def test_diff_up_to_date():
+    node = bucket_node()
+    change = Planner.diff(node, {'bucket_name': 'logs', 'spec_hash': node.digest}, {'bucket_name': 'logs'})
+    assert (change['action'], change['reason']) == ('no-op', "Up to date.")
+
+
+def test_plan_against_aws(fake_aws, engine, tmp_path):
+    fake_aws.buckets['logs'] = fake_aws.created
+    fake_aws.buckets['old'] = fake_aws.created
+    data = {'buckets': [{'bucket_name': 'logs', 'region': 'us-east-1'}, {'bucket_name': 'new', 'region': 'us-east-1'}]}
+    tracker = StateTracker(str(tmp_path / 'state.srstate'))
+    tracker.update_resource_state('buckets', 'old', {'bucket_name': 'old'})
+    tracker.update_resource_state('buckets', 'gone', {'bucket_name': 'gone'})
+
+    result = Planner(engine).plan(data, tracker)
+    actions = {change['name']: change['action'] for change in result.changes}
+    assert actions == {'logs': 'update', 'new': 'create', 'old': 'delete', 'gone': 'delete'}
+    assert result.summary() == "Plan: 1 to create, 1 to update, 2 to delete, 0 unchanged."
+    tracker.close()
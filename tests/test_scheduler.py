@@ -0,0 +1,140 @@
+import threading
+import pytest
+import scheduler
+
+DATA = {
+    'vpcs': [{'vpc_name': 'main', 'cidr_block': '10.0.0.0/16'}],
+    'subnets': [{'subnet_name': 'public', 'vpc_id': 'main', 'cidr_block': '10.0.1.0/24'}],
+    'instances': [
+        {'instance_name': 'web-1', 'subnet_id': 'public', 'image_id': 'ami-1', 'instance_type': 't3.micro'},
+        {'instance_name': 'web-2', 'subnet_id': 'public', 'image_id': 'ami-1', 'instance_type': 't3.micro'},
+    ],
+    'buckets': [{'bucket_name': 'logs'}],
+}
+
+
+class Recorder:
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.events = []
+        self.lock = threading.Lock()
+
+    def task(self, node):
+        with self.lock:
+            self.events.append(('start', node.key))
+        if node.name in self.fail:
+            raise RuntimeError(f"{node.name} failed")
+        with self.lock:
+            self.events.append(('end', node.key))
+        return node.name
+
+    def position(self, event, key):
+        return self.events.index((event, key))
+
+
+def test_build_graph_records_references():
+    nodes = scheduler.build_graph(DATA)
+    assert nodes[('subnet', 'public')].depends_on == {('vpc', 'main')}
+    assert nodes[('instance', 'web-1')].depends_on == {('subnet', 'public')}
+    assert [sorted(node.name for node in wave) for wave in scheduler.waves(nodes)] == [
+        ['logs', 'main'], ['public'], ['web-1', 'web-2']]
+
+
+def test_waves_reject_cycles():
+    data = {'resources': [
+        {'type': 'iam_user', 'user_name': 'a', 'depends_on': 'b'},
+        {'type': 'iam_user', 'user_name': 'b', 'depends_on': 'a'},
+    ]}
+    with pytest.raises(ValueError, match='Dependency cycle'):
+        scheduler.build_graph(data)
+
+
+def test_run_starts_nodes_after_their_dependencies(engine):
+    nodes = scheduler.build_graph(DATA)
+    recorder = Recorder()
+    finished, failed = scheduler.run(nodes, recorder.task, engine=engine)
+
+    assert finished == set(nodes)
+    assert failed == set()
+    for node in nodes.values():
+        for dependency in node.depends_on:
+            assert recorder.position('end', dependency) < recorder.position('start', node.key)
+
+
+def test_run_skips_dependents_of_failed_nodes(engine, capsys):
+    nodes = scheduler.build_graph(DATA)
+    recorder = Recorder(fail={'public'})
+    done = []
+    finished, failed = scheduler.run(nodes, recorder.task, engine=engine,
+                                     on_done=lambda node, result, error: done.append((node.key, result, error)))
+
+    assert failed == {('subnet', 'public')}
+    assert finished == {('vpc', 'main'), ('bucket', 'logs')}
+    assert ('start', ('instance', 'web-1')) not in recorder.events
+    # on_done sees every node that ran, failures included, but not skipped ones.
+    assert sorted(key for key, _, _ in done) == [('bucket', 'logs'), ('subnet', 'public'), ('vpc', 'main')]
+    assert [str(error) for key, _, error in done if key == ('subnet', 'public')] == ['public failed']
+    output = capsys.readouterr().out
+    assert "Error occurred while creating Subnet 'public': public failed" in output
+    assert "Skipping Instance 'web-1' because a dependency failed." in output
+
+
+def test_run_treats_done_nodes_as_finished(engine):
+    nodes = scheduler.build_graph(DATA)
+    recorder = Recorder()
+    done = {('vpc', 'main'), ('subnet', 'public')}
+    finished, failed = scheduler.run(nodes, recorder.task, engine=engine, done=done)
+
+    assert finished == set(nodes)
+    assert {key for event, key in recorder.events if event == 'start'} == set(nodes) - done
+
+
+def test_run_batches_ready_nodes_by_key(engine, capsys):
+    data = {'instances': [{'instance_name': f'web-{i}', 'image_id': 'ami-1', 'instance_type': 't3.micro'}
+                          for i in range(5)]}
+    nodes = scheduler.build_graph(data)
+    batches = []
+
+    def batch_task(batch):
+        batches.append(sorted(node.name for node in batch))
+        # web-4 is left out of the result, as if it had not been created.
+        return {node.key: node.name for node in batch if node.name != 'web-4'}
+
+    finished, failed = scheduler.run(nodes, lambda node: pytest.fail('not batched'), engine=engine,
+                                     batch_key=lambda node: node.spec['image_id'], batch_task=batch_task, batch_size=3)
+
+    assert sorted(batches) == [['web-0', 'web-1', 'web-2'], ['web-3', 'web-4']]
+    assert failed == {('instance', 'web-4')}
+    assert finished == set(nodes) - failed
+    assert "Instance 'web-4' was not created." in capsys.readouterr().out
+
+
+def test_run_fails_the_whole_batch_when_it_raises(engine):
+    data = {'instances': [{'instance_name': f'web-{i}', 'image_id': 'ami-1', 'instance_type': 't3.micro'}
+                          for i in range(3)]}
+    nodes = scheduler.build_graph(data)
+
+    def batch_task(batch):
+        raise RuntimeError('launch failed')
+
+    finished, failed = scheduler.run(nodes, None, engine=engine, batch_key=lambda node: 'all', batch_task=batch_task)
+    assert finished == set()
+    assert failed == set(nodes)
+
+
+# IAM resources may be named by 'name' alone; their creators read user_name,
+# role_name and policy_name.
+def test_resolve_spec_fills_in_the_name_key_the_creator_reads():
+    data = {'resources': [
+        {'type': 'iam_user', 'name': 'alice'},
+        {'type': 'iam_role', 'name': 'deploy', 'role_name': 'deploy'},
+        {'type': 'iam_policy', 'name': 'read', 'roles': ['deploy']},
+    ], 'vpcs': [{'name': 'main'}]}
+    nodes = scheduler.build_graph(data)
+    lookup = lambda key: None
+    assert scheduler.resolve_spec(nodes[('iam_user', 'alice')], lookup)['user_name'] == 'alice'
+    assert scheduler.resolve_spec(nodes[('iam_role', 'deploy')], lookup)['role_name'] == 'deploy'
+    assert scheduler.resolve_spec(nodes[('iam_policy', 'read')], lookup)['policy_name'] == 'read'
+    assert scheduler.resolve_spec(nodes[('vpc', 'main')], lookup)['vpc_name'] == 'main'
+    # The node's own spec, which its digest covers, is left as it was.
+    assert 'user_name' not in nodes[('iam_user', 'alice')].spec
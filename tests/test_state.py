@@ -0,0 +1,90 @@
+import json
+import os
+import pytest
+from state import StateTracker, open_state_tracker
+from yamlio import load_file
+
+
+@pytest.fixture
+def state_file(tmp_path):
+    return str(tmp_path / 'state.srstate')
+
+
+def journal_records(tracker):
+    with open(tracker.journal_file) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_changes_are_journaled_and_replayed(state_file):
+    tracker = StateTracker(state_file)
+    tracker.update_resource_state('buckets', 'logs', {'bucket_name': 'logs'})
+    tracker.update_resource_state('instances', 'web', {'instance_id': 'i-1'})
+    tracker.update_resource_state('instances', 'web', {'instance_id': 'i-2'})
+    tracker.remove_resource_state('buckets', 'logs')
+
+    assert not os.path.exists(state_file)
+    assert len(journal_records(tracker)) == 4
+
+    # A second tracker, as in the next run after a crash, sees every change.
+    replayed = StateTracker(state_file)
+    assert replayed.state == {'buckets': {}, 'instances': {'web': {'instance_id': 'i-2'}}}
+    tracker.close()
+    replayed.close()
+
+
+def test_close_folds_the_journal_into_the_snapshot(state_file):
+    tracker = StateTracker(state_file)
+    tracker.update_resource_state('iam_users', 'alice', {'user_name': 'alice'})
+    tracker.close()
+
+    assert not os.path.exists(tracker.journal_file)
+    assert load_file(state_file) == {'iam_users': {'alice': {'user_name': 'alice'}}}
+    assert StateTracker(state_file).state == {'iam_users': {'alice': {'user_name': 'alice'}}}
+
+
+def test_compaction_starts_once_the_threshold_is_reached(state_file):
+    tracker = StateTracker(state_file)
+    tracker.COMPACT_THRESHOLD = 3
+    for i in range(3):
+        tracker.update_resource_state('instances', f'web-{i}', {'instance_id': f'i-{i}'})
+    compactor = tracker.compactor
+    if compactor is not None:
+        compactor.join()
+
+    assert not os.path.exists(tracker.journal_file)
+    assert tracker.journaled == 0
+    assert set(load_file(state_file)['instances']) == {'web-0', 'web-1', 'web-2'}
+
+    # Records after compaction start a new journal on top of the new snapshot.
+    tracker.update_resource_state('instances', 'web-3', {'instance_id': 'i-3'})
+    assert journal_records(tracker) == [{'type': 'instances', 'name': 'web-3', 'state': {'instance_id': 'i-3'}}]
+    assert set(StateTracker(state_file).state['instances']) == {'web-0', 'web-1', 'web-2', 'web-3'}
+    tracker.close()
+
+
+def test_torn_journal_line_is_skipped_and_terminated(state_file):
+    with open(state_file + '.journal', 'w') as f:
+        f.write(json.dumps({'type': 'buckets', 'name': 'logs', 'state': {'bucket_name': 'logs'}}) + '\n')
+        f.write('{"type": "buckets", "name": "tor')
+
+    tracker = StateTracker(state_file)
+    assert tracker.state == {'buckets': {'logs': {'bucket_name': 'logs'}}}
+
+    # The next record goes on a line of its own rather than onto the torn one.
+    tracker.update_resource_state('buckets', 'data', {'bucket_name': 'data'})
+    assert StateTracker(state_file).state == {'buckets': {'logs': {'bucket_name': 'logs'}, 'data': {'bucket_name': 'data'}}}
+    tracker.close()
+    assert load_file(state_file) == {'buckets': {'logs': {'bucket_name': 'logs'}, 'data': {'bucket_name': 'data'}}}
+
+
+def test_without_a_journal_every_change_rewrites_the_snapshot(state_file):
+    tracker = StateTracker(state_file, journal=False)
+    tracker.update_resource_state('vpcs', 'main', {'vpc_id': 'vpc-1'})
+    assert not os.path.exists(tracker.journal_file)
+    assert load_file(state_file) == {'vpcs': {'main': {'vpc_id': 'vpc-1'}}}
+
+
+def test_accounts_get_state_files_of_their_own(state_file):
+    tracker = open_state_tracker(state_file, 'yaml', '111111111111-Audit')
+    assert tracker.state_file.endswith('state.111111111111-Audit.srstate')
+    tracker.close()
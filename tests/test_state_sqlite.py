@@ -0,0 +1,57 @@
+import os
+import pytest
+from state import open_state_tracker
+from state_sqlite import SqliteStateTracker
+
+
+@pytest.fixture
+def state_file(tmp_path):
+    return str(tmp_path / 'state.srstate.db')
+
+
+def test_extension_picks_the_sqlite_backend(state_file):
+    tracker = open_state_tracker(state_file)
+    assert isinstance(tracker, SqliteStateTracker)
+    tracker.close()
+
+
+def test_changes_persist_across_trackers(state_file):
+    tracker = SqliteStateTracker(state_file)
+    tracker.update_resource_state('buckets', 'logs', {'bucket_name': 'logs'})
+    tracker.update_resource_state('instances', 'web', {'instance_id': 'i-1'})
+    tracker.update_resource_state('instances', 'web', {'instance_id': 'i-2'})
+    tracker.remove_resource_state('buckets', 'logs')
+    tracker.close()
+
+    reopened = SqliteStateTracker(state_file)
+    assert reopened.state == {'instances': {'web': {'instance_id': 'i-2'}}}
+    assert reopened.resource_exists('instances', 'web')
+    assert not reopened.resource_exists('buckets', 'logs')
+    assert reopened.get_resource_state('buckets', 'logs') is None
+    reopened.close()
+
+
+def test_lookups_by_cloud_id_and_tag(state_file):
+    tracker = SqliteStateTracker(state_file)
+    tracker.update_resource_state('instances', 'web', {'instance_id': 'i-1', 'tags': {'env': 'prod'}})
+    tracker.update_resource_state('instances', 'db', {'instance_id': 'i-2', 'tags': [{'Key': 'env', 'Value': 'prod'}]})
+    tracker.update_resource_state('vpcs', 'main', {'vpc_id': 'vpc-1', 'tags': {'env': 'prod'}})
+
+    assert tracker.find_by_cloud_id('i-2') == ('instances', 'db', {'instance_id': 'i-2', 'tags': [{'Key': 'env', 'Value': 'prod'}]})
+    assert tracker.find_by_cloud_id('i-3') is None
+    assert sorted(name for _, name, _ in tracker.find_by_tag('env', 'prod')) == ['db', 'main', 'web']
+    assert sorted(name for _, name, _ in tracker.find_by_tag('env', 'prod', 'instances')) == ['db', 'web']
+
+    # New state replaces the old tags; removing a resource drops its tags with it.
+    tracker.update_resource_state('instances', 'web', {'instance_id': 'i-1', 'tags': {'env': 'dev'}})
+    tracker.remove_resource_state('instances', 'db')
+    assert [name for _, name, _ in tracker.find_by_tag('env', 'prod')] == ['main']
+    assert [name for _, name, _ in tracker.find_by_tag('env', 'dev')] == ['web']
+    tracker.close()
+
+
+def test_delete_state_file_removes_the_database(state_file):
+    tracker = SqliteStateTracker(state_file)
+    tracker.update_resource_state('buckets', 'logs', {'bucket_name': 'logs'})
+    tracker.delete_state_file()
+    assert not any(os.path.exists(state_file + suffix) for suffix in ('', '-wal', '-shm'))
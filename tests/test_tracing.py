@@ -0,0 +1,70 @@
+import json
+import pytest
+import tracing
+from tracing import NULL_SPAN, span, traced
+
+
+@pytest.fixture
+def tracer(monkeypatch):
+    monkeypatch.setattr(tracing, '_tracer', None)
+    return tracing.enable_tracing()
+
+
+def spans_by_name(tracer):
+    return {span.name: span for span in tracer.spans}
+
+
+def test_spans_are_free_while_tracing_is_off(monkeypatch):
+    monkeypatch.setattr(tracing, '_tracer', None)
+    assert span('provision') is NULL_SPAN
+    assert traced('work')(lambda x: x + 1)(1) == 2
+
+
+def test_spans_nest_across_engine_workers(tracer, engine):
+    @traced('create')
+    def create(name):
+        with span('call', resource=name):
+            return name
+
+    with span('provision') as root:
+        with span('stage', wave=0):
+            assert engine.map(create, ['a', 'b']) == ['a', 'b']
+        root.set(resources=2)
+
+    spans = spans_by_name(tracer)
+    assert spans['provision'].parent_id is None
+    assert spans['provision'].attributes == {'resources': 2}
+    assert spans['stage'].parent_id == spans['provision'].span_id
+    creates = [s for s in tracer.spans if s.name == 'create']
+    assert len(creates) == 2
+    assert all(s.parent_id == spans['stage'].span_id for s in creates)
+    assert {s.parent_id for s in tracer.spans if s.name == 'call'} == {s.span_id for s in creates}
+
+
+def test_failed_spans_record_the_error(tracer):
+    with pytest.raises(ValueError):
+        with span('create'):
+            raise ValueError('bad spec')
+    assert tracer.spans[0].attributes == {'error': 'bad spec'}
+    assert tracer.to_otlp()['resourceSpans'][0]['scopeSpans'][0]['spans'][0]['status'] == {'code': 2, 'message': 'bad spec'}
+
+
+def test_traces_are_written_in_chrome_and_otlp_formats(tracer, engine, tmp_path):
+    with span('provision'):
+        engine.map(traced('create')(lambda name: name), ['a'])
+
+    tracer.write(str(tmp_path / 'trace.json'))
+    with open(tmp_path / 'trace.json') as f:
+        events = json.load(f)['traceEvents']
+    complete = {event['name']: event for event in events if event['ph'] == 'X'}
+    assert complete['create']['args']['parent_id'] == complete['provision']['args']['span_id']
+    assert complete['create']['tid'] != complete['provision']['tid']
+    # The worker's span is linked to the span that scheduled it.
+    assert sorted(event['ph'] for event in events if event.get('cat') == 'flow') == ['f', 's']
+
+    tracer.write(str(tmp_path / 'trace.otlp.json'), 'otlp')
+    with open(tmp_path / 'trace.otlp.json') as f:
+        spans = {otlp_span['name']: otlp_span for otlp_span in json.load(f)['resourceSpans'][0]['scopeSpans'][0]['spans']}
+    assert spans['create']['parentSpanId'] == spans['provision']['spanId']
+    assert spans['create']['traceId'] == spans['provision']['traceId'] == tracer.trace_id
+    assert int(spans['provision']['startTimeUnixNano']) <= int(spans['create']['startTimeUnixNano'])
@@ -0,0 +1,15 @@
+from waiter import ReadinessWaiter
+
+
+# IDs are sent as filter values, which EC2 caps at 200 per filter.
+def test_instances_are_polled_within_the_filter_limit(fake_aws):
+    import clients
+    fake_aws.populate(450)
+    waiter = ReadinessWaiter(clients.get_client('ec2'), timeout=1)
+    for instance in fake_aws.instances:
+        waiter.add_instance(instance['InstanceId'])
+
+    assert waiter.MAX_IDS_PER_CALL == 200
+    assert waiter.wait()
+    assert fake_aws.calls['DescribeInstances'] == 3
+    assert all(resource['state'] == 'ready' for resource in waiter.resources.values())
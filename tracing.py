@@ -0,0 +1,195 @@
+import contextvars
+import functools
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+
+# Span tracing for provision runs, off unless --trace is given. A span's parent is
+# the span open in the calling context; the engine's worker pool and the state
+# writer thread run their work in a copy of the submitting context, so resources
+# created on workers nest under the stage that scheduled them.
+TRACE_FORMATS = ['chrome', 'otlp']
+
+_current = contextvars.ContextVar('sarmastack_span', default=None)
+
+
+class Span:
+    def __init__(self, tracer, span_id, name, parent, attributes):
+        self.tracer = tracer
+        self.span_id = span_id
+        self.name = name
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = attributes
+        self.thread = threading.current_thread()
+        self.start = time.perf_counter()
+        self.end = None
+        self.token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time.perf_counter()
+        if exc is not None:
+            self.attributes['error'] = str(exc)
+        _current.reset(self.token)
+        self.tracer.finish(self)
+        return False
+
+
+# Stands in for a span while tracing is off.
+class NullSpan:
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Tracer:
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.spans = []
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        # Span times are taken from perf_counter and placed on the wall clock
+        # through this pair of readings.
+        self.started = time.perf_counter()
+        self.started_ns = time.time_ns()
+
+    def span(self, name, **attributes):
+        return Span(self, next(self.ids), name, _current.get(), attributes)
+
+    def finish(self, span):
+        with self.lock:
+            self.spans.append(span)
+
+    def unix_ns(self, seconds):
+        return self.started_ns + int((seconds - self.started) * 1e9)
+
+    # Chrome trace event format, for chrome://tracing and Perfetto. Spans are
+    # complete ('X') events on the thread that ran them; a child started on another
+    # thread is linked to its parent with a flow arrow.
+    def to_chrome(self):
+        with self.lock:
+            spans = sorted(self.spans, key=lambda span: span.start)
+        pid = os.getpid()
+        by_id = {span.span_id: span for span in spans}
+        threads = {}
+        events = []
+        for span in spans:
+            if span.thread.ident not in threads:
+                threads[span.thread.ident] = len(threads) + 1
+                events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': threads[span.thread.ident],
+                               'args': {'name': span.thread.name}})
+            tid = threads[span.thread.ident]
+            ts = (span.start - self.started) * 1e6
+            events.append({
+                'name': span.name,
+                'cat': 'sarmastack',
+                'ph': 'X',
+                'ts': round(ts, 3),
+                'dur': round((span.end - span.start) * 1e6, 3),
+                'pid': pid,
+                'tid': tid,
+                'args': dict(span.attributes, span_id=span.span_id, parent_id=span.parent_id),
+            })
+            parent = by_id.get(span.parent_id)
+            if parent is not None and parent.thread.ident != span.thread.ident:
+                flow = {'name': 'schedule', 'cat': 'flow', 'id': span.span_id, 'pid': pid, 'ts': round(ts, 3)}
+                events.append(dict(flow, ph='s', tid=threads[parent.thread.ident]))
+                events.append(dict(flow, ph='f', bp='e', tid=tid))
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    # OTLP/JSON, as accepted by OpenTelemetry collectors and Jaeger's importer.
+    def to_otlp(self):
+        with self.lock:
+            spans = sorted(self.spans, key=lambda span: span.start)
+        otlp_spans = []
+        for span in spans:
+            otlp_span = {
+                'traceId': self.trace_id,
+                'spanId': f'{span.span_id:016x}',
+                'name': span.name,
+                'kind': 1,
+                'startTimeUnixNano': str(self.unix_ns(span.start)),
+                'endTimeUnixNano': str(self.unix_ns(span.end)),
+                'attributes': [otlp_attribute(key, value) for key, value in span.attributes.items()]
+                              + [otlp_attribute('thread.name', span.thread.name)],
+                'status': {'code': 2, 'message': span.attributes['error']} if 'error' in span.attributes else {},
+            }
+            if span.parent_id:
+                otlp_span['parentSpanId'] = f'{span.parent_id:016x}'
+            otlp_spans.append(otlp_span)
+        return {
+            'resourceSpans': [{
+                'resource': {'attributes': [otlp_attribute('service.name', 'sarmastack')]},
+                'scopeSpans': [{'scope': {'name': 'sarmastack'}, 'spans': otlp_spans}],
+            }]
+        }
+
+    # Written to a temporary file and moved into place, like snapshots.
+    def write(self, path, output_format='chrome'):
+        trace = self.to_otlp() if output_format == 'otlp' else self.to_chrome()
+        tmp_file = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(trace, f, default=str)
+        os.replace(tmp_file, path)
+
+    def finish_trace(self, path, output_format='chrome'):
+        self.write(path, output_format)
+        print(f"Wrote {len(self.spans)} trace spans to {path}", file=sys.stderr)
+
+
+def otlp_attribute(key, value):
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    if isinstance(value, float):
+        return {'key': key, 'value': {'doubleValue': value}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def enable_tracing():
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer()
+        return _tracer
+
+
+def span(name, **attributes):
+    if _tracer is None:
+        return NULL_SPAN
+    return _tracer.span(name, **attributes)
+
+
+# Runs every call of the decorated function in a span of its own.
+def traced(name):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return fn(*args, **kwargs)
+            with _tracer.span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,150 @@
+import json
+import urllib.parse
+from clients import lazy_client
+from create import CreateManager
+from executor import get_engine
+from network import NetworkManager
+from output import print_line
+
+# Applies an edited spec to a resource that already exists. Each method takes the
+# desired spec and the resource's current state, and returns the state to record.
+# Changes that AWS can only make by replacing the resource raise RuntimeError.
+class UpdateManager:
+    ec2_client = lazy_client('ec2')
+    iam_client = lazy_client('iam')
+
+    # IAM keeps at most this many versions of a managed policy.
+    MAX_POLICY_VERSIONS = 5
+
+    def __init__(self, engine=None, region=None):
+        self.engine = engine or get_engine()
+        self.region = region
+        self.network_manager = NetworkManager(self.engine, region)
+
+    def update_vpc(self, spec, resource_state):
+        self.check_cidr_block('VPC', resource_state['vpc_id'], spec, resource_state)
+        if spec.get('enable_dns_hostnames'):
+            self.network_manager.enable_vpc_dns_hostnames(resource_state['vpc_id'])
+        return dict(resource_state)
+
+    def update_subnet(self, spec, resource_state):
+        self.check_cidr_block('Subnet', resource_state['subnet_id'], spec, resource_state)
+        return dict(resource_state)
+
+    def update_internet_gateway(self, spec, resource_state):
+        return dict(resource_state)
+
+    def update_route_table(self, spec, resource_state):
+        self.network_manager.apply_routes(resource_state['route_table_id'], spec)
+        return dict(resource_state)
+
+    @staticmethod
+    def check_cidr_block(label, resource_id, spec, resource_state):
+        if resource_state.get('cidr_block') and spec.get('cidr_block') != resource_state['cidr_block']:
+            raise RuntimeError(f"{label} {resource_id} cannot change its CIDR block; delete it and provision again.")
+
+    def update_instance(self, spec, resource_state):
+        instance_id = resource_state['instance_id']
+        response = self.ec2_client.describe_instances(InstanceIds=[instance_id])
+        instance = response['Reservations'][0]['Instances'][0]
+
+        for key, live_key in [('image_id', 'ImageId'), ('subnet_id', 'SubnetId')]:
+            if spec.get(key) and spec[key] != instance.get(live_key):
+                raise RuntimeError(f"Changing {key} of instance {instance_id} requires replacing it; delete the instance and provision again.")
+
+        instance_type = spec.get('instance_type')
+        if instance_type and instance_type != instance['InstanceType']:
+            # The instance type can only be changed while the instance is stopped.
+            running = instance['State']['Name'] in ('pending', 'running')
+            if running:
+                self.ec2_client.stop_instances(InstanceIds=[instance_id])
+                self.ec2_client.get_waiter('instance_stopped').wait(InstanceIds=[instance_id])
+            self.ec2_client.modify_instance_attribute(InstanceId=instance_id, InstanceType={'Value': instance_type})
+            if running:
+                self.ec2_client.start_instances(InstanceIds=[instance_id])
+            print_line(f"Changed instance {instance_id} type to {instance_type}")
+        return dict(resource_state)
+
+    def update_bucket(self, spec, resource_state):
+        region = spec.get('region')
+        if resource_state.get('region') and region != resource_state['region']:
+            raise RuntimeError(f"Bucket {resource_state['bucket_name']} cannot be moved to another region.")
+        return dict(resource_state, region=region)
+
+    def update_iam_user(self, spec, resource_state):
+        return dict(resource_state)
+
+    # A role is also updated when only something it depends on changed, so the trust
+    # policy is compared with the live one first.
+    def update_iam_role(self, spec, resource_state):
+        role_name = spec.get('role_name')
+        assume_role_policy = spec.get('assume_role_policy')
+        if assume_role_policy is None:
+            return dict(resource_state)
+        role = self.iam_client.get_role(RoleName=role_name)['Role']
+        if self.same_document(role.get('AssumeRolePolicyDocument'), assume_role_policy):
+            return dict(resource_state)
+        self.iam_client.update_assume_role_policy(
+            RoleName=role_name,
+            PolicyDocument=json.dumps(assume_role_policy)
+        )
+        print_line(f"Updated assume role policy of IAM role: {role_name}")
+        return dict(resource_state)
+
+    # Publishes the document as the new default version, unless it already is the
+    # default one (dropping the oldest version when IAM's version limit is
+    # reached). Then brings the attachments in line with 'roles' and 'users':
+    # missing ones are attached and ones no longer listed are detached.
+    def update_iam_policy(self, spec, resource_state):
+        policy_arn = resource_state['arn']
+        document = CreateManager.read_policy_document(spec['policy_document'])
+        default_version = self.iam_client.get_policy(PolicyArn=policy_arn)['Policy']['DefaultVersionId']
+        current = self.iam_client.get_policy_version(PolicyArn=policy_arn, VersionId=default_version)['PolicyVersion']
+        if not self.same_document(current.get('Document'), document):
+            versions = self.iam_client.list_policy_versions(PolicyArn=policy_arn)['Versions']
+            if len(versions) >= self.MAX_POLICY_VERSIONS:
+                oldest = min((version for version in versions if not version['IsDefaultVersion']),
+                             key=lambda version: version['CreateDate'])
+                self.iam_client.delete_policy_version(PolicyArn=policy_arn, VersionId=oldest['VersionId'])
+
+            self.iam_client.create_policy_version(
+                PolicyArn=policy_arn,
+                PolicyDocument=document,
+                SetAsDefault=True
+            )
+            print_line(f"Updated IAM policy: {spec['policy_name']}")
+
+        attached_roles, attached_users = set(), set()
+        for page in self.iam_client.get_paginator('list_entities_for_policy').paginate(PolicyArn=policy_arn):
+            attached_roles.update(role['RoleName'] for role in page.get('PolicyRoles', []))
+            attached_users.update(user['UserName'] for user in page.get('PolicyUsers', []))
+        roles = set(spec.get('roles') or [])
+        users = set(spec.get('users') or [])
+
+        for role_name in sorted(roles - attached_roles):
+            self.iam_client.attach_role_policy(RoleName=role_name, PolicyArn=policy_arn)
+            print_line(f"Attached IAM policy {spec['policy_name']} to role {role_name}")
+        for role_name in sorted(attached_roles - roles):
+            self.iam_client.detach_role_policy(RoleName=role_name, PolicyArn=policy_arn)
+            print_line(f"Detached IAM policy {spec['policy_name']} from role {role_name}")
+        for user_name in sorted(users - attached_users):
+            self.iam_client.attach_user_policy(UserName=user_name, PolicyArn=policy_arn)
+            print_line(f"Attached IAM policy {spec['policy_name']} to user {user_name}")
+        for user_name in sorted(attached_users - users):
+            self.iam_client.detach_user_policy(UserName=user_name, PolicyArn=policy_arn)
+            print_line(f"Detached IAM policy {spec['policy_name']} from user {user_name}")
+        return dict(resource_state)
+
+    # IAM hands documents back already decoded; specs may hold them as dicts or as
+    # JSON text.
+    @staticmethod
+    def same_document(live, desired):
+        def parse(document):
+            if isinstance(document, str):
+                for text in (document, urllib.parse.unquote(document)):
+                    try:
+                        return json.loads(text)
+                    except ValueError:
+                        pass
+            return document
+        return parse(live) == parse(desired)
@@ -0,0 +1,110 @@
+import random
+import time
+from tabulate import tabulate
+from output import print_line
+from plan import Planner
+
+class ReadinessWaiter:
+    # describe_instances and describe_vpcs are asked about at most this many IDs per
+    # call. The IDs go in a filter, and EC2 accepts no more values than this in one.
+    MAX_IDS_PER_CALL = Planner.MAX_FILTER_VALUES
+
+    def __init__(self, ec2_client, s3_client=None, timeout=900, base_interval=2, max_interval=30):
+        self.ec2_client = ec2_client
+        self.s3_client = s3_client
+        self.timeout = timeout
+        self.base_interval = base_interval
+        self.max_interval = max_interval
+        self.resources = {}
+
+    def add_instance(self, instance_id, name=None):
+        self._add('instance', instance_id, name)
+
+    def add_bucket(self, bucket_name):
+        self._add('bucket', bucket_name, bucket_name)
+
+    def add_vpc(self, vpc_id, name=None):
+        self._add('vpc', vpc_id, name)
+
+    def _add(self, resource_type, resource_id, name):
+        self.resources[(resource_type, resource_id)] = {
+            'name': name or resource_id,
+            'state': 'pending',
+            'added': time.monotonic(),
+            'ready': None,
+        }
+
+    def pending(self, resource_type):
+        return [resource_id for (kind, resource_id), resource in self.resources.items()
+                if kind == resource_type and resource['ready'] is None and resource['state'] == 'pending']
+
+    # Polls every pending resource once per tick, with one call per resource type
+    # (per MAX_IDS_PER_CALL IDs), backing off exponentially with full jitter.
+    def wait(self):
+        deadline = time.monotonic() + self.timeout
+        tick = 0
+        while True:
+            self.poll_instances()
+            self.poll_vpcs()
+            self.poll_buckets()
+
+            if not any(self.pending(kind) for kind in ('instance', 'vpc', 'bucket')):
+                return True
+            if time.monotonic() >= deadline:
+                for resource in self.resources.values():
+                    if resource['ready'] is None and resource['state'] == 'pending':
+                        resource['state'] = 'timed out'
+                return False
+
+            interval = min(self.max_interval, self.base_interval * 2 ** tick)
+            time.sleep(min(random.uniform(interval / 2, interval), max(0, deadline - time.monotonic())))
+            tick += 1
+
+    def poll_instances(self):
+        pending = self.pending('instance')
+        for i in range(0, len(pending), self.MAX_IDS_PER_CALL):
+            chunk = pending[i:i + self.MAX_IDS_PER_CALL]
+            # Filtering by instance-id (rather than InstanceIds=) tolerates IDs that
+            # are not visible yet right after run_instances.
+            paginator = self.ec2_client.get_paginator('describe_instances')
+            for page in paginator.paginate(Filters=[{'Name': 'instance-id', 'Values': chunk}]):
+                for reservation in page['Reservations']:
+                    for instance in reservation['Instances']:
+                        state = instance['State']['Name']
+                        if state == 'running':
+                            self.mark_ready('instance', instance['InstanceId'])
+                        elif state in ('shutting-down', 'terminated', 'stopping', 'stopped'):
+                            self.resources[('instance', instance['InstanceId'])]['state'] = state
+
+    def poll_vpcs(self):
+        pending = self.pending('vpc')
+        for i in range(0, len(pending), self.MAX_IDS_PER_CALL):
+            chunk = pending[i:i + self.MAX_IDS_PER_CALL]
+            paginator = self.ec2_client.get_paginator('describe_vpcs')
+            for page in paginator.paginate(Filters=[{'Name': 'vpc-id', 'Values': chunk}]):
+                for vpc in page['Vpcs']:
+                    if vpc['State'] == 'available':
+                        self.mark_ready('vpc', vpc['VpcId'])
+
+    def poll_buckets(self):
+        pending = self.pending('bucket')
+        if pending:
+            names = {bucket['Name'] for bucket in self.s3_client.list_buckets()['Buckets']}
+            for bucket_name in pending:
+                if bucket_name in names:
+                    self.mark_ready('bucket', bucket_name)
+
+    def mark_ready(self, resource_type, resource_id):
+        resource = self.resources.get((resource_type, resource_id))
+        if resource and resource['ready'] is None:
+            resource['ready'] = time.monotonic()
+            resource['state'] = 'ready'
+
+    def report(self):
+        table_data = []
+        for (resource_type, resource_id), resource in self.resources.items():
+            seconds = f"{resource['ready'] - resource['added']:.1f}" if resource['ready'] else '-'
+            table_data.append([resource_type, resource['name'], resource_id, resource['state'], seconds])
+        if table_data:
+            headers = ['Type', 'Name', 'ID', 'State', 'Seconds to Ready']
+            print_line(tabulate(table_data, headers, tablefmt="fancy_grid"))
@@ -0,0 +1,102 @@
+import hashlib
+import marshal
+import os
+import stat as stat_module
+import yaml
+
+# libyaml's C loader and dumper are many times faster than the pure-Python ones;
+# PyYAML builds without libyaml fall back to the latter.
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+SafeDumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+# Parsed documents are cached with marshal, keyed by the file's absolute path and
+# checked against its mtime and size, so commands run again on an unchanged file
+# skip YAML parsing. Unlike pickle, loading marshal data never runs code; entries
+# are still only read from a directory nobody else can write to (see
+# private_dir). Documents marshal cannot hold (timestamps) are not cached.
+# SARMASTACK_YAML_CACHE=0 turns the cache off.
+CACHE_DIR = os.environ.get('SARMASTACK_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'sarmastack', 'yaml'))
+CACHE_ENABLED = os.environ.get('SARMASTACK_YAML_CACHE', '1') != '0'
+
+
+def safe_load(stream):
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+def safe_dump(data, stream=None):
+    return yaml.dump(data, stream, Dumper=SafeDumper)
+
+
+def load_file(path):
+    stat = os.stat(path)
+    data = read_cache(path, stat)
+    if data is not None:
+        return data[0]
+    with open(path, 'r') as f:
+        document = safe_load(f)
+    write_cache(path, stat, document)
+    return document
+
+
+def cache_path(path):
+    return os.path.join(CACHE_DIR, hashlib.sha256(os.path.abspath(path).encode()).hexdigest() + '.marshal')
+
+
+# Creates directory (mode 0700) if needed and tells whether it is safe to keep
+# cache files in: owned by the current user and not writable by group or others.
+# Where ownership cannot be checked (no os.getuid), any directory is accepted.
+def private_dir(directory, create=False):
+    try:
+        if create:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        info = os.stat(directory)
+    except OSError:
+        return False
+    if not stat_module.S_ISDIR(info.st_mode):
+        return False
+    if hasattr(os, 'getuid') and (info.st_uid != os.getuid() or info.st_mode & 0o022):
+        return False
+    return True
+
+
+# Returns (document,) on a hit and None on a miss; a corrupt or unreadable cache
+# entry, or one in a directory others can write to, is a miss.
+def read_cache(path, stat):
+    if not CACHE_ENABLED or not private_dir(CACHE_DIR):
+        return None
+    try:
+        with open(cache_path(path), 'rb') as f:
+            mtime_ns, size, document = marshal.load(f)
+    except Exception:
+        return None
+    if mtime_ns != stat.st_mtime_ns or size != stat.st_size:
+        return None
+    return (document,)
+
+
+def write_cache(path, stat, document):
+    if not CACHE_ENABLED:
+        return
+    try:
+        data = marshal.dumps((stat.st_mtime_ns, stat.st_size, document))
+    except ValueError:
+        return
+    if not private_dir(CACHE_DIR, create=True):
+        return
+    target = cache_path(path)
+    tmp_file = f"{target}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_file, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_file, target)
+    except OSError:
+        # The cache is only an optimization; a read-only home directory is fine.
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+def clear_cache():
+    if os.path.isdir(CACHE_DIR):
+        for name in os.listdir(CACHE_DIR):
+            if name.endswith(('.marshal', '.pickle')):
+                os.remove(os.path.join(CACHE_DIR, name))